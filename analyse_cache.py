@@ -0,0 +1,163 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from messung import messungen
+
+# Zweite Ebene auf der Platte, überlebt Neustarts der App; leer setzen schaltet sie ab
+ANALYSE_CACHE_DIR = os.environ.get("EKG_ANALYSE_CACHE", os.path.join("data", "cache", "analyse"))
+
+# Obergrenze für die im Prozess gehaltenen Ergebnisse (Peaks, RR-Intervalle, Anomalien)
+MAX_BYTES = 64 * 1024 * 1024
+
+# Obergrenze für die .npz-Dateien der zweiten Ebene; darüber werden die am längsten nicht genutzten gelöscht
+MAX_PLATTE_BYTES = int(os.environ.get("EKG_ANALYSE_CACHE_MAX_MB", 256)) * 1024 * 1024
+
+
+def _groesse(wert):
+    """Schätzt den Speicherbedarf eines Cache-Eintrags in Bytes."""
+    if isinstance(wert, np.ndarray):
+        return wert.nbytes
+    if hasattr(wert, "memory_usage"):
+        # pandas-DataFrame oder -Series
+        return int(np.sum(wert.memory_usage()))
+    if isinstance(wert, (list, tuple)):
+        return 64 + sum(_groesse(w) for w in wert)
+    if hasattr(wert, "__dict__"):
+        return sum(_groesse(w) for w in vars(wert).values())
+    return 64
+
+
+class AnalyseCache:
+    """Speichert Analyseergebnisse unter einem Schlüssel aus Inhalts-Hash der Aufnahme und Parametern.
+    Die erste Ebene ist ein LRU-Dictionary im Prozess mit Größenbegrenzung, die zweite (optional)
+    je Schlüssel eine .npz-Datei, aus der nach einem Neustart wieder gelesen wird. Die Dateien sind zusammen
+    höchstens max_platte_bytes groß: wird es mehr, fallen die ältesten weg (ein Treffer zählt als Nutzung).
+
+    Die zurückgegebenen Objekte werden geteilt und dürfen nicht verändert werden."""
+
+    def __init__(self, max_bytes=MAX_BYTES, verzeichnis=ANALYSE_CACHE_DIR, max_platte_bytes=MAX_PLATTE_BYTES):
+        self.max_bytes = max_bytes
+        self.verzeichnis = verzeichnis or None
+        self.max_platte_bytes = max_platte_bytes
+        self._eintraege = OrderedDict()
+        self._bytes = 0
+        # Summe der Dateigrößen, beim ersten Schreiben aus dem Verzeichnis gelesen (andere Prozesse schreiben mit)
+        self._platte_bytes = None
+        self._lock = threading.Lock()
+        self.treffer = 0
+        self.fehlschlaege = 0
+
+    def hole(self, schluessel):
+        """Gibt den Eintrag zum Schlüssel zurück oder None (nur Speicherebene)."""
+        with self._lock:
+            eintrag = self._eintraege.get(schluessel)
+            if eintrag is None:
+                self.fehlschlaege += 1
+                messungen.zaehle("analyse_cache.fehlschlaege")
+                return None
+            self._eintraege.move_to_end(schluessel)
+            self.treffer += 1
+            messungen.zaehle("analyse_cache.treffer")
+            return eintrag[0]
+
+    def lege_ab(self, schluessel, wert):
+        """Legt einen Eintrag in der Speicherebene ab und verdrängt bei Bedarf die ältesten."""
+        groesse = _groesse(wert)
+        with self._lock:
+            alt = self._eintraege.pop(schluessel, None)
+            if alt is not None:
+                self._bytes -= alt[1]
+            if groesse > self.max_bytes:
+                return
+            self._eintraege[schluessel] = (wert, groesse)
+            self._bytes += groesse
+            while self._bytes > self.max_bytes:
+                _, (_, verdraengt) = self._eintraege.popitem(last=False)
+                self._bytes -= verdraengt
+
+    def _datei(self, schluessel):
+        name = hashlib.sha1(repr(schluessel).encode("utf-8")).hexdigest()
+        return os.path.join(self.verzeichnis, f"{name}.npz")
+
+    def hole_arrays(self, schluessel):
+        """Liest die Arrays eines Eintrags von der Platte oder None, falls keine vorhanden sind."""
+        if self.verzeichnis is None:
+            return None
+        datei = self._datei(schluessel)
+        try:
+            with np.load(datei) as daten:
+                arrays = {name: daten[name] for name in daten.files}
+            # Änderungszeit = letzte Nutzung, damit beim Aufräumen zuerst lange nicht genutzte Dateien gehen
+            os.utime(datei)
+        except (OSError, ValueError, KeyError):
+            return None
+        messungen.zaehle("analyse_cache.platte_treffer")
+        return arrays
+
+    def lege_arrays_ab(self, schluessel, **arrays):
+        """Schreibt die Arrays eines Eintrags atomar auf die Platte (Fehler werden ignoriert) und räumt auf,
+        wenn die Dateien zusammen größer als max_platte_bytes werden."""
+        if self.verzeichnis is None:
+            return
+        ziel = self._datei(schluessel)
+        tmp = f"{ziel}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.verzeichnis, exist_ok=True)
+            with open(tmp, "wb") as f:
+                np.savez(f, **arrays)
+            groesse = os.path.getsize(tmp)
+            os.replace(tmp, ziel)
+        except OSError:
+            return
+        with self._lock:
+            if self._platte_bytes is None:
+                self._platte_bytes = sum(groesse for _, _, groesse in self._dateien())
+            else:
+                self._platte_bytes += groesse
+            if self._platte_bytes > self.max_platte_bytes:
+                self._aufraeumen()
+
+    def _dateien(self):
+        """Gibt (Änderungszeit, Pfad, Größe) aller .npz-Dateien der zweiten Ebene zurück."""
+        dateien = []
+        try:
+            eintraege = list(os.scandir(self.verzeichnis))
+        except OSError:
+            return dateien
+        for eintrag in eintraege:
+            if not eintrag.name.endswith(".npz"):
+                continue
+            try:
+                stat = eintrag.stat()
+            except OSError:
+                continue
+            dateien.append((stat.st_mtime_ns, eintrag.path, stat.st_size))
+        return dateien
+
+    def _aufraeumen(self):
+        """Löscht die ältesten Dateien, bis die zweite Ebene wieder unter max_platte_bytes liegt."""
+        dateien = sorted(self._dateien())
+        self._platte_bytes = sum(groesse for _, _, groesse in dateien)
+        for _, pfad, groesse in dateien:
+            if self._platte_bytes <= self.max_platte_bytes:
+                break
+            try:
+                os.remove(pfad)
+            except OSError:
+                continue
+            self._platte_bytes -= groesse
+            messungen.zaehle("analyse_cache.platte_verdraengt")
+
+    def leeren(self):
+        """Verwirft die Speicherebene (die Dateien bleiben erhalten)."""
+        with self._lock:
+            self._eintraege.clear()
+            self._bytes = 0
+
+
+# Gemeinsame Instanz für die ganze App; bleibt über Streamlit-Reruns im Speicher
+analyse_cache = AnalyseCache()
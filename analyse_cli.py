@@ -0,0 +1,129 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from ekg_batch import ANALYSE_KENNUNG, alter_bei_aufnahme, analysiere_ekg
+from ekg_cache import datei_hash
+from ekg_jobs import ist_fertig
+from ergebnis_speicher import ERGEBNIS_DIR, ErgebnisSpeicher
+from read_data import load_person_data
+
+
+def _auftraege(personen, bisher, speicher, erzwingen, ausgabe=sys.stderr):
+    """Stellt die Aufträge zusammen und überspringt EKGs, deren Datei sich seit dem letzten Lauf nicht geändert hat
+    und die mit derselben Analyseversion ausgewertet wurden (ältere Ergebnisse ohne Analyseversion gelten als veraltet).
+    Fehlt die Datei eines EKGs, wird es gemeldet und übersprungen, statt den ganzen Lauf abzubrechen.
+
+        Output:
+        Tupel (Liste neuer Aufträge, Anzahl übersprungener EKGs)."""
+    bekannt = {}
+    if not bisher.empty:
+        bekannt = bisher.set_index("ekg_id").reindex(
+            columns=["sha256", "mtime_ns", "groesse", "analyse_version"]).to_dict("index")
+
+    auftraege, uebersprungen = [], 0
+    for person_dict in personen:
+        for ekg_dict in person_dict.get("ekg_tests", []):
+            if not ist_fertig(ekg_dict):
+                # Upload wird noch verarbeitet oder ist fehlgeschlagen
+                continue
+            try:
+                stat = os.stat(ekg_dict["result_link"])
+            except OSError as fehler:
+                print(f"EKG {ekg_dict['id']}: Datei nicht lesbar, übersprungen ({fehler})", file=ausgabe)
+                uebersprungen += 1
+                continue
+            alt = bekannt.get(ekg_dict["id"])
+            vorhanden = (alt is not None and alt["analyse_version"] == ANALYSE_KENNUNG
+                         and os.path.exists(speicher.beats_pfad(ekg_dict["id"])))
+            if vorhanden and not erzwingen and (alt["mtime_ns"], alt["groesse"]) == (stat.st_mtime_ns, stat.st_size):
+                uebersprungen += 1
+                continue
+            sha256 = datei_hash(ekg_dict["result_link"])
+            if vorhanden and not erzwingen and alt["sha256"] == sha256:
+                # Nur die Änderungszeit ist neu -> merken, damit beim nächsten Lauf nicht erneut gehasht wird
+                zeile = bisher["ekg_id"] == ekg_dict["id"]
+                bisher.loc[zeile, "mtime_ns"] = stat.st_mtime_ns
+                bisher.loc[zeile, "groesse"] = stat.st_size
+                uebersprungen += 1
+                continue
+            auftraege.append({
+                "person_id": person_dict["id"],
+                "alter": alter_bei_aufnahme(person_dict, ekg_dict),
+                "ekg": ekg_dict,
+                "sha256": sha256,
+                "mtime_ns": stat.st_mtime_ns,
+                "groesse": stat.st_size})
+    return auftraege, uebersprungen
+
+
+def analysiere_datenbank(verzeichnis=ERGEBNIS_DIR, jobs=None, format="parquet", erzwingen=False, ausgabe=sys.stderr):
+    """Analysiert alle EKGs aller Personen parallel und schreibt die Ergebnistabellen.
+
+        Input:
+        verzeichnis (str, optional): Zielverzeichnis der Tabellen.
+        jobs (int, optional): Anzahl paralleler Prozesse (Standard: Anzahl CPUs).
+        format (str, optional): "parquet" oder "csv".
+        erzwingen (bool, optional): Auch unveränderte EKGs neu auswerten.
+
+        Output:
+        DataFrame mit der Zusammenfassung aller EKGs."""
+    speicher = ErgebnisSpeicher(verzeichnis, format)
+    bisher = speicher.zusammenfassung()
+    personen = load_person_data()
+    gueltige_ids = {ekg["id"] for p in personen for ekg in p.get("ekg_tests", [])}
+
+    auftraege, uebersprungen = _auftraege(personen, bisher, speicher, erzwingen, ausgabe)
+    print(f"{len(auftraege)} EKGs werden ausgewertet, {uebersprungen} übersprungen.", file=ausgabe)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(analysiere_ekg, auftrag): auftrag for auftrag in auftraege}
+        for nummer, future in enumerate(as_completed(futures), start=1):
+            ekg_id = futures[future]["ekg"]["id"]
+            try:
+                zusammenfassung, beats = future.result()
+            except Exception as fehler:
+                print(f"[{nummer}/{len(auftraege)}] EKG {ekg_id}: Fehler: {fehler}", file=ausgabe)
+                continue
+            speicher.schreibe_beats(ekg_id, beats)
+            speicher.schreibe_zeile(zusammenfassung)
+            print(f"[{nummer}/{len(auftraege)}] EKG {ekg_id}: {zusammenfassung['anzahl_beats']} Schläge, "
+                  f"{time.perf_counter() - start:.1f} s", file=ausgabe)
+
+    # Bisherige Zeilen mit den in diesem Lauf abgelegten zusammenführen (neue ersetzen alte), gelöschte EKGs entfernen
+    neu = speicher.zeilen()
+    gesamt = pd.concat([bisher, neu], ignore_index=True) if not bisher.empty else neu
+    if not gesamt.empty:
+        gesamt = gesamt.drop_duplicates("ekg_id", keep="last")
+        gesamt = gesamt[gesamt["ekg_id"].isin(gueltige_ids)]
+        gesamt = gesamt.sort_values("ekg_id", ignore_index=True)
+        speicher.schreibe_zusammenfassung(gesamt)
+    return gesamt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Wertet alle EKGs der Personendatenbank ohne Browser aus.")
+    parser.add_argument("--jobs", type=int, default=None, help="Anzahl paralleler Prozesse (Standard: Anzahl CPUs)")
+    parser.add_argument("--out", default=ERGEBNIS_DIR, help=f"Zielverzeichnis (Standard: {ERGEBNIS_DIR})")
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet", help="Dateiformat der Tabellen")
+    parser.add_argument("--force", action="store_true", help="Auch unveränderte EKGs neu auswerten")
+    args = parser.parse_args(argv)
+
+    if args.format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("pyarrow ist nicht installiert, Ergebnisse werden als CSV geschrieben.", file=sys.stderr)
+            args.format = "csv"
+
+    gesamt = analysiere_datenbank(args.out, args.jobs, args.format, args.force)
+    print(f"Zusammenfassung mit {len(gesamt)} EKGs in {args.out}")
+
+
+if __name__ == "__main__":
+    main()
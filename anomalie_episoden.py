@@ -0,0 +1,168 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+# Relative Änderung zum vorherigen RR-Intervall, ab der ein Sprung gemeldet wird (wie bei RRIntervalle.qualitaet)
+RR_SPRUNG_ANTEIL = 0.3
+
+# Ein Intervall länger als AUSSETZER_FAKTOR x gleitender Median (über MEDIAN_SCHLAEGE Intervalle) gilt als ausgelassener Schlag
+AUSSETZER_FAKTOR = 1.75
+MEDIAN_SCHLAEGE = 9
+
+# Mindestdauer, ab der ein konstantes Signal (z.B. abgefallene Elektrode) als Nulllinie gilt
+FLATLINE_MS = 1000
+
+SPALTEN = ["Art", "Beginn in ms", "Ende in ms", "Dauer in ms", "Schläge", "min bpm", "max bpm"]
+
+# Farbe je Art für die Darstellung im EKG-Plot
+FARBEN = {
+    "Tachykardie": "red",
+    "Bradykardie": "orange",
+    "RR-Sprung": "gold",
+    "Ausgelassener Schlag": "purple",
+    "Nulllinie": "gray"}
+
+
+def _laeufe(maske):
+    """Gibt Anfang und Ende (exklusiv) aller zusammenhängenden True-Bereiche einer Maske zurück."""
+    kanten = np.diff(np.concatenate(([0], maske.astype(np.int8), [0])))
+    return np.flatnonzero(kanten == 1), np.flatnonzero(kanten == -1)
+
+
+def episoden_aus_maske(art, maske, beginn, ende, bpm=None):
+    """Fasst aufeinanderfolgende auffällige Intervalle zu Episoden zusammen.
+
+        Input:
+        art (str): Name der Regel, z.B. "Tachykardie".
+        maske: Boolesches Array, True für auffällige Intervalle.
+        beginn, ende: Anfangs- und Endzeit jedes Intervalls in ms.
+        bpm (optional): Herzfrequenz jedes Intervalls für min/max bpm.
+
+        Output:
+        DataFrame mit einer Zeile pro Episode (Spalten siehe SPALTEN)."""
+    anfang, schluss = _laeufe(np.asarray(maske, dtype=bool))
+    anzahl = schluss - anfang
+    if bpm is not None and len(anfang):
+        # min/max pro Episode über die hintereinandergelegten auffälligen Werte
+        werte = np.asarray(bpm, dtype=np.float64)[maske]
+        versatz = np.concatenate(([0], np.cumsum(anzahl)[:-1]))
+        min_bpm, max_bpm = np.minimum.reduceat(werte, versatz), np.maximum.reduceat(werte, versatz)
+    else:
+        min_bpm = max_bpm = np.full(len(anfang), np.nan)
+    t0 = np.asarray(beginn, dtype=np.float64)[anfang]
+    t1 = np.asarray(ende, dtype=np.float64)[schluss - 1]
+    return pd.DataFrame({
+        "Art": pd.Series([art] * len(anfang), dtype=str),
+        "Beginn in ms": t0,
+        "Ende in ms": t1,
+        "Dauer in ms": t1 - t0,
+        "Schläge": anzahl,
+        "min bpm": min_bpm,
+        "max bpm": max_bpm}, columns=SPALTEN)
+
+
+def flatline_episoden(werte, zeit, min_dauer_ms=FLATLINE_MS):
+    """Sucht Abschnitte, in denen das Signal mindestens min_dauer_ms lang konstant ist.
+
+        Input:
+        werte: Messwerte.
+        zeit: Zeitpunkte der Messwerte in ms.
+        min_dauer_ms (int, optional): Mindestdauer einer Nulllinie.
+
+        Output:
+        DataFrame mit einer Zeile pro Nulllinie (Spalten siehe SPALTEN)."""
+    werte, zeit = np.asarray(werte), np.asarray(zeit, dtype=np.float64)
+    # Maske über die Abstände zwischen zwei Messwerten: True, wenn sich der Wert nicht ändert
+    gleich = (werte[1:] == werte[:-1]) & (zeit[1:] > zeit[:-1])
+    episoden = episoden_aus_maske("Nulllinie", gleich, zeit[:-1], zeit[1:])
+    episoden = episoden[episoden["Dauer in ms"] >= min_dauer_ms].copy()
+    # Bei einer Nulllinie zählen keine Schläge
+    episoden["Schläge"] = 0
+    return episoden.reset_index(drop=True)
+
+
+def anomalie_episoden(rr, alter, min_hr=40, flatline=None):
+    """Erkennt Anomalien als Episoden statt als einzelne Schläge. Alle Regeln sind Masken über die
+    RR-Intervalle, aufeinanderfolgende auffällige Intervalle einer Regel werden zusammengefasst:
+
+    - Tachykardie / Bradykardie: Herzfrequenz über 220 - alter bzw. unter min_hr
+    - RR-Sprung: Intervall weicht um mehr als RR_SPRUNG_ANTEIL vom vorherigen ab
+    - Ausgelassener Schlag: Intervall länger als AUSSETZER_FAKTOR x gleitender Median
+
+    Intervalle über einen Zeitsprung der Aufnahme hinweg zählen nicht, sie trennen Episoden.
+
+        Input:
+        rr (RRIntervalle): RR-Intervalle der Aufnahme.
+        alter: Alter der Person für max Herzfrequenzberechnung.
+        min_hr: Minimale Herzfrequenz.
+        flatline (optional): Nulllinien aus flatline_episoden, werden mit ausgegeben.
+
+        Output:
+        DataFrame mit einer Zeile pro Episode, nach Beginn sortiert (Spalten siehe SPALTEN)."""
+    intervalle = rr.intervalle.astype(np.float64)
+    gueltig = rr.gueltig
+    beginn, ende = rr.peak_zeiten[:-1], rr.peak_zeiten[1:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bpm = np.where(gueltig, 60000 / intervalle, np.nan)
+
+    episoden = [
+        episoden_aus_maske("Tachykardie", gueltig & (bpm > 220 - alter), beginn, ende, bpm),
+        episoden_aus_maske("Bradykardie", gueltig & (bpm < min_hr), beginn, ende, bpm)]
+
+    if len(intervalle) > 1:
+        median = pd.Series(np.where(gueltig, intervalle, np.nan)).rolling(
+            MEDIAN_SCHLAEGE, center=True, min_periods=1).median().to_numpy()
+        aussetzer = gueltig & (intervalle > AUSSETZER_FAKTOR * median)
+
+        # Sprung nur zwischen zwei gültigen Nachbarn; die Sprünge in einen Aussetzer hinein und wieder heraus
+        # sind schon über den Aussetzer gemeldet
+        sprung = np.zeros(len(intervalle), dtype=bool)
+        sprung[1:] = gueltig[1:] & gueltig[:-1] & (np.abs(np.diff(intervalle)) > RR_SPRUNG_ANTEIL * intervalle[:-1])
+        sprung[1:] &= ~aussetzer[:-1]
+        sprung &= ~aussetzer
+
+        episoden.append(episoden_aus_maske("RR-Sprung", sprung, beginn, ende, bpm))
+        episoden.append(episoden_aus_maske("Ausgelassener Schlag", aussetzer, beginn, ende, bpm))
+
+    if flatline is not None:
+        episoden.append(flatline)
+    episoden = [e for e in episoden if len(e)]
+    if not episoden:
+        return pd.DataFrame({spalte: [] for spalte in SPALTEN}, columns=SPALTEN)
+    return pd.concat(episoden, ignore_index=True).sort_values("Beginn in ms", kind="stable", ignore_index=True)
+
+
+def als_arrays(episoden):
+    """Wandelt Episoden in einfache Arrays für die Plattenebene des Analyse-Caches (ohne Pickle)."""
+    return {f"spalte_{i}": episoden[spalte].to_numpy(dtype=str if spalte == "Art" else np.float64)
+            for i, spalte in enumerate(SPALTEN)}
+
+
+def aus_arrays(arrays):
+    """Gegenstück zu als_arrays."""
+    episoden = pd.DataFrame({spalte: arrays[f"spalte_{i}"] for i, spalte in enumerate(SPALTEN)}, columns=SPALTEN)
+    episoden["Art"] = episoden["Art"].astype(str)
+    episoden["Schläge"] = episoden["Schläge"].astype(np.int64)
+    return episoden
+
+
+def episoden_spuren(episoden, y_min, y_max):
+    """Erzeugt die Hervorhebung der Episoden als eine gefüllte Fläche pro Art statt einer Form pro Episode,
+    damit der Plot unabhängig von der Anzahl der Episoden schnell bleibt.
+
+        Input:
+        episoden: DataFrame aus anomalie_episoden.
+        y_min, y_max: Vertikale Ausdehnung der Flächen.
+
+        Output:
+        Liste von Plotly-Spuren."""
+    spuren = []
+    for art, gruppe in episoden.groupby("Art", sort=False):
+        t0, t1 = gruppe["Beginn in ms"].to_numpy(), gruppe["Ende in ms"].to_numpy()
+        # Pro Episode ein Rechteck, getrennt durch None
+        x = np.column_stack([t0, t0, t1, t1, np.full(len(t0), np.nan)]).ravel()
+        y = np.tile([y_min, y_max, y_max, y_min, np.nan], len(t0))
+        spuren.append(go.Scatter(
+            x=x, y=y, fill="toself", mode="none", opacity=0.3, name=art,
+            fillcolor=FARBEN.get(art, "orange"), hoverinfo="name"))
+    return spuren
@@ -0,0 +1,353 @@
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+from analyse_cache import analyse_cache
+from detektoren import DETEKTOREN, finde_r_zacken, uebereinstimmung
+from ekg_cache import ABTASTRATE_HZ, abgeleitete_datei, entferne_cache, lade_ekg_arrays
+from ekg_filter import filter_schluessel, filter_sos, gefiltertes_signal
+from ekg_speicher import aufnahme_speicher
+from ekgdaten import EKGdata
+
+try:
+    import resource
+except ImportError:
+    # Nur unter Unix vorhanden; unter Windows fehlt der Spitzenspeicher des Prozesses im Ergebnis (None)
+    resource = None
+
+BENCHMARK_DIR = os.path.join("data", "benchmarks")
+
+# Dauer der synthetischen Aufnahmen in Minuten (1 min bis 24 h)
+STANDARD_DAUERN = [1, 10, 60]
+ALLE_DAUERN = [1, 10, 60, 240, 1440]
+
+# Wellen eines Herzschlags als (Lage relativ zur R-Zacke in s, Breite in s, Amplitude in mV-Einheiten der Aufnahmen)
+WELLEN = [(-0.20, 0.025, 8), (-0.03, 0.010, -12), (0.0, 0.012, 75), (0.03, 0.010, -18), (0.25, 0.040, 15)]
+GRUNDLINIE = 297
+
+# Zwei R-Zacken gelten beim Vergleich der Detektoren als dieselbe, wenn sie höchstens so weit auseinander liegen
+TOLERANZ_MS = 50
+
+
+def erzeuge_signal(dauer_min, seed=0, hr_bpm=70, drift=0.0, mit_r_zacken=False):
+    """Erzeugt ein synthetisches EKG im Wertebereich der Aufnahmen in data/ekg_data.
+    Die Herzfrequenz schwankt langsam um hr_bpm, dazu kommen Rauschen, Grundlinienschwankung
+    und einzelne Pausen, damit auch die Anomalieerkennung etwas zu tun hat.
+
+        Input:
+        dauer_min (float): Länge der Aufnahme in Minuten.
+        seed (int, optional): Startwert des Zufallsgenerators.
+        hr_bpm (float, optional): Mittlere Herzfrequenz.
+        drift (float, optional): Relative Schwankung der Amplitude (Periode 2 min) mit entsprechend stärkerer
+            Grundlinienschwankung, z.B. 0.5 für Amplituden zwischen 50 % und 150 %.
+        mit_r_zacken (bool, optional): Zusätzlich die Indizes der erzeugten R-Zacken zurückgeben.
+
+        Output:
+        Tupel (messwerte, zeit_in_ms) als int-Arrays, mit mit_r_zacken=True (messwerte, zeit_in_ms, r_zacken)."""
+    rng = np.random.default_rng(seed)
+    n = int(dauer_min * 60 * ABTASTRATE_HZ)
+    t = np.arange(n) / ABTASTRATE_HZ
+
+    # RR-Intervalle: langsame Schwankung, Zufall und vereinzelte Pausen (< 40 bpm) als Anomalien
+    anzahl_beats = int(dauer_min * 60 * hr_bpm / 60 * 2) + 10
+    rr = 60 / hr_bpm * (1 + 0.05 * rng.standard_normal(anzahl_beats).cumsum() / np.sqrt(anzahl_beats))
+    rr = np.clip(rr + 0.03 * rng.standard_normal(anzahl_beats), 0.45, 1.4)
+    rr[rng.random(anzahl_beats) < 0.005] = 1.8
+    r_zeiten = np.cumsum(rr)
+    r_zeiten = r_zeiten[r_zeiten < t[-1]] if n else r_zeiten[:0]
+
+    signal = GRUNDLINIE + 3 * np.sin(2 * np.pi * 0.25 * t) + 1.5 * rng.standard_normal(n)
+    signal += 40 * drift * np.sin(2 * np.pi * 0.03 * t)
+    skala = 1 + drift * np.sin(2 * np.pi * r_zeiten / 120)
+    for lage, breite, amplitude in WELLEN:
+        fenster = int(4 * breite * ABTASTRATE_HZ)
+        versatz = np.arange(-fenster, fenster + 1)
+        mitte = np.round((r_zeiten + lage) * ABTASTRATE_HZ).astype(np.int64)
+        idx = mitte[:, None] + versatz[None, :]
+        gueltig = (idx >= 0) & (idx < n)
+        form = amplitude * np.exp(-0.5 * (versatz / (breite * ABTASTRATE_HZ)) ** 2)
+        np.add.at(signal, idx[gueltig], (skala[:, None] * form[None, :])[gueltig])
+
+    werte = np.round(signal).astype(np.int64)
+    zeit = 13666 + np.arange(n, dtype=np.int64) * (1000 // ABTASTRATE_HZ)
+    if mit_r_zacken:
+        return werte, zeit, np.round(r_zeiten * ABTASTRATE_HZ).astype(np.int64)
+    return werte, zeit
+
+
+def schreibe_aufnahme(pfad, werte, zeit, block=1_000_000):
+    """Schreibt eine Aufnahme im Format der EKG-Textdateien (zwei Spalten, tabulatorgetrennt)."""
+    tmp = f"{pfad}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        for start in range(0, len(werte), block):
+            stueck = np.column_stack((werte[start:start + block], zeit[start:start + block]))
+            np.savetxt(f, stueck, fmt="%d", delimiter="\t")
+    os.replace(tmp, pfad)
+
+
+def synthetische_aufnahme(dauer_min, verzeichnis, seed=0, drift=0.0):
+    """Gibt den Pfad einer synthetischen Aufnahme zurück und erzeugt sie, falls sie noch nicht existiert.
+    Die wahren R-Zacken liegen daneben in <name>_r.npy (siehe wahre_r_zacken)."""
+    os.makedirs(verzeichnis, exist_ok=True)
+    name = f"synthetisch_{dauer_min}min_seed{seed}" + (f"_drift{drift}" if drift else "")
+    pfad = os.path.join(verzeichnis, name + ".txt")
+    if not os.path.exists(pfad) or not os.path.exists(wahre_r_zacken_pfad(pfad)):
+        werte, zeit, r_zacken = erzeuge_signal(dauer_min, seed, drift=drift, mit_r_zacken=True)
+        np.save(wahre_r_zacken_pfad(pfad), r_zacken)
+        schreibe_aufnahme(pfad, werte, zeit)
+    return pfad
+
+
+def wahre_r_zacken_pfad(pfad):
+    """Pfad der Datei mit den wahren R-Zacken einer synthetischen Aufnahme."""
+    return os.path.splitext(pfad)[0] + "_r.npy"
+
+
+def _max_rss_mb():
+    """Spitzenspeicher des Prozesses in MB oder None, wo das Modul resource fehlt (Windows)."""
+    if resource is None:
+        return None
+    # ru_maxrss ist unter Linux in KB angegeben, unter macOS in Bytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1e6 if sys.platform == "darwin" else 1e3)
+
+
+def _miss(funktion, wiederholungen):
+    """Führt eine Stufe mehrmals aus und gibt (Ergebnis, beste Zeit, Median, Spitzenspeicher) zurück."""
+    zeiten, spitze, ergebnis = [], 0, None
+    for _ in range(wiederholungen):
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        ergebnis = funktion()
+        zeiten.append(time.perf_counter() - start)
+        spitze = max(spitze, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return ergebnis, {
+        "zeit_s_min": min(zeiten),
+        "zeit_s_median": float(np.median(zeiten)),
+        "spitzenspeicher_mb": spitze / 1e6}
+
+
+def miss_detektoren(signal, wiederholungen=3, referenz=None, toleranz_ms=TOLERANZ_MS):
+    """Misst den Durchsatz aller registrierten Detektoren und vergleicht ihre R-Zacken paarweise,
+    bei synthetischen Aufnahmen zusätzlich mit den wahren R-Zacken.
+
+        Input:
+        signal: Messwerte.
+        wiederholungen (int, optional): Messungen pro Detektor.
+        referenz (optional): Wahre R-Zacken als Indizes.
+        toleranz_ms (int, optional): Größter Abstand zweier R-Zacken, die als dieselbe gelten.
+
+        Output:
+        Dictionary mit Zeiten, Messwerten pro Sekunde und Echtzeitfaktor je Detektor und der Übereinstimmung
+        (Sensitivität, positiver Vorhersagewert, F1, mittlere Abweichung in ms) je Paar."""
+    signal = np.asarray(signal, dtype=np.float64)
+    toleranz = int(toleranz_ms * ABTASTRATE_HZ / 1000)
+    detektoren, gefunden = {}, {}
+    for name in DETEKTOREN:
+        gefunden[name], detektoren[name] = _miss(lambda: finde_r_zacken(signal, name), wiederholungen)
+        detektoren[name]["anzahl_peaks"] = int(len(gefunden[name]))
+        detektoren[name]["messwerte_pro_s"] = len(signal) / detektoren[name]["zeit_s_min"]
+        detektoren[name]["echtzeitfaktor"] = detektoren[name]["messwerte_pro_s"] / ABTASTRATE_HZ
+
+    paare = list(itertools.combinations(gefunden, 2))
+    if referenz is not None:
+        gefunden["wahr"] = np.asarray(referenz)
+        paare = [("wahr", name) for name in DETEKTOREN] + paare
+    vergleiche = {}
+    for a, b in paare:
+        vergleich = uebereinstimmung(gefunden[a], gefunden[b], toleranz)
+        vergleich["mittlere_abweichung_ms"] = vergleich.pop("mittlere_abweichung") * 1000 / ABTASTRATE_HZ
+        vergleiche[f"{a}/{b}"] = vergleich
+    return {"detektoren": detektoren, "uebereinstimmung": vergleiche}
+
+
+def _drucke_detektoren(ergebnis, ausgabe):
+    for name, detektor in ergebnis["detektoren"].items():
+        print(f"    {name:<26} {detektor['messwerte_pro_s'] / 1e6:10.1f} Mio. Messwerte/s "
+              f"({detektor['echtzeitfaktor']:.0f}x Echtzeit), {detektor['anzahl_peaks']} Peaks", file=ausgabe)
+    for paar, vergleich in ergebnis["uebereinstimmung"].items():
+        print(f"    {paar:<26} F1 {vergleich['f1']:.4f}, Sensitivität {vergleich['sensitivitaet']:.4f}, "
+              f"PPV {vergleich['ppv']:.4f}", file=ausgabe)
+
+
+def miss_aufnahme(pfad, wiederholungen=3, alter=30):
+    """Misst alle Stufen der Auswertung einer Aufnahme einzeln. Der Analyse-Cache wird dabei umgangen,
+    damit jede Wiederholung wirklich rechnet.
+
+        Input:
+        pfad (str): Pfad zur EKG-Textdatei.
+        wiederholungen (int, optional): Anzahl der Messungen pro Stufe (beste Zeit und Median werden berichtet).
+        alter (int, optional): Alter für die Anomalieerkennung.
+
+        Output:
+        Dictionary mit einem Eintrag pro Stufe."""
+    ekg_dict = {"id": 0, "date": "1.1.2024", "result_link": pfad}
+    stufen = {}
+
+    def kalt_laden():
+        entferne_cache(pfad)
+        aufnahme_speicher.leeren()
+        # Objekt nicht zurückgeben: es hielte die Aufnahme im Speicher, leeren() würde sie nicht verwerfen
+        EKGdata(ekg_dict)
+
+    _, stufen["laden_kalt"] = _miss(kalt_laden, wiederholungen)
+    ekg, stufen["laden_warm"] = _miss(lambda: EKGdata(ekg_dict), wiederholungen)
+
+    def filtern_kalt():
+        sos = filter_sos()
+        datei = abgeleitete_datei(pfad, f"gefiltert_{filter_schluessel(sos)}")
+        if os.path.exists(datei):
+            os.remove(datei)
+        gefiltertes_signal(pfad, sos)
+
+    _, stufen["filtern_kalt"] = _miss(filtern_kalt, wiederholungen)
+    _, stufen["filtern_warm"] = _miss(lambda: gefiltertes_signal(pfad), wiederholungen)
+
+    verzeichnis = analyse_cache.verzeichnis
+    analyse_cache.verzeichnis = None
+    try:
+        def peaks_neu():
+            analyse_cache.leeren()
+            return ekg.find_peaks()
+
+        peaks, stufen["find_peaks"] = _miss(peaks_neu, wiederholungen)
+        zeit = ekg.df["Zeit in ms"]
+
+        # Nachjustieren mit gefülltem Cache: jede Wiederholung mit neuem Wert, es rechnen nur die betroffenen Stufen
+        werte = itertools.count(1)
+        _, stufen["prominenz_aendern"] = _miss(lambda: ekg.find_peaks(prominence=30 + next(werte)), wiederholungen)
+        _, stufen["hoehe_aendern"] = _miss(lambda: ekg.find_peaks(height=340 + next(werte)), wiederholungen)
+        ekg.find_peaks()
+        _, stufen["alter_aendern"] = _miss(lambda: ekg.detect_anomalies(peaks, alter + next(werte)), wiederholungen)
+
+        def mit_neuen_rr(funktion):
+            # RR-Intervalle jedes Mal neu aufbauen, sonst misst man nur den Objekt-Cache
+            def stufe():
+                ekg._rr = None
+                return funktion()
+            return stufe
+
+        _, stufen["estimate_hr"] = _miss(mit_neuen_rr(lambda: ekg.estimate_hr(peaks)), wiederholungen)
+        _, stufen["Heart_Rate"] = _miss(mit_neuen_rr(lambda: ekg.Heart_Rate(peaks)), wiederholungen)
+        _, stufen["Heartratevariation"] = _miss(lambda: EKGdata.Heartratevariation(peaks, zeit), wiederholungen)
+        anomalien, stufen["detect_anomalies"] = _miss(
+            mit_neuen_rr(lambda: ekg.detect_anomalies(peaks, alter)), wiederholungen)
+
+        def hrv_verlauf_neu():
+            analyse_cache.leeren()
+            return ekg.hrv_verlauf(peaks)
+
+        _, stufen["hrv_verlauf"] = _miss(hrv_verlauf_neu, wiederholungen)
+
+        def stats_neu():
+            analyse_cache.leeren()
+            return EKGdata.get_ekg_stats(ekg)
+
+        _, stufen["get_ekg_stats"] = _miss(stats_neu, wiederholungen)
+        start = int(zeit.iloc[0])
+        _, stufen["plot_time_series_bereich"] = _miss(
+            lambda: ekg.plot_time_series(peaks, anomalien, x_bereich=(start, start + 10000)), wiederholungen)
+        _, stufen["plot_time_series_gesamt"] = _miss(
+            lambda: ekg.plot_time_series(peaks, anomalien), wiederholungen)
+    finally:
+        analyse_cache.verzeichnis = verzeichnis
+        analyse_cache.leeren()
+
+    referenz = np.load(wahre_r_zacken_pfad(pfad)) if os.path.exists(wahre_r_zacken_pfad(pfad)) else None
+    return {
+        "datei": pfad,
+        "dateigroesse_mb": os.path.getsize(pfad) / 1e6,
+        "anzahl_messwerte": int(len(ekg.df)),
+        "anzahl_peaks": int(len(peaks)),
+        "anzahl_anomalien": len(anomalien),
+        "stufen": stufen,
+        "detektoren": miss_detektoren(ekg.df["Messwerte in mV"], wiederholungen, referenz)}
+
+
+def fuehre_aus(dauern=STANDARD_DAUERN, wiederholungen=3, daten_dir=None, seed=0, ausgabe=sys.stderr, drift=0.0,
+               dateien=()):
+    """Misst die Auswertung für synthetische Aufnahmen der angegebenen Längen.
+
+        Input:
+        dauern (list, optional): Längen der Aufnahmen in Minuten.
+        wiederholungen (int, optional): Messungen pro Stufe.
+        daten_dir (str, optional): Ablage der synthetischen Aufnahmen (Standard: temporäres Verzeichnis).
+        drift (float, optional): Amplitudendrift der synthetischen Aufnahmen (siehe erzeuge_signal).
+        dateien (list, optional): Echte Aufnahmen, auf denen nur die Detektoren verglichen werden.
+
+        Output:
+        Dictionary mit Umgebung und einem Ergebnis pro Aufnahme."""
+    daten_dir = daten_dir or os.path.join(tempfile.gettempdir(), "ekg_benchmark")
+    ergebnisse = []
+    for dauer in dauern:
+        print(f"{dauer} min: Aufnahme erzeugen ...", file=ausgabe)
+        pfad = synthetische_aufnahme(dauer, daten_dir, seed, drift)
+        print(f"{dauer} min: messen ...", file=ausgabe)
+        ergebnis = miss_aufnahme(pfad, wiederholungen)
+        ergebnis["dauer_min"] = dauer
+        entferne_cache(pfad)
+        ergebnisse.append(ergebnis)
+        for name, stufe in ergebnis["stufen"].items():
+            print(f"    {name:<26} {stufe['zeit_s_min'] * 1000:10.1f} ms {stufe['spitzenspeicher_mb']:9.1f} MB",
+                  file=ausgabe)
+        _drucke_detektoren(ergebnis["detektoren"], ausgabe)
+
+    aufnahmen = []
+    for pfad in dateien:
+        print(f"{pfad}: Detektoren vergleichen ...", file=ausgabe)
+        ergebnis = miss_detektoren(lade_ekg_arrays(pfad)[0], wiederholungen)
+        ergebnis["datei"] = pfad
+        aufnahmen.append(ergebnis)
+        _drucke_detektoren(ergebnis, ausgabe)
+
+    return {
+        "zeitpunkt": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "plattform": platform.platform(),
+        "prozessor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "wiederholungen": wiederholungen,
+        "drift": drift,
+        "max_rss_mb": _max_rss_mb(),
+        "ergebnisse": ergebnisse,
+        "aufnahmen": aufnahmen}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Misst die einzelnen Stufen der EKG-Auswertung mit synthetischen Aufnahmen.")
+    parser.add_argument("--dauer", type=float, nargs="+", default=STANDARD_DAUERN,
+                        help=f"Längen in Minuten (Standard: {STANDARD_DAUERN}, alle Größen: {ALLE_DAUERN})")
+    parser.add_argument("--alle", action="store_true", help=f"Alle Größen bis 24 h messen ({ALLE_DAUERN})")
+    parser.add_argument("--wiederholungen", type=int, default=3, help="Messungen pro Stufe")
+    parser.add_argument("--daten", default=None, help="Verzeichnis für die synthetischen Aufnahmen")
+    parser.add_argument("--drift", type=float, default=0.0,
+                        help="Amplitudendrift der synthetischen Aufnahmen, z.B. 0.5 für 50 %% bis 150 %%")
+    parser.add_argument("--dateien", nargs="*", default=[],
+                        help="Echte Aufnahmen, auf denen zusätzlich die Detektoren verglichen werden")
+    parser.add_argument("--out", default=None, help=f"JSON-Datei für die Ergebnisse (Standard: {BENCHMARK_DIR}/<zeitpunkt>.json)")
+    args = parser.parse_args(argv)
+
+    dauern = ALLE_DAUERN if args.alle else [int(d) if d == int(d) else d for d in args.dauer]
+    bericht = fuehre_aus(dauern, args.wiederholungen, args.daten, drift=args.drift, dateien=args.dateien)
+
+    ziel = args.out or os.path.join(BENCHMARK_DIR, bericht["zeitpunkt"].replace(":", "-") + ".json")
+    os.makedirs(os.path.dirname(ziel) or ".", exist_ok=True)
+    with open(ziel, "w") as f:
+        json.dump(bericht, f, indent=4)
+    print(f"Ergebnisse in {ziel}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import numpy as np
+from scipy.signal import butter, find_peaks, lfilter, sosfiltfilt
+
+from ekg_cache import ABTASTRATE_HZ
+from peak_stream import finde_peaks
+
+# Registrierte R-Zacken-Detektoren: Name -> funktion(signal, abtastrate_hz, **parameter) -> Peak-Indizes
+DETEKTOREN = {}
+
+STANDARD_DETEKTOR = "schwelle"
+
+# Pan-Tompkins: Durchlassbereich des Bandpasses, Breite des Integrationsfensters, Refraktärzeit,
+# Abstand, unter dem eine flache Zacke als T-Welle gilt, und Lernphase für die Startschwellen
+PT_BAND_HZ = (5, 15)
+PT_INTEGRATION_MS = 150
+PT_REFRAKTAER_MS = 200
+PT_T_WELLE_MS = 360
+PT_LERNPHASE_MS = 2000
+# Lücke, ab der mit halber Schwelle nachgesucht wird (Vielfaches des mittleren RR-Intervalls der letzten 8 Schläge)
+PT_NACHSUCHE_FAKTOR = 1.66
+PT_RR_SCHLAEGE = 8
+# Bereich um das Maximum der integrierten Energie, in dem die R-Zacke im Rohsignal gesucht wird
+PT_R_SUCHE_MS = 50
+PT_MAX_DURCHLAEUFE = 20
+
+
+def registriere(name):
+    """Dekorator, der eine Funktion als Detektor einträgt (ein vorhandener gleichen Namens wird ersetzt).
+    Die Funktion bekommt das Signal als float64-Array, die Abtastrate und ihre eigenen Parameter und gibt
+    die aufsteigenden Indizes der R-Zacken zurück."""
+    def dekorator(funktion):
+        DETEKTOREN[name] = funktion
+        return funktion
+    return dekorator
+
+
+def finde_r_zacken(signal, detektor=STANDARD_DETEKTOR, abtastrate_hz=ABTASTRATE_HZ, **parameter):
+    """Findet die R-Zacken eines Signals mit einem registrierten Detektor.
+
+        Input:
+        signal: Messwerte.
+        detektor (str, optional): Name des Detektors (siehe DETEKTOREN).
+        abtastrate_hz (int, optional): Abtastrate des Signals.
+        parameter: Parameter des Detektors, z.B. height=300 für "schwelle".
+
+        Output:
+        Array mit den Indizes der R-Zacken."""
+    if detektor not in DETEKTOREN:
+        raise ValueError(f"Unbekannter Detektor: {detektor} (vorhanden: {', '.join(DETEKTOREN)})")
+    peaks = DETEKTOREN[detektor](np.asarray(signal, dtype=np.float64), abtastrate_hz, **parameter)
+    return np.asarray(peaks, dtype=np.int64)
+
+
+@registriere("schwelle")
+def schwelle(signal, abtastrate_hz=ABTASTRATE_HZ, distance=200, height=340, prominence=30):
+    """Lokale Maxima über einer festen Höhe mit Mindestabstand und Prominenz (peak_stream.finde_peaks).
+    Abstand in Messwerten, Höhe und Prominenz in Einheiten der Messwerte."""
+    return finde_peaks(signal, distance, height, prominence)
+
+
+def _gleitendes_mittel(werte, breite):
+    """Zentriertes gleitendes Mittel über breite Werte, am Rand über den vorhandenen Teil des Fensters."""
+    summe = np.concatenate(([0.0], np.cumsum(werte)))
+    links = np.clip(np.arange(len(werte)) - breite // 2, 0, len(werte))
+    rechts = np.clip(links + breite, 0, len(werte))
+    return (summe[rechts] - summe[links]) / np.maximum(rechts - links, 1)
+
+
+def _laufender_pegel(hoehen, maske, start):
+    """Pegel SPKI bzw. NPKI vor jedem Kandidaten: exponentielles Mittel (Gewicht 1/8) über die bisherigen
+    Kandidaten der Klasse maske, als Filter über alle Werte der Klasse statt Schleife über die Kandidaten."""
+    verlauf, _ = lfilter([0.125], [1, -0.875], hoehen[maske], zi=[0.875 * start])
+    verlauf = np.concatenate(([start], verlauf))
+    # Anzahl der vorherigen Kandidaten dieser Klasse = Stelle im Verlauf
+    return verlauf[np.cumsum(maske) - maske]
+
+
+def _fenster_index(mitten, von, bis, laenge):
+    """Indexmatrix mit einer Zeile mitte+von ... mitte+bis pro Mitte (am Rand abgeschnitten)."""
+    return np.clip(mitten[:, None] + np.arange(von, bis + 1)[None, :], 0, laenge - 1)
+
+
+@registriere("pan_tompkins")
+def pan_tompkins(signal, abtastrate_hz=ABTASTRATE_HZ, band_hz=PT_BAND_HZ, integration_ms=PT_INTEGRATION_MS,
+                 refraktaer_ms=PT_REFRAKTAER_MS):
+    """Pan-Tompkins-Detektor ohne Schleife über die Messwerte: Bandpass (nullphasig), Ableitung, Quadrieren
+    und gleitende Integration; die Kandidaten werden mit adaptiven Schwellen (Signal- und Rauschpegel)
+    eingeteilt, T-Wellen verworfen und zu lange Lücken mit halber Schwelle nachgesucht. Die Schwellen sind
+    relativ zum Signal, der Detektor kommt also ohne feste Höhe aus und verträgt Amplitudendrift.
+
+        Input:
+        signal: Messwerte als float64-Array.
+        abtastrate_hz (int, optional): Abtastrate.
+        band_hz (tuple, optional): Durchlassbereich des Bandpasses.
+        integration_ms (int, optional): Breite des Integrationsfensters.
+        refraktaer_ms (int, optional): Mindestabstand zweier R-Zacken.
+
+        Output:
+        Array mit den Indizes der R-Zacken im Rohsignal."""
+    x = np.asarray(signal, dtype=np.float64)
+    n = len(x)
+    ms = abtastrate_hz / 1000
+    if n < PT_LERNPHASE_MS * ms:
+        return np.array([], dtype=np.int64)
+
+    sos = butter(2, band_hz, btype="bandpass", fs=abtastrate_hz, output="sos")
+    gefiltert = sosfiltfilt(sos, x - x.mean())
+    # Fünf-Punkt-Ableitung (1/8) * (-x[n-2] - 2x[n-1] + 2x[n+1] + x[n+2]), zentriert
+    ableitung = np.convolve(gefiltert, np.array([1, 2, 0, -2, -1]) * (abtastrate_hz / 8), mode="same")
+    # Zentrierte Integration, damit das Maximum im QRS-Komplex liegt und nicht dahinter
+    integriert = _gleitendes_mittel(ableitung ** 2, max(1, int(round(integration_ms * ms))))
+
+    kandidaten, _ = find_peaks(integriert, distance=max(1, int(refraktaer_ms * ms)))
+    if len(kandidaten) == 0:
+        return kandidaten.astype(np.int64)
+    hoehen = integriert[kandidaten]
+
+    # Startpegel aus der Lernphase wie im Original: Signal = ein Drittel des Maximums, Rauschen = halber Mittelwert
+    lernphase = integriert[:int(PT_LERNPHASE_MS * ms)]
+    spki_start, npki_start = lernphase.max() / 3, lernphase.mean() / 2
+
+    # Die Einteilung hängt über die Pegel von sich selbst ab: so lange neu einteilen, bis sie sich nicht mehr ändert
+    ist_qrs = hoehen > npki_start + 0.25 * (spki_start - npki_start)
+    for _ in range(PT_MAX_DURCHLAEUFE):
+        spki = _laufender_pegel(hoehen, ist_qrs, spki_start)
+        npki = _laufender_pegel(hoehen, ~ist_qrs, npki_start)
+        schwelle = npki + 0.25 * (spki - npki)
+        neu = hoehen > schwelle
+        if np.array_equal(neu, ist_qrs):
+            break
+        ist_qrs = neu
+
+    # T-Welle: kurz nach einem QRS-Komplex und mit weniger als der halben maximalen Steigung
+    steigung = np.abs(ableitung)[_fenster_index(kandidaten, -int(integration_ms * ms), 0, n)].max(axis=1)
+    qrs = np.flatnonzero(ist_qrs)
+    t_welle = (np.diff(kandidaten[qrs]) < PT_T_WELLE_MS * ms) & (steigung[qrs[1:]] < 0.5 * steigung[qrs[:-1]])
+    ist_qrs[qrs[1:][t_welle]] = False
+
+    # Nachsuche: in Lücken über PT_NACHSUCHE_FAKTOR x mittleres RR der letzten Schläge den höchsten
+    # Kandidaten über der halben Schwelle nehmen
+    qrs = np.flatnonzero(ist_qrs)
+    if len(qrs) > 2:
+        rr = np.diff(kandidaten[qrs]).astype(np.float64)
+        summe = np.concatenate(([0.0], np.cumsum(rr)))
+        ende = np.arange(len(rr))
+        anfang = np.maximum(ende - PT_RR_SCHLAEGE, 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rr_mittel = (summe[ende] - summe[anfang]) / (ende - anfang)
+        luecke = rr > PT_NACHSUCHE_FAKTOR * rr_mittel
+
+        # Lücke, in der jeder Kandidat liegt (-1 vor dem ersten QRS-Komplex)
+        in_luecke = np.searchsorted(kandidaten[qrs], kandidaten, side="right") - 1
+        moeglich = ~ist_qrs & (in_luecke >= 0) & (in_luecke < len(rr)) & (hoehen > 0.5 * schwelle)
+        moeglich[moeglich] = luecke[in_luecke[moeglich]]
+        auswahl = np.flatnonzero(moeglich)
+        # Pro Lücke der höchste: nach Lücke und absteigender Höhe sortieren, jeweils den ersten nehmen
+        auswahl = auswahl[np.lexsort((-hoehen[auswahl], in_luecke[auswahl]))]
+        _, erste = np.unique(in_luecke[auswahl], return_index=True)
+        ist_qrs[auswahl[erste]] = True
+
+    # R-Zacke = Maximum des Rohsignals nahe dem Energiemaximum
+    qrs = kandidaten[ist_qrs]
+    fenster = _fenster_index(qrs, -int(PT_R_SUCHE_MS * ms), int(PT_R_SUCHE_MS * ms), n)
+    r_zacken = fenster[np.arange(len(qrs)), np.argmax(x[fenster], axis=1)]
+    return np.unique(r_zacken).astype(np.int64)
+
+
+def uebereinstimmung(referenz, test, toleranz):
+    """Vergleicht zwei Peak-Listen. Zwei Peaks bilden ein Paar, wenn sie füreinander der nächste Peak
+    der anderen Liste sind und höchstens toleranz Messwerte auseinander liegen.
+
+        Input:
+        referenz, test: Aufsteigende Peak-Indizes.
+        toleranz (int): Größter erlaubter Abstand eines Paares in Messwerten.
+
+        Output:
+        Dictionary mit Paaren, nur in einer Liste gefundenen Peaks, Sensitivität, positivem
+        Vorhersagewert, F1 und mittlerer Abweichung (test - referenz, in Messwerten)."""
+    a, b = np.asarray(referenz, dtype=np.int64), np.asarray(test, dtype=np.int64)
+    paare = np.zeros(len(a), dtype=bool)
+    naechster = np.zeros(len(a), dtype=np.int64)
+    if len(a) and len(b):
+        def naechste(x, y):
+            rechts = np.clip(np.searchsorted(y, x), 0, len(y) - 1)
+            links = np.clip(rechts - 1, 0, len(y) - 1)
+            return np.where(np.abs(x - y[links]) <= np.abs(y[rechts] - x), links, rechts)
+
+        naechster = naechste(a, b)
+        paare = (naechste(b, a)[naechster] == np.arange(len(a))) & (np.abs(b[naechster] - a) <= toleranz)
+    treffer = int(paare.sum())
+    sensitivitaet = treffer / len(a) if len(a) else float("nan")
+    ppv = treffer / len(b) if len(b) else float("nan")
+    return {
+        "paare": treffer,
+        "nur_referenz": len(a) - treffer,
+        "nur_test": len(b) - treffer,
+        "sensitivitaet": sensitivitaet,
+        "ppv": ppv,
+        "f1": 2 * treffer / (len(a) + len(b)) if len(a) + len(b) else float("nan"),
+        "mittlere_abweichung": float(np.mean(b[naechster[paare]] - a[paare])) if treffer else float("nan")}
@@ -0,0 +1,277 @@
+import argparse
+import json
+import os
+import struct
+import sys
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from ekg_cache import ABTASTRATE_HZ, SPALTEN
+
+# Dateiendung und Kennung der Archive
+ENDUNG = ".ekgz"
+MAGIC = b"EKGZ"
+VERSION = 1
+
+# Messwerte pro Block (16 s bei 500 Hz); ein Zeitfenster liest nur die Blöcke, die es überlappt
+BLOCK_MESSWERTE = 8192
+
+ZLIB_STUFE = 6
+
+# Abschluss der Datei: Position des Blockindex, Position der Metadaten, Kennung
+_FUSS = struct.Struct("<QQ4s")
+
+# Ein Eintrag pro Block; zeit_schritt 0 bedeutet, dass die Zeitdifferenzen mit im Block stehen
+_INDEX_DTYPE = np.dtype([
+    ("start", "<i8"), ("anzahl", "<i4"), ("offset", "<i8"), ("laenge", "<i4"),
+    ("t_min", "<i8"), ("t_max", "<i8"), ("wert_erster", "<f8"), ("wert_typ", "S2"),
+    ("zeit_erster", "<i8"), ("zeit_schritt", "<i8")])
+
+
+def ist_archiv(pfad):
+    """Prüft anhand der Kennung am Dateianfang, ob eine Datei ein EKG-Archiv ist."""
+    try:
+        with open(pfad, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def archiv_pfad(pfad):
+    """Gibt den Pfad des Archivs zu einer EKG-Textdatei zurück (gleicher Name, Endung .ekgz)."""
+    return os.path.splitext(pfad)[0] + ENDUNG
+
+
+def _differenzen(werte):
+    """Kodiert einen Block Messwerte als ersten Wert und Differenzen im kleinsten passenden Ganzzahltyp.
+    Nicht ganzzahlige Messwerte werden unverändert als float64 abgelegt."""
+    if not np.issubdtype(werte.dtype, np.integer):
+        return 0.0, b"f8", werte.astype("<f8")
+    differenzen = np.diff(werte.astype(np.int64))
+    grenze = int(np.abs(differenzen).max()) if len(differenzen) else 0
+    for typ in (b"i1", b"i2", b"i4"):
+        if grenze <= np.iinfo(np.dtype(typ.decode())).max:
+            return float(werte[0]), typ, differenzen.astype("<" + typ.decode())
+    return float(werte[0]), b"i8", differenzen.astype("<i8")
+
+
+class ArchivSchreiber:
+    """Schreibt ein EKG-Archiv blockweise, sodass auch Tage lange Aufnahmen nie ganz im Speicher liegen.
+
+    Aufbau der Datei: Kennung, danach die zlib-komprimierten Blöcke (Messwerte als Differenzen,
+    Zeitachse nur bei ungleichmäßiger Abtastung), am Ende der Blockindex (Zeitbereich und Byte-Position
+    jedes Blocks), die Metadaten als JSON und ein Fuß mit den Positionen von Index und Metadaten."""
+
+    def __init__(self, ziel, block_messwerte=BLOCK_MESSWERTE, meta=None):
+        self.ziel = ziel
+        self.block_messwerte = block_messwerte
+        self.meta = dict(meta or {})
+        self._tmp = f"{ziel}.{os.getpid()}.tmp"
+        self._datei = open(self._tmp, "wb")
+        self._datei.write(MAGIC + bytes([VERSION]))
+        self._index = []
+        self._rest = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        self._anzahl = 0
+
+    def schreibe(self, werte, zeit):
+        """Hängt Messwerte und Zeitpunkte an; volle Blöcke werden sofort geschrieben."""
+        werte = np.concatenate((self._rest[0], np.asarray(werte))) if len(self._rest[0]) else np.asarray(werte)
+        zeit = np.concatenate((self._rest[1], np.asarray(zeit))) if len(self._rest[1]) else np.asarray(zeit)
+        volle = len(werte) // self.block_messwerte * self.block_messwerte
+        for start in range(0, volle, self.block_messwerte):
+            self._schreibe_block(werte[start:start + self.block_messwerte], zeit[start:start + self.block_messwerte])
+        self._rest = (werte[volle:], zeit[volle:])
+
+    def _schreibe_block(self, werte, zeit):
+        wert_erster, wert_typ, kodiert = _differenzen(werte)
+        zeit = zeit.astype(np.int64)
+        schritte = np.diff(zeit)
+        inhalt = kodiert.tobytes()
+        zeit_schritt = int(schritte[0]) if len(schritte) else 1
+        if len(schritte) and (zeit_schritt <= 0 or np.any(schritte != zeit_schritt)):
+            # Ungleichmäßige Zeitachse (z.B. Zeitsprung) -> Differenzen mit ablegen
+            zeit_schritt = 0
+            inhalt += schritte.astype("<i8").tobytes()
+        daten = zlib.compress(inhalt, ZLIB_STUFE)
+        self._index.append((self._anzahl, len(werte), self._datei.tell(), len(daten), int(zeit.min()),
+                            int(zeit.max()), wert_erster, wert_typ, int(zeit[0]), zeit_schritt))
+        self._datei.write(daten)
+        self._anzahl += len(werte)
+
+    def schliesse(self):
+        """Schreibt den letzten Block, Index und Metadaten und legt die Datei atomar unter ziel ab."""
+        if len(self._rest[0]):
+            self._schreibe_block(*self._rest)
+        index = np.array(self._index, dtype=_INDEX_DTYPE)
+        index_offset = self._datei.tell()
+        self._datei.write(index.tobytes())
+        meta_offset = self._datei.tell()
+        self.meta.update(anzahl=self._anzahl, bloecke=len(index), block_messwerte=self.block_messwerte,
+                         abtastrate_hz=self.meta.get("abtastrate_hz", ABTASTRATE_HZ))
+        self._datei.write(json.dumps(self.meta).encode("utf-8"))
+        self._datei.write(_FUSS.pack(index_offset, meta_offset, MAGIC))
+        self._datei.close()
+        os.replace(self._tmp, self.ziel)
+        return self.ziel
+
+    def verwerfe(self):
+        """Bricht das Schreiben ab und entfernt die temporäre Datei."""
+        self._datei.close()
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, wert, tb):
+        if typ is None:
+            self.schliesse()
+        else:
+            self.verwerfe()
+
+
+def schreibe_archiv(ziel, werte, zeit, block_messwerte=BLOCK_MESSWERTE):
+    """Schreibt Messwerte und Zeitpunkte einer Aufnahme als EKG-Archiv.
+
+        Input:
+        ziel (str): Pfad des Archivs.
+        werte, zeit: Messwerte und Zeitpunkte in ms.
+        block_messwerte (int, optional): Messwerte pro Block.
+
+        Output:
+        Pfad des Archivs."""
+    with ArchivSchreiber(ziel, block_messwerte) as schreiber:
+        schreiber.schreibe(werte, zeit)
+    return ziel
+
+
+class EKGArchiv:
+    """Lesezugriff auf ein EKG-Archiv. Beim Öffnen werden nur Index und Metadaten gelesen,
+    Messwerte erst blockweise für das angefragte Zeitfenster. Der Aufwand eines Zeitfensters
+    hängt damit von seiner Länge ab, nicht von der Länge der Aufnahme."""
+
+    def __init__(self, pfad):
+        """Input:
+            pfad (str): Pfad zum Archiv (.ekgz)."""
+        self.pfad = pfad
+        with open(pfad, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{pfad} ist kein EKG-Archiv")
+            f.seek(-_FUSS.size, os.SEEK_END)
+            fuss_position = f.tell()
+            index_offset, meta_offset, magic = _FUSS.unpack(f.read(_FUSS.size))
+            if magic != MAGIC:
+                raise ValueError(f"{pfad} ist unvollständig")
+            f.seek(index_offset)
+            self.index = np.frombuffer(f.read(meta_offset - index_offset), dtype=_INDEX_DTYPE)
+            self.meta = json.loads(f.read(fuss_position - meta_offset))
+
+    @property
+    def anzahl(self):
+        """Anzahl der Messwerte."""
+        return int(self.meta["anzahl"])
+
+    def _dekodiere(self, f, eintrag):
+        f.seek(int(eintrag["offset"]))
+        inhalt = zlib.decompress(f.read(int(eintrag["laenge"])))
+        anzahl = int(eintrag["anzahl"])
+        typ = np.dtype("<" + eintrag["wert_typ"].decode())
+        if typ.kind == "f":
+            werte = np.frombuffer(inhalt, dtype=typ, count=anzahl)
+        else:
+            differenzen = np.frombuffer(inhalt, dtype=typ, count=anzahl - 1)
+            werte = np.empty(anzahl, dtype=np.int64)
+            werte[0] = int(eintrag["wert_erster"])
+            np.cumsum(differenzen, dtype=np.int64, out=werte[1:])
+            werte[1:] += werte[0]
+        if eintrag["zeit_schritt"]:
+            zeit = int(eintrag["zeit_erster"]) + np.arange(anzahl, dtype=np.int64) * int(eintrag["zeit_schritt"])
+        else:
+            werte_bytes = typ.itemsize * (anzahl if typ.kind == "f" else anzahl - 1)
+            schritte = np.frombuffer(inhalt, dtype="<i8", offset=werte_bytes, count=anzahl - 1)
+            zeit = np.empty(anzahl, dtype=np.int64)
+            zeit[0] = int(eintrag["zeit_erster"])
+            np.cumsum(schritte, dtype=np.int64, out=zeit[1:])
+            zeit[1:] += zeit[0]
+        return werte, zeit
+
+    def _lies_bloecke(self, nummern):
+        if len(nummern) == 0:
+            leer = np.empty(0, dtype=np.int64)
+            return leer, leer
+        with open(self.pfad, "rb") as f:
+            teile = [self._dekodiere(f, self.index[i]) for i in nummern]
+        return np.concatenate([t[0] for t in teile]), np.concatenate([t[1] for t in teile])
+
+    def lies_alles(self):
+        """Gibt die ganze Aufnahme als (messwerte, zeit_in_ms) zurück."""
+        return self._lies_bloecke(np.arange(len(self.index)))
+
+    def lies_zeitfenster(self, start_ms, ende_ms):
+        """Gibt die Messwerte mit start_ms <= Zeit <= ende_ms zurück. Es werden nur die Blöcke gelesen,
+        deren Zeitbereich das Fenster überlappt (auch bei Zeitsprüngen in der Aufnahme).
+
+            Input:
+            start_ms, ende_ms: Zeitfenster in ms.
+
+            Output:
+            Tupel (messwerte, zeit_in_ms) als NumPy-Arrays."""
+        nummern = np.flatnonzero((self.index["t_max"] >= start_ms) & (self.index["t_min"] <= ende_ms))
+        werte, zeit = self._lies_bloecke(nummern)
+        im_fenster = (zeit >= start_ms) & (zeit <= ende_ms)
+        return werte[im_fenster], zeit[im_fenster]
+
+    def lies_bloecke(self):
+        """Generator über (messwerte, zeit_in_ms) je Block, z.B. für blockweise Verarbeitung."""
+        with open(self.pfad, "rb") as f:
+            for eintrag in self.index:
+                yield self._dekodiere(f, eintrag)
+
+
+def konvertiere(quelle, ziel=None, chunk_zeilen=1 << 20):
+    """Wandelt eine EKG-Textdatei in ein Archiv um. Die Textdatei wird in Stücken gelesen,
+    auch sehr lange Aufnahmen (Holter) brauchen also nur wenig Speicher.
+
+        Input:
+        quelle (str): Pfad zur EKG-Textdatei.
+        ziel (str, optional): Pfad des Archivs, Standard gleicher Name mit Endung .ekgz.
+        chunk_zeilen (int, optional): Zeilen pro gelesenem Stück.
+
+        Output:
+        Pfad des Archivs."""
+    ziel = ziel or archiv_pfad(quelle)
+    reader = pd.read_csv(quelle, sep="\t", header=None, names=SPALTEN, chunksize=chunk_zeilen)
+    with reader, ArchivSchreiber(ziel) as schreiber:
+        for chunk in reader:
+            schreiber.schreibe(chunk[SPALTEN[0]].to_numpy(), chunk[SPALTEN[1]].to_numpy())
+    return ziel
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Wandelt EKG-Textdateien in komprimierte Archive (.ekgz) um.")
+    parser.add_argument("dateien", nargs="*", help="EKG-Textdateien (Standard: alle EKGs der Personendatenbank)")
+    parser.add_argument("--datenbank", action="store_true",
+                        help="result_link der EKGs in der Personendatenbank auf die Archive umstellen")
+    args = parser.parse_args(argv)
+
+    if args.dateien:
+        auftraege = [(None, pfad) for pfad in args.dateien]
+    else:
+        from read_data import load_person_data
+        auftraege = [(ekg["id"], ekg["result_link"]) for person in load_person_data()
+                     for ekg in person.get("ekg_tests", [])
+                     if os.path.exists(ekg["result_link"]) and not ist_archiv(ekg["result_link"])]
+
+    for ekg_id, quelle in auftraege:
+        ziel = konvertiere(quelle)
+        print(f"{quelle} -> {ziel}: {os.path.getsize(quelle) / 1e6:.1f} MB -> {os.path.getsize(ziel) / 1e6:.2f} MB",
+              file=sys.stderr)
+        if args.datenbank and ekg_id is not None:
+            from read_data import update_ekg_test
+            update_ekg_test(ekg_id, result_link=ziel)
+
+
+if __name__ == "__main__":
+    main()
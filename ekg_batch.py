@@ -0,0 +1,192 @@
+import atexit
+import hashlib
+import inspect
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from ekg_cache import inhalts_hash
+from ekgdaten import EKGdata
+from person import Person
+from read_data import find_person_data_by_ekg_id
+
+# Obergrenze für parallele Prozesse, damit ein Vergleich nicht die ganze Maschine belegt
+MAX_WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+_pool = None
+
+# Erhöhen, sobald sich Peak-Erkennung, Anomalieregeln oder Kennzahlen ändern, ohne dass sich ein
+# Standardparameter ändert; gespeicherte Ergebnisse mit anderer Analyseversion gelten als veraltet
+ANALYSE_VERSION = 1
+
+
+def _analyse_version():
+    """Kennung der Auswertung aus ANALYSE_VERSION und den Standardparametern von Peak- und Anomalieerkennung."""
+    standard = [(name, parameter.default)
+                for funktion in (EKGdata.find_peaks, EKGdata.detect_anomalies)
+                for name, parameter in inspect.signature(funktion).parameters.items()
+                if parameter.default is not inspect.Parameter.empty]
+    return f"{ANALYSE_VERSION}-{hashlib.sha1(repr(standard).encode()).hexdigest()[:12]}"
+
+
+# Wird mit jeder Zusammenfassung gespeichert (EKG-Index, analyse_cli)
+ANALYSE_KENNUNG = _analyse_version()
+
+
+def alter_bei_aufnahme(person_dict, ekg_dict):
+    """Alter der Person am Tag der Aufnahme (heute, falls das Datum nicht lesbar ist)."""
+    try:
+        stichtag = Person.parse_date(ekg_dict["date"])
+    except ValueError:
+        stichtag = None
+    return Person(person_dict).calc_age(stichtag)
+
+
+def datum_iso(datum):
+    """Datum eines EKGs als ISO-String (für Bereichsabfragen und plot_HFV) oder None, falls nicht lesbar."""
+    try:
+        return Person.parse_date(datum).isoformat()
+    except ValueError:
+        return None
+
+
+def erstelle_auftrag(ekg_dict, person_dict=None, sha256=None):
+    """Stellt den Auftrag für analysiere_ekg zusammen.
+
+        Input:
+        ekg_dict (dict): EKG-Dictionary (id, date, result_link).
+        person_dict (dict, optional): Person des EKGs, sonst aus der Personendatenbank gesucht. EKGs ohne
+            Person werden ohne Alter und damit ohne Anomalien ausgewertet.
+        sha256 (str, optional): Bereits bekannter Hash der Datei.
+
+        Output:
+        Auftrag als dict; OSError, wenn die Datei fehlt."""
+    stat = os.stat(ekg_dict["result_link"])
+    if person_dict is None:
+        person_dict = find_person_data_by_ekg_id(ekg_dict["id"])
+    return {
+        "person_id": person_dict.get("id"),
+        "alter": alter_bei_aufnahme(person_dict, ekg_dict) if person_dict else None,
+        "ekg": ekg_dict,
+        "sha256": sha256 if sha256 is not None else inhalts_hash(ekg_dict["result_link"]),
+        "mtime_ns": stat.st_mtime_ns,
+        "groesse": stat.st_size}
+
+
+def analysiere_ekg(auftrag):
+    """Wertet ein EKG vollständig aus (läuft im Worker-Prozess).
+
+        Input:
+        auftrag (dict): person_id, alter, ekg (EKG-Dictionary) und Signatur der Quelldatei.
+
+        Output:
+        Tupel (Zusammenfassung als dict, DataFrame mit einer Zeile pro Schlag). anzahl_anomalien zählt die
+        Anomalie-Episoden wie in der App (detect_anomalies), die Spalte anomalie der Schläge markiert
+        Schläge außerhalb der Herzfrequenzgrenzen. Ohne Alter ist anzahl_anomalien None."""
+    ekg_dict = auftrag["ekg"]
+    ekg = EKGdata(ekg_dict)
+    peaks = ekg.find_peaks()
+    rr = ekg.rr_intervalle(peaks)
+    if auftrag["alter"] is None:
+        maske = np.zeros(len(rr.bpm), dtype=bool)
+        episoden = None
+    else:
+        maske = rr.anomalie_maske(auftrag["alter"])
+        episoden = ekg.detect_anomalies(peaks, auftrag["alter"])
+
+    beats = pd.DataFrame({
+        "ekg_id": ekg.id,
+        "zeit_ms": rr.bpm_zeiten,
+        "rr_ms": rr.intervalle[rr.gueltig],
+        "bpm": rr.bpm,
+        "anomalie": maske})
+    zusammenfassung = {
+        "person_id": auftrag["person_id"],
+        "ekg_id": ekg.id,
+        "datum": ekg.date,
+        "alter": auftrag["alter"],
+        "laenge_min": len(ekg.df) / 60000,
+        "anzahl_beats": int(len(peaks)),
+        "hr_mittel_bpm": rr.mittlere_hr,
+        "hr_min_bpm": float(rr.bpm.min()) if len(rr.bpm) else np.nan,
+        "hr_max_bpm": float(rr.bpm.max()) if len(rr.bpm) else np.nan,
+        "rmssd_ms": float(rr.rmssd) if len(rr.intervalle) > 1 else np.nan,
+        "anzahl_anomalien": int(len(episoden)) if episoden is not None else None,
+        "signalqualitaet": rr.qualitaet,
+        "sha256": auftrag["sha256"],
+        "mtime_ns": auftrag["mtime_ns"],
+        "groesse": auftrag["groesse"],
+        "analyse_version": ANALYSE_KENNUNG}
+    return zusammenfassung, beats
+
+
+def get_pool():
+    """Gibt den gemeinsamen Prozess-Pool zurück. Er wird einmal gestartet und über Streamlit-Reruns
+    wiederverwendet; "spawn" vermeidet fork() aus dem mehrfädigen Streamlit-Prozess."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+    return _pool
+
+
+def analysiere_auftraege(auftraege, parallel=True):
+    """Führt mehrere Aufträge im gemeinsamen Prozess-Pool aus. Jedes EKG wird unabhängig ausgewertet;
+    die Ergebnisse stehen in der Reihenfolge der Eingabe, egal welcher Prozess zuerst fertig ist.
+
+        Input:
+        auftraege (list): Aufträge aus erstelle_auftrag.
+        parallel (bool, optional): False rechnet alles im aktuellen Prozess.
+
+        Output:
+        Liste von Tupeln (Zusammenfassung, Schläge) wie bei analysiere_ekg."""
+    auftraege = list(auftraege)
+    if parallel and len(auftraege) > 1:
+        return list(get_pool().map(analysiere_ekg, auftraege))
+    return [analysiere_ekg(auftrag) for auftrag in auftraege]
+
+
+def stats_tabelle(zusammenfassungen):
+    """Formt Zusammenfassungen (analysiere_ekg oder Zeilen des EKG-Index) zur Vergleichstabelle um: Spalten
+    von get_ekg_stats (passend für plot_HFV), ergänzt um Schlagzahl, Anomalie-Episoden, min/max HR und
+    Signalqualität.
+
+        Input:
+        zusammenfassungen (DataFrame): Eine Zeile pro EKG.
+
+        Output:
+        DataFrame mit einer Zeile pro EKG in derselben Reihenfolge."""
+    df = zusammenfassungen
+    if df.empty:
+        return pd.DataFrame()
+    datum = df["datum_iso"] if "datum_iso" in df else df["datum"].map(datum_iso)
+    return pd.DataFrame({
+        # ISO-Datum, damit plot_HFV Tag und Monat nicht vertauscht
+        "Datum": datum.fillna(df["datum"]).to_numpy(),
+        "EKG-ID": df["ekg_id"].to_numpy(),
+        "Testlänge (min)": df["laenge_min"].round(2).to_numpy(),
+        "Ø Herzfrequenz (bpm)": df["hr_mittel_bpm"].fillna(0).astype(int).to_numpy(),
+        "HRV (ms)": df["rmssd_ms"].fillna(0).astype(int).to_numpy(),
+        "Schläge": df["anzahl_beats"].to_numpy(),
+        "Anomalie-Episoden": df["anzahl_anomalien"].to_numpy(),
+        "HR min (bpm)": df["hr_min_bpm"].round(0).to_numpy(),
+        "HR max (bpm)": df["hr_max_bpm"].round(0).to_numpy(),
+        "Signalqualität": df["signalqualitaet"].round(3).to_numpy()})
+
+
+def berechne_ekg_stats(ekg_dicts, parallel=True):
+    """Berechnet die Vergleichstabelle mehrerer EKGs im Prozess-Pool (höchstens MAX_WORKERS Prozesse),
+    ohne Index oder Ergebnistabellen zu schreiben; nutzbar aus der App und aus Skripten.
+
+        Input:
+        ekg_dicts (list): EKG-Dictionaries (id, date, result_link). EKGs ohne Person in der
+            Personendatenbank werden ohne Anomalien ausgewertet.
+        parallel (bool, optional): False rechnet alles im aktuellen Prozess.
+
+        Output:
+        DataFrame wie stats_tabelle, eine Zeile pro EKG in der Reihenfolge der Eingabe."""
+    ergebnisse = analysiere_auftraege([erstelle_auftrag(ekg_dict) for ekg_dict in ekg_dicts], parallel)
+    return stats_tabelle(pd.DataFrame([zusammenfassung for zusammenfassung, _ in ergebnisse]))
@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from messung import gemessen, messungen
+
+# Verzeichnis, in dem die binären Kopien der EKG-Aufnahmen abgelegt werden
+CACHE_DIR = os.path.join("data", "cache", "ekg")
+
+# Laut data/ekg_data/ReadMe.txt mit f=500 Hz aufgezeichnet
+ABTASTRATE_HZ = 500
+
+# Wird erhöht, sobald sich das Format der Cache-Dateien ändert
+FORMAT_VERSION = 2
+
+SPALTEN = ['Messwerte in mV', 'Zeit in ms']
+
+# Präfix der aus einer Aufnahme berechneten Dateien (z.B. gefiltertes Signal) im Cache-Verzeichnis
+ABGELEITET = "abgeleitet_"
+
+
+def quell_signatur(pfad):
+    """Bildet den Schlüssel einer Quelldatei aus Pfad, Änderungszeit und Größe.
+
+        Input:
+        pfad (str): Pfad zur EKG-Textdatei.
+
+        Output:
+        Dictionary mit absolutem Pfad, mtime (ns), Größe und Formatversion."""
+    stat = os.stat(pfad)
+    return {
+        "pfad": os.path.abspath(pfad),
+        "mtime_ns": stat.st_mtime_ns,
+        "groesse": stat.st_size,
+        "version": FORMAT_VERSION}
+
+
+def datei_hash(pfad, block=1 << 20):
+    """Berechnet den SHA-256-Hash einer Datei blockweise."""
+    h = hashlib.sha256()
+    with open(pfad, "rb") as f:
+        for stueck in iter(lambda: f.read(block), b""):
+            h.update(stueck)
+    return h.hexdigest()
+
+
+def _cache_pfad(pfad, cache_dir):
+    """Gibt das Cache-Unterverzeichnis einer Quelldatei zurück (ein Verzeichnis pro Pfad)."""
+    schluessel = hashlib.sha1(os.path.abspath(pfad).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, schluessel)
+
+
+def _kompakter_dtype(werte, reserve=1):
+    """Wählt den kleinsten Ganzzahltyp, in den alle Werte (mal Reserve) passen.
+    Nicht ganzzahlige Daten bleiben unverändert."""
+    if not np.issubdtype(werte.dtype, np.integer) or len(werte) == 0:
+        return werte.dtype
+    grenze = max(abs(int(werte.min())), abs(int(werte.max()))) * reserve
+    for dtype in (np.int16, np.int32):
+        if grenze <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+@gemessen("ekg_cache.textdatei_parsen")
+def _lies_textdatei(pfad):
+    """Parst die zweispaltige, tabulatorgetrennte EKG-Datei in NumPy-Arrays.
+    Die Datei wird am Stück gelesen und von NumPy direkt in Ganzzahlen umgewandelt (ohne CSV-Parser
+    und Spaltennamen); nur wenn das nicht geht (z.B. Kommazahlen), wird pandas verwendet."""
+    with open(pfad, "rb") as f:
+        inhalt = f.read()
+    try:
+        # sep=" " trennt an beliebigem Leerraum, also an Tabulatoren und Zeilenumbrüchen
+        zahlen = np.fromstring(inhalt, dtype=np.int64, sep=" ")
+    except ValueError:
+        zahlen = None
+    if zahlen is not None and len(zahlen) % 2 == 0 and len(zahlen) // 2 == inhalt.count(b"\n") + (not inhalt.endswith(b"\n")):
+        zahlen = zahlen.reshape(-1, 2)
+        messungen.zaehle("zeilen_geparst", len(zahlen))
+        return np.ascontiguousarray(zahlen[:, 0]), np.ascontiguousarray(zahlen[:, 1])
+
+    df = pd.read_csv(pfad, sep='\t', header=None, names=SPALTEN)
+    messungen.zaehle("zeilen_geparst", len(df))
+    return df[SPALTEN[0]].to_numpy(), df[SPALTEN[1]].to_numpy()
+
+
+def lies_quelle(pfad):
+    """Liest eine Aufnahme direkt aus der Quelldatei (ohne Binär-Cache) als (messwerte, zeit_in_ms),
+    egal ob Textdatei oder Archiv (ekg_archiv), z.B. um eine hochgeladene Datei zu prüfen."""
+    # Erst hier importiert, da ekg_archiv die Konstanten dieses Moduls verwendet
+    from ekg_archiv import EKGArchiv, ist_archiv
+    if ist_archiv(pfad):
+        werte, zeit = EKGArchiv(pfad).lies_alles()
+        messungen.zaehle("archiv_messwerte_gelesen", len(werte))
+        return werte, zeit
+    return _lies_textdatei(pfad)
+
+
+def _speichere_atomar(ziel, array):
+    """Schreibt ein Array als .npy über eine temporäre Datei, damit parallele Leser nie halbe Dateien sehen."""
+    tmp = f"{ziel}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, ziel)
+
+
+def _baue_cache(pfad, verzeichnis, signatur):
+    """Liest die Quelldatei (Text oder Archiv) einmal ein und legt Messwerte und ggf. Zeitspalte als .npy ab.
+    Ist die Zeitspalte gleichmäßig abgetastet, werden nur Startzeit und Schrittweite gespeichert."""
+    werte, zeit = lies_quelle(pfad)
+    os.makedirs(verzeichnis, exist_ok=True)
+    # Aus der alten Version der Quelldatei berechnete Dateien passen nicht mehr
+    for name in os.listdir(verzeichnis):
+        if name.startswith(ABGELEITET):
+            os.remove(os.path.join(verzeichnis, name))
+
+    meta = dict(signatur)
+    meta["anzahl"] = int(len(werte))
+    meta["abtastrate_hz"] = ABTASTRATE_HZ
+    meta["start_ms"] = int(zeit[0]) if len(zeit) else 0
+    meta["sha256"] = datei_hash(pfad)
+
+    # Gleichmäßige Zeitachse -> keine Zeitspalte nötig
+    schritte = np.diff(zeit)
+    if len(schritte) and np.issubdtype(zeit.dtype, np.integer) and np.all(schritte == schritte[0]) and schritte[0] > 0:
+        meta["schritt_ms"] = int(schritte[0])
+    else:
+        meta["schritt_ms"] = None
+        # Reserve 2, damit auch Summen zweier Zeitpunkte (Mittelpunkte) nicht überlaufen
+        _speichere_atomar(os.path.join(verzeichnis, "zeit.npy"), zeit.astype(_kompakter_dtype(zeit, reserve=2)))
+
+    _speichere_atomar(os.path.join(verzeichnis, "werte.npy"), werte.astype(_kompakter_dtype(werte)))
+
+    # meta.json wird zuletzt geschrieben und markiert den Cache damit als vollständig
+    tmp = os.path.join(verzeichnis, f"meta.json.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(verzeichnis, "meta.json"))
+    return meta
+
+
+def _lies_meta(verzeichnis):
+    """Lädt die Metadaten eines Cache-Eintrags oder None, falls keiner existiert."""
+    try:
+        with open(os.path.join(verzeichnis, "meta.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _ist_aktuell(meta, signatur):
+    """Prüft, ob ein Cache-Eintrag zur aktuellen Quelldatei passt."""
+    return meta is not None and all(meta.get(k) == v for k, v in signatur.items())
+
+
+@gemessen("ekg_cache.lade_ekg_arrays")
+def lade_ekg_arrays(pfad, cache_dir=CACHE_DIR):
+    """Lädt eine EKG-Aufnahme als typisierte Arrays aus dem Binär-Cache.
+    Der Cache wird beim ersten Zugriff angelegt und neu erstellt, sobald sich die Quelldatei ändert.
+    Die Messwerte werden per mmap geöffnet, es wird also kein Text mehr geparst und kein Archiv entpackt.
+
+        Input:
+        pfad (str): Pfad zur EKG-Textdatei oder zum Archiv (result_link).
+        cache_dir (str, optional): Wurzelverzeichnis des Caches.
+
+        Output:
+        Tupel (messwerte, zeit_in_ms) als NumPy-Arrays (schreibgeschützt)."""
+    signatur = quell_signatur(pfad)
+    verzeichnis = _cache_pfad(pfad, cache_dir)
+    meta = _lies_meta(verzeichnis)
+
+    if not _ist_aktuell(meta, signatur):
+        try:
+            meta = _baue_cache(pfad, verzeichnis, signatur)
+        except OSError:
+            # Cache nicht beschreibbar -> direkt aus der Quelldatei lesen
+            return lies_quelle(pfad)
+
+    werte = np.load(os.path.join(verzeichnis, "werte.npy"), mmap_mode="r")
+    if meta["schritt_ms"] is not None:
+        # Kleinster Typ, in den die Zeitachse (mit Reserve 2 wie beim Speichern) passt
+        ende = meta["start_ms"] + meta["schritt_ms"] * meta["anzahl"]
+        dtype = _kompakter_dtype(np.array([meta["start_ms"], ende]), reserve=2)
+        zeit = np.arange(meta["start_ms"], ende, meta["schritt_ms"], dtype=dtype)[:meta["anzahl"]]
+    else:
+        zeit = np.load(os.path.join(verzeichnis, "zeit.npy"), mmap_mode="r")
+    return werte, zeit
+
+
+def abgeleitete_datei(pfad, name, cache_dir=CACHE_DIR):
+    """Gibt den Pfad einer aus der Aufnahme berechneten .npy-Datei neben den Messwerten im Cache zurück.
+    Solche Dateien werden gelöscht, sobald der Cache für eine geänderte Quelldatei neu gebaut wird.
+
+        Input:
+        pfad (str): Pfad zur EKG-Textdatei.
+        name (str): Name der abgeleiteten Datei, z.B. "gefiltert_<schlüssel>".
+
+        Output:
+        Pfad der Datei (sie muss nicht existieren)."""
+    return os.path.join(_cache_pfad(pfad, cache_dir), f"{ABGELEITET}{name}.npy")
+
+
+def inhalts_hash(pfad, cache_dir=CACHE_DIR):
+    """Gibt den SHA-256-Hash des Dateiinhalts zurück. Er wird beim Anlegen des Caches in meta.json
+    gespeichert und daher nur einmal pro Version der Quelldatei berechnet.
+
+        Input:
+        pfad (str): Pfad zur EKG-Textdatei.
+
+        Output:
+        Hash als Hex-String."""
+    signatur = quell_signatur(pfad)
+    meta = _lies_meta(_cache_pfad(pfad, cache_dir))
+    if not _ist_aktuell(meta, signatur):
+        lade_ekg_arrays(pfad, cache_dir)
+        meta = _lies_meta(_cache_pfad(pfad, cache_dir))
+    if _ist_aktuell(meta, signatur) and "sha256" in meta:
+        return meta["sha256"]
+    return datei_hash(pfad)
+
+
+def lade_ekg_dataframe(pfad, cache_dir=CACHE_DIR):
+    """Gibt die EKG-Aufnahme als DataFrame mit den Spalten 'Messwerte in mV' und 'Zeit in ms' zurück.
+    Die Spalten verweisen direkt auf die gemappten Arrays (keine Kopie).
+
+        Input:
+        pfad (str): Pfad zur EKG-Textdatei.
+
+        Output:
+        DataFrame mit Messwerten und Zeitpunkten."""
+    werte, zeit = lade_ekg_arrays(pfad, cache_dir)
+    return pd.DataFrame({SPALTEN[0]: werte, SPALTEN[1]: zeit}, copy=False)
+
+
+def entferne_cache(pfad, cache_dir=CACHE_DIR):
+    """Löscht den Cache-Eintrag einer Quelldatei, falls vorhanden."""
+    verzeichnis = _cache_pfad(pfad, cache_dir)
+    if not os.path.isdir(verzeichnis):
+        return
+    for name in os.listdir(verzeichnis):
+        os.remove(os.path.join(verzeichnis, name))
+    os.rmdir(verzeichnis)
@@ -0,0 +1,124 @@
+import hashlib
+import os
+
+import numpy as np
+from scipy.signal import butter, iirnotch, sosfilt, sosfilt_zi, tf2sos
+
+from ekg_cache import ABTASTRATE_HZ, CACHE_DIR, abgeleitete_datei, lade_ekg_arrays
+from messung import gemessen, messungen
+
+# Bandpass gegen Grundlinienschwankung (unten) und Muskelrauschen (oben), Kerbfilter gegen Netzbrummen
+BAND_HZ = (0.5, 40)
+BAND_ORDNUNG = 2
+NETZ_HZ = 50
+NOTCH_GUETE = 30
+
+# Messwerte pro Block; außer dem Ergebnis wird nur Speicher für einen Block gebraucht
+CHUNK_MESSWERTE = 1 << 20
+
+
+def filter_sos(abtastrate_hz=ABTASTRATE_HZ, band_hz=BAND_HZ, netz_hz=NETZ_HZ, guete=NOTCH_GUETE):
+    """Entwirft Bandpass (Butterworth) und Kerbfilter als eine Kaskade von Filtern zweiter Ordnung (SOS).
+
+        Input:
+        abtastrate_hz (int, optional): Abtastrate der Aufnahme.
+        band_hz (tuple, optional): Durchlassbereich des Bandpasses.
+        netz_hz (float, optional): Netzfrequenz für den Kerbfilter, None ohne Kerbfilter.
+        guete (float, optional): Güte des Kerbfilters (höher = schmaler).
+
+        Output:
+        SOS-Array mit einer Zeile pro Filterstufe."""
+    teile = [butter(BAND_ORDNUNG, band_hz, btype="bandpass", fs=abtastrate_hz, output="sos")]
+    if netz_hz is not None and netz_hz < abtastrate_hz / 2:
+        teile.append(tf2sos(*iirnotch(netz_hz, guete, fs=abtastrate_hz)))
+    return np.vstack(teile)
+
+
+def _randlaenge(sos, n):
+    # Länge der ungeraden Fortsetzung an den Rändern wie bei scipy.signal.sosfiltfilt
+    ntaps = 2 * len(sos) + 1 - min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+    return min(3 * int(ntaps), n - 1)
+
+
+def filtere_nullphasig(werte, sos, ziel=None, chunk=CHUNK_MESSWERTE):
+    """Filtert vorwärts und rückwärts (ohne Phasenverschiebung) wie scipy.signal.sosfiltfilt, aber blockweise:
+    Der Zustand der Filter wird von Block zu Block weitergegeben, das Zwischenergebnis der Vorwärtsrichtung
+    liegt schon in ziel. So reicht für lange Aufnahmen ein Block Arbeitsspeicher neben dem Ergebnis,
+    das auch eine Datei sein kann (np.memmap).
+
+        Input:
+        werte: Messwerte (Array oder gemappte Datei).
+        sos: Filter aus filter_sos.
+        ziel (optional): Float-Array gleicher Länge für das Ergebnis.
+        chunk (int, optional): Messwerte pro Block.
+
+        Output:
+        ziel mit dem gefilterten Signal."""
+    n = len(werte)
+    if ziel is None:
+        ziel = np.empty(n, dtype=np.float64)
+    if n < 2:
+        ziel[:] = werte
+        return ziel
+
+    # Ungerade Fortsetzung an beiden Rändern, damit die Filter ohne Sprung ein- und ausschwingen
+    rand = _randlaenge(sos, n)
+    anfang = np.asarray(werte[:rand + 1], dtype=np.float64)
+    ende = np.asarray(werte[n - rand - 1:], dtype=np.float64)
+    vorlauf = 2 * anfang[0] - anfang[rand:0:-1]
+    nachlauf = 2 * ende[-1] - ende[-2::-1]
+    zi = sosfilt_zi(sos)
+
+    _, zustand = sosfilt(sos, vorlauf, zi=zi * vorlauf[0])
+    for start in range(0, n, chunk):
+        ziel[start:start + chunk], zustand = sosfilt(
+            sos, np.asarray(werte[start:start + chunk], dtype=np.float64), zi=zustand)
+    nachlauf, zustand = sosfilt(sos, nachlauf, zi=zustand)
+
+    # Rückwärts: erst über den gefilterten Nachlauf einschwingen, dann die Blöcke von hinten
+    _, zustand = sosfilt(sos, nachlauf[::-1], zi=zi * nachlauf[-1])
+    for start in range((n - 1) // chunk * chunk, -1, -chunk):
+        block, zustand = sosfilt(sos, np.asarray(ziel[start:start + chunk], dtype=np.float64)[::-1], zi=zustand)
+        ziel[start:start + chunk] = block[::-1]
+    return ziel
+
+
+def filter_schluessel(sos):
+    """Kurzer Schlüssel eines Filters für Dateinamen und Cache-Schlüssel."""
+    return hashlib.sha1(np.ascontiguousarray(sos, dtype=np.float64).tobytes()).hexdigest()[:16]
+
+
+@gemessen("ekg_filter.gefiltertes_signal")
+def gefiltertes_signal(pfad, sos=None, cache_dir=CACHE_DIR):
+    """Gibt das gefilterte Signal einer Aufnahme zurück. Es wird einmal pro Aufnahme und Filter blockweise
+    berechnet und neben den Rohdaten im Binär-Cache abgelegt (ekg_cache), danach nur noch gemappt.
+
+        Input:
+        pfad (str): Pfad zur EKG-Textdatei oder zum Archiv.
+        sos (optional): Filter aus filter_sos (Standard: Bandpass 0,5-40 Hz und Kerbfilter 50 Hz).
+        cache_dir (str, optional): Wurzelverzeichnis des Caches.
+
+        Output:
+        Gefiltertes Signal als float32-Array (schreibgeschützt), um 0 statt um die Grundlinie."""
+    sos = filter_sos() if sos is None else sos
+    # Legt den Cache der Rohdaten an bzw. baut ihn neu, wobei alte abgeleitete Dateien verschwinden
+    werte, _ = lade_ekg_arrays(pfad, cache_dir)
+    ziel = abgeleitete_datei(pfad, f"gefiltert_{filter_schluessel(sos)}", cache_dir)
+    if os.path.exists(ziel):
+        messungen.zaehle("filter_cache_treffer")
+        return np.load(ziel, mmap_mode="r")
+
+    messungen.zaehle("messwerte_gefiltert", len(werte))
+    if len(werte) < 2:
+        return filtere_nullphasig(werte, sos).astype(np.float32)
+    tmp = f"{ziel}.{os.getpid()}.tmp"
+    try:
+        ausgabe = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(len(werte),))
+    except OSError:
+        # Cache nicht beschreibbar -> im Speicher filtern
+        return filtere_nullphasig(werte, sos).astype(np.float32)
+    filtere_nullphasig(werte, sos, ausgabe)
+    ausgabe.flush()
+    del ausgabe
+    os.replace(tmp, ziel)
+    return np.load(ziel, mmap_mode="r")
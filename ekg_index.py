@@ -0,0 +1,201 @@
+import os
+import sqlite3
+import threading
+from datetime import date
+
+import pandas as pd
+
+from ekg_batch import (ANALYSE_KENNUNG, alter_bei_aufnahme, analysiere_auftraege, berechne_ekg_stats, datum_iso,
+                       erstelle_auftrag, stats_tabelle)
+from ekg_jobs import ist_fertig
+from read_data import find_person_data_by_ekg_id, find_person_data_by_id, personen_ansicht
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ekg_zusammenfassung (
+    ekg_id INTEGER PRIMARY KEY,
+    person_id INTEGER NOT NULL,
+    datum TEXT NOT NULL,
+    datum_iso TEXT,
+    "alter" INTEGER,
+    laenge_min REAL,
+    anzahl_beats INTEGER,
+    hr_mittel_bpm REAL,
+    hr_min_bpm REAL,
+    hr_max_bpm REAL,
+    rmssd_ms REAL,
+    anzahl_anomalien INTEGER,
+    signalqualitaet REAL,
+    sha256 TEXT,
+    mtime_ns INTEGER,
+    groesse INTEGER,
+    analyse_version TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_zusammenfassung_person ON ekg_zusammenfassung (person_id, datum_iso);
+CREATE INDEX IF NOT EXISTS idx_zusammenfassung_datum ON ekg_zusammenfassung (datum_iso);
+"""
+
+# "alter" ist ein SQL-Schlüsselwort, daher werden alle Spaltennamen in Abfragen gequotet
+SPALTEN = ("ekg_id", "person_id", "datum", "datum_iso", "alter", "laenge_min", "anzahl_beats", "hr_mittel_bpm",
+           "hr_min_bpm", "hr_max_bpm", "rmssd_ms", "anzahl_anomalien", "signalqualitaet", "sha256", "mtime_ns",
+           "groesse", "analyse_version")
+_SPALTEN_SQL = ", ".join(f'"{spalte}"' for spalte in SPALTEN)
+
+# Spalten, die erst nach der ersten Version dazukamen und in bestehenden Indizes ergänzt werden
+NACHTRAEGLICHE_SPALTEN = ("analyse_version TEXT",)
+
+
+class EKGIndex:
+    """Persistenter Index mit einer kompakten Zeile pro EKG (Länge, HR, HRV, Anomalie-Episoden, Signalqualität).
+    Eine Zeile wird nur neu berechnet, wenn das EKG neu ist, sich Änderungszeit bzw. Größe seiner Datei,
+    Datum oder Alter bei der Aufnahme geändert haben oder sie mit einer anderen Analyseversion
+    (ekg_batch.ANALYSE_KENNUNG) berechnet wurde; Vergleichstabelle und HRV-Verlauf lesen danach nur noch
+    aus dem Index.
+
+    Die Anomalie-Episoden (wie in der App) beziehen sich auf das Alter der Person am Tag der Aufnahme."""
+
+    def __init__(self, pfad="data/ekg_index.sqlite"):
+        self.pfad = pfad
+        self._lokal = threading.local()
+        with self._verbindung() as con:
+            con.executescript(SCHEMA)
+            vorhanden = {zeile[1] for zeile in con.execute("PRAGMA table_info(ekg_zusammenfassung)")}
+            for spalte in NACHTRAEGLICHE_SPALTEN:
+                if spalte.split()[0] not in vorhanden:
+                    con.execute(f"ALTER TABLE ekg_zusammenfassung ADD COLUMN {spalte}")
+
+    def _verbindung(self):
+        """Gibt die Verbindung des aktuellen Threads zurück und legt sie bei Bedarf an."""
+        con = getattr(self._lokal, "con", None)
+        if con is None:
+            os.makedirs(os.path.dirname(self.pfad) or ".", exist_ok=True)
+            con = sqlite3.connect(self.pfad, timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            self._lokal.con = con
+        return con
+
+    def _veraltet(self, ekg_dicts):
+        """Gibt die EKGs zurück, deren Zeile fehlt, nicht mehr zur Datei passt, von einer anderen
+        Analyseversion stammt oder nicht mehr zu Datum und Alter passt (z.B. nach Ändern des Geburtsdatums
+        der Person oder des Aufnahmedatums; die Anomalien hängen vom Alter ab).
+
+            Output:
+            Liste von Tupeln (EKG-Dictionary, Person); EKGs ohne Person oder Datei fehlen."""
+        if not ekg_dicts:
+            return []
+        ids = [int(ekg["id"]) for ekg in ekg_dicts]
+        platzhalter = ",".join("?" * len(ids))
+        bekannt = {zeile[0]: zeile[1:] for zeile in self._verbindung().execute(
+            f'SELECT ekg_id, mtime_ns, groesse, analyse_version, person_id, datum, "alter" '
+            f"FROM ekg_zusammenfassung WHERE ekg_id IN ({platzhalter})", ids)}
+        veraltet = []
+        for ekg in ekg_dicts:
+            person = find_person_data_by_ekg_id(ekg["id"])
+            if not person:
+                continue
+            try:
+                stat = os.stat(ekg["result_link"])
+            except OSError:
+                continue
+            aktuell = (stat.st_mtime_ns, stat.st_size, ANALYSE_KENNUNG, person["id"], ekg["date"],
+                       alter_bei_aufnahme(person, ekg))
+            if bekannt.get(int(ekg["id"])) != aktuell:
+                veraltet.append((ekg, person))
+        return veraltet
+
+    def aktualisiere(self, ekg_dicts, parallel=True):
+        """Berechnet die Zeilen aller übergebenen EKGs neu, die fehlen oder veraltet sind.
+        Mehrere EKGs werden im gemeinsamen Prozess-Pool aus ekg_batch ausgewertet.
+
+            Input:
+            ekg_dicts (list): EKG-Dictionaries (id, date, result_link).
+            parallel (bool, optional): False rechnet alles im aktuellen Prozess.
+
+            Output:
+            Anzahl neu berechneter Zeilen."""
+        # Noch nicht fertig verarbeitete Uploads haben keine Datei
+        ekg_dicts = [ekg for ekg in ekg_dicts if ist_fertig(ekg)]
+        auftraege = [erstelle_auftrag(ekg, person) for ekg, person in self._veraltet(ekg_dicts)]
+        if not auftraege:
+            return 0
+
+        ergebnisse = analysiere_auftraege(auftraege, parallel)
+        zeilen = []
+        for zusammenfassung, _ in ergebnisse:
+            zusammenfassung["datum_iso"] = datum_iso(zusammenfassung["datum"])
+            zeilen.append(tuple(zusammenfassung[spalte] for spalte in SPALTEN))
+        with self._verbindung() as con:
+            con.executemany(
+                f"INSERT OR REPLACE INTO ekg_zusammenfassung ({_SPALTEN_SQL}) VALUES ({', '.join('?' * len(SPALTEN))})",
+                zeilen)
+        return len(zeilen)
+
+    def _abfrage(self, where="", parameter=()):
+        zeilen = self._verbindung().execute(
+            f"SELECT {_SPALTEN_SQL} FROM ekg_zusammenfassung {where} ORDER BY datum_iso, ekg_id", parameter)
+        return pd.DataFrame(zeilen.fetchall(), columns=SPALTEN)
+
+    @staticmethod
+    def _zeitraum(von, bis):
+        """Baut die Bedingung für einen Datumsbereich (date oder ISO-String, jeweils einschließlich)."""
+        bedingungen, parameter = [], []
+        if von is not None:
+            bedingungen.append("datum_iso >= ?")
+            parameter.append(von.isoformat() if isinstance(von, date) else von)
+        if bis is not None:
+            bedingungen.append("datum_iso <= ?")
+            parameter.append(bis.isoformat() if isinstance(bis, date) else bis)
+        return bedingungen, parameter
+
+    def fuer_person(self, person_id, von=None, bis=None):
+        """Gibt alle Zeilen einer Person (optional in einem Datumsbereich) nach Datum sortiert zurück.
+
+            Input:
+            person_id: ID der Versuchsperson.
+            von, bis (date or str, optional): Datumsbereich, jeweils einschließlich.
+
+            Output:
+            DataFrame mit einer Zeile pro EKG."""
+        person = find_person_data_by_id(person_id)
+        self.aktualisiere(person.get("ekg_tests", []))
+        bedingungen, parameter = self._zeitraum(von, bis)
+        return self._abfrage("WHERE " + " AND ".join(["person_id = ?"] + bedingungen), [int(person_id)] + parameter)
+
+    def im_zeitraum(self, von=None, bis=None):
+        """Gibt die Zeilen aller Personen in einem Datumsbereich zurück."""
+        self.aktualisiere([ekg for person in personen_ansicht() for ekg in person.get("ekg_tests", [])])
+        bedingungen, parameter = self._zeitraum(von, bis)
+        return self._abfrage(("WHERE " + " AND ".join(bedingungen)) if bedingungen else "", parameter)
+
+    def vergleichstabelle(self, ekg_dicts):
+        """Gibt die Kennzahlen mehrerer EKGs im Format von ekg_batch.stats_tabelle zurück (passend für plot_HFV).
+        EKGs ohne Person in der Personendatenbank stehen nicht im Index und werden mit
+        ekg_batch.berechne_ekg_stats direkt ausgewertet.
+
+            Input:
+            ekg_dicts (list): EKG-Dictionaries.
+
+            Output:
+            DataFrame mit einer Zeile pro EKG in der Reihenfolge der Eingabe."""
+        ekg_dicts = [ekg for ekg in ekg_dicts if ekg]
+        self.aktualisiere(ekg_dicts)
+        ids = [int(ekg["id"]) for ekg in ekg_dicts]
+        if not ids:
+            return pd.DataFrame()
+        df = stats_tabelle(self._abfrage(f"WHERE ekg_id IN ({','.join('?' * len(ids))})", ids))
+        im_index = set(df["EKG-ID"]) if not df.empty else set()
+        fehlend = [ekg for ekg in ekg_dicts
+                   if int(ekg["id"]) not in im_index and ist_fertig(ekg) and os.path.exists(ekg["result_link"])]
+        if fehlend:
+            df = pd.concat([df, berechne_ekg_stats(fehlend)], ignore_index=True)
+        reihenfolge = {ekg_id: i for i, ekg_id in reversed(list(enumerate(ids)))}
+        df = df.sort_values("EKG-ID", key=lambda spalte: spalte.map(reihenfolge), kind="stable")
+        return df.reset_index(drop=True)
+
+_index = None
+
+def get_index():
+    """Gibt die gemeinsame Index-Instanz der App zurück (beim ersten Zugriff angelegt)."""
+    global _index
+    if _index is None:
+        _index = EKGIndex()
+    return _index
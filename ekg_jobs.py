@@ -0,0 +1,178 @@
+import atexit
+import glob
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ekg_archiv import ENDUNG, ist_archiv, schreibe_archiv
+from ekg_cache import lade_ekg_arrays, lies_quelle
+from ekgdaten import EKGdata
+from person import Person
+from read_data import add_ekg_test, find_person_data_by_id, personen_ansicht, update_ekg_test
+
+# Status eines hochgeladenen EKGs im Feld "status" des EKG-Eintrags; Einträge ohne Status gelten als fertig
+WARTEND = "wartend"
+LAEUFT = "läuft"
+FERTIG = "fertig"
+FEHLER = "fehler"
+
+# Schritte der Verarbeitung, ihr Text steht während des Laufs in "status_text"
+SCHRITTE = ("Datei wird geprüft und archiviert", "Umwandlung ins Binärformat", "Peaks, Herzfrequenz und Anomalien werden berechnet")
+
+# Mindestlänge einer Aufnahme (5 s bei 500 Hz), kürzere Dateien werden abgelehnt
+MIN_MESSWERTE = 2500
+
+# Threads statt Prozesse: die Ergebnisse landen so direkt im Analyse-Cache der App
+MAX_JOBS = 2
+
+_pool = None
+_pool_lock = threading.Lock()
+_abgebrochene_markiert = False
+
+
+def ist_fertig(ekg_dict):
+    """Prüft, ob ein EKG ausgewertet werden kann (alte Einträge ohne Status gelten als fertig)."""
+    return ekg_dict.get("status", FERTIG) == FERTIG
+
+
+def pruefe_ekg_datei(pfad):
+    """Prüft, ob eine Datei eine gültige EKG-Aufnahme ist (Textdatei mit zwei Ganzzahlspalten oder Archiv,
+    genug Messwerte, überwiegend steigende Zeitachse).
+
+        Input:
+        pfad (str): Pfad zur hochgeladenen Datei.
+
+        Output:
+        Tupel (messwerte, zeit_in_ms); bei ungültigen Dateien ValueError mit Beschreibung."""
+    try:
+        werte, zeit = lies_quelle(pfad)
+    except Exception as fehler:
+        raise ValueError(f"Datei ist keine zweispaltige EKG-Textdatei ({fehler})")
+    if not (np.issubdtype(werte.dtype, np.number) and np.issubdtype(zeit.dtype, np.integer)):
+        raise ValueError("Messwerte und Zeit müssen Zahlen sein, die Zeit in ganzen ms")
+    if len(werte) < MIN_MESSWERTE:
+        raise ValueError(f"Aufnahme zu kurz ({len(werte)} Messwerte, mindestens {MIN_MESSWERTE})")
+    if np.mean(np.diff(zeit) > 0) < 0.99:
+        raise ValueError("Zeitspalte ist nicht aufsteigend")
+    return werte, zeit
+
+
+def fortschritt(ekg_dict):
+    """Gibt den Fortschritt eines EKG-Jobs als Zahl zwischen 0 und 1 zurück."""
+    status = ekg_dict.get("status", FERTIG)
+    if status in (FERTIG, FEHLER):
+        return 1.0
+    if status == LAEUFT and ekg_dict.get("status_text") in SCHRITTE:
+        return (SCHRITTE.index(ekg_dict["status_text"]) + 0.5) / len(SCHRITTE)
+    return 0.0
+
+
+def _get_pool():
+    """Gibt den gemeinsamen Thread-Pool für Uploads zurück (einmal pro Prozess gestartet)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=MAX_JOBS, thread_name_prefix="ekg-upload")
+            atexit.register(_pool.shutdown, wait=False)
+    return _pool
+
+
+def _setze_status(ekg_id, status, text):
+    update_ekg_test(ekg_id, status=status, status_text=text)
+
+
+def markiere_abgebrochene():
+    """Markiert Uploads, die beim Beenden des letzten Serverprozesses noch wartend oder in Arbeit waren, als
+    fehlgeschlagen und entfernt ihre halb geschriebenen Dateien. Neu einreihen geht nicht, da die hochgeladenen
+    Daten nur im Speicher des alten Prozesses lagen. Läuft einmal pro Prozess und nur, solange dieser Prozess
+    selbst noch keinen Upload angenommen hat.
+
+        Output:
+        Liste der IDs der als fehlgeschlagen markierten EKGs."""
+    global _abgebrochene_markiert
+    with _pool_lock:
+        if _abgebrochene_markiert or _pool is not None:
+            return []
+        _abgebrochene_markiert = True
+
+    markiert = []
+    for person_dict in personen_ansicht():
+        for ekg_dict in person_dict.get("ekg_tests", []):
+            if ekg_dict.get("status") not in (WARTEND, LAEUFT):
+                continue
+            for tmp in glob.glob(f"{glob.escape(ekg_dict['result_link'])}.*.upload"):
+                os.remove(tmp)
+            _setze_status(ekg_dict["id"], FEHLER, "Verarbeitung durch Neustart des Servers abgebrochen, bitte erneut hochladen")
+            markiert.append(ekg_dict["id"])
+    return markiert
+
+
+def verarbeite_upload(ekg_dict, daten, alter):
+    """Verarbeitet ein hochgeladenes EKG (läuft im Hintergrund-Thread): Datei prüfen und als Archiv
+    (ekg_archiv) ablegen, in den Binär-Cache umwandeln und Peaks, HR, HRV und Anomalien vorab berechnen.
+    Der Fortschritt wird im EKG-Eintrag der Personendatenbank festgehalten.
+
+        Input:
+        ekg_dict (dict): Neuer EKG-Eintrag (id, date, result_link).
+        daten (bytes): Inhalt der hochgeladenen Datei (Text oder Archiv).
+        alter (int): Alter der Person, für das die Anomalien vorab berechnet werden.
+
+        Output:
+        Status nach Abschluss (FERTIG oder FEHLER)."""
+    ekg_id = ekg_dict["id"]
+    ziel = ekg_dict["result_link"]
+    tmp = f"{ziel}.{os.getpid()}.upload"
+    try:
+        _setze_status(ekg_id, LAEUFT, SCHRITTE[0])
+        os.makedirs(os.path.dirname(ziel) or ".", exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(daten)
+        if ist_archiv(tmp):
+            pruefe_ekg_datei(tmp)
+            # Erst die geprüfte Datei erscheint unter result_link
+            os.replace(tmp, ziel)
+        else:
+            # Textdateien werden als komprimiertes Archiv abgelegt (atomar, erst nach der Prüfung)
+            schreibe_archiv(ziel, *pruefe_ekg_datei(tmp))
+            os.remove(tmp)
+
+        _setze_status(ekg_id, LAEUFT, SCHRITTE[1])
+        lade_ekg_arrays(ziel)
+
+        _setze_status(ekg_id, LAEUFT, SCHRITTE[2])
+        ekg = EKGdata(ekg_dict)
+        peaks = ekg.find_peaks()
+        anomalien = ekg.detect_anomalies(peaks, alter)
+        rr = ekg.rr_intervalle(peaks)
+        # Zeile im Übersichtsindex anlegen; erst hier importiert, da ekg_index seinerseits ekg_jobs importiert (ist_fertig)
+        from ekg_index import get_index
+        get_index().aktualisiere([ekg_dict], parallel=False)
+        _setze_status(ekg_id, FERTIG, f"{len(peaks)} Schläge, Ø {rr.mittlere_hr:.0f} bpm, {len(anomalien)} Anomalie-Episoden")
+        return FERTIG
+    except Exception as fehler:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        _setze_status(ekg_id, FEHLER, str(fehler))
+        return FEHLER
+
+
+def reiche_upload_ein(person_id, date, daten):
+    """Legt den EKG-Eintrag sofort an (Status "wartend") und verarbeitet die Datei im Hintergrund.
+    Das Formular blockiert damit nicht, auch nicht bei großen Dateien.
+
+        Input:
+        person_id: ID der Versuchsperson.
+        date (str): Datum des EKGs.
+        daten (bytes): Inhalt der hochgeladenen Datei.
+
+        Output:
+        Tupel (neuer EKG-Eintrag, Future des Hintergrund-Jobs)."""
+    # Uploads werden als Archiv gespeichert (data/ekg_data/<id>.ekgz statt .txt); Pfad und Status in einem
+    # Schreibvorgang, damit die JSON-Datenbank nur einmal neu geschrieben wird
+    ekg_dict = add_ekg_test(person_id, date, endung=ENDUNG, status=WARTEND, status_text="Wartet auf Verarbeitung")
+    # Alter wie in der Ansicht (heute), damit die vorab berechneten Anomalien dort direkt aus dem Cache kommen
+    alter = Person(find_person_data_by_id(person_id)).calc_age()
+    future = _get_pool().submit(verarbeite_upload, ekg_dict, bytes(daten), alter)
+    return ekg_dict, future
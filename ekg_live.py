@@ -0,0 +1,307 @@
+import socket
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from ekg_cache import ABTASTRATE_HZ
+from ekg_speicher import aufnahme_speicher
+from peak_stream import StreamingPeakDetektor
+
+
+class ZeilenParser:
+    """Zerlegt einen Bytestrom im Format der EKG-Textdateien ("Messwert<TAB>Zeit" pro Zeile) in Arrays.
+    Eine unvollständige letzte Zeile wird bis zum nächsten Aufruf aufgehoben; fehlerhafte Zeilen (falsche
+    Spaltenzahl, keine Ganzzahlen) werden verworfen und in verworfen gezählt, statt die Sitzung zu beenden."""
+
+    def __init__(self):
+        self._rest = b""
+        self.verworfen = 0
+
+    def fuettern(self, daten):
+        """Gibt (messwerte, zeit_in_ms) aller vollständigen, gültigen Zeilen zurück."""
+        daten = self._rest + daten
+        ende = daten.rfind(b"\n") + 1
+        self._rest = daten[ende:]
+        if not ende:
+            leer = np.empty(0, dtype=np.int64)
+            return leer, leer
+        try:
+            # sep=" " trennt an beliebigem Leerraum, also an Tabulatoren und Zeilenumbrüchen
+            zahlen = np.fromstring(daten[:ende], dtype=np.int64, sep=" ")
+        except ValueError:
+            zahlen = None
+        # Schneller Weg nur, wenn jede Zeile genau zwei Zahlen ergeben hat (wie ekg_cache._lies_textdatei)
+        if zahlen is None or len(zahlen) != 2 * daten.count(b"\n", 0, ende):
+            zahlen = self._zeilenweise(daten[:ende])
+        zahlen = zahlen.reshape(-1, 2)
+        return zahlen[:, 0], zahlen[:, 1]
+
+    def _zeilenweise(self, daten):
+        """Parst Zeile für Zeile und verwirft fehlerhafte Zeilen (leere Zeilen zählen nicht als Fehler)."""
+        zahlen = []
+        for zeile in daten.splitlines():
+            teile = zeile.split()
+            if not teile:
+                continue
+            try:
+                if len(teile) != 2:
+                    raise ValueError
+                zahlen.extend((int(teile[0]), int(teile[1])))
+            except ValueError:
+                self.verworfen += 1
+        return np.array(zahlen, dtype=np.int64)
+
+
+def wiedergabe_quelle(pfad, stopp, geschwindigkeit=1.0, block_ms=100):
+    """Spielt eine vorhandene Aufnahme in Echtzeit ab (Ersatz für ein Messgerät).
+
+        Input:
+        pfad (str): Pfad zur EKG-Textdatei.
+        stopp (threading.Event): Beendet die Wiedergabe.
+        geschwindigkeit (float, optional): Faktor gegenüber Echtzeit.
+        block_ms (int, optional): Länge der ausgegebenen Blöcke in ms.
+
+        Output:
+        Generator über Tupel (messwerte, zeit_in_ms)."""
+    pro_block = max(1, block_ms * ABTASTRATE_HZ // 1000)
+    # Dieselbe Aufnahme wie in der Ansicht, gehalten bis die Wiedergabe endet
+    with aufnahme_speicher.ausleihen(pfad) as (werte, zeit):
+        start = time.monotonic()
+        for nummer, anfang in enumerate(range(0, len(werte), pro_block)):
+            faellig = start + nummer * pro_block / ABTASTRATE_HZ / geschwindigkeit
+            if stopp.wait(max(0.0, faellig - time.monotonic())):
+                return
+            yield werte[anfang:anfang + pro_block], zeit[anfang:anfang + pro_block]
+
+
+def socket_quelle(host, port, stopp, timeout=0.5):
+    """Liest Messwerte von einem Gerät, das sie über TCP zeilenweise ("Messwert<TAB>Zeit") sendet."""
+    parser = ZeilenParser()
+    with socket.create_connection((host, port), timeout=5) as verbindung:
+        verbindung.settimeout(timeout)
+        while not stopp.is_set():
+            try:
+                daten = verbindung.recv(65536)
+            except socket.timeout:
+                continue
+            if not daten:
+                return
+            werte, zeit = parser.fuettern(daten)
+            if len(werte):
+                yield werte, zeit
+
+
+def pipe_quelle(pfad, stopp):
+    """Liest Messwerte zeilenweise aus einer Pipe oder FIFO (z.B. mkfifo oder "-" für stdin)."""
+    parser = ZeilenParser()
+    datei = sys.stdin.buffer if pfad == "-" else open(pfad, "rb", buffering=0)
+    try:
+        while not stopp.is_set():
+            daten = datei.read1(65536) if hasattr(datei, "read1") else datei.read(65536)
+            if not daten:
+                return
+            werte, zeit = parser.fuettern(daten)
+            if len(werte):
+                yield werte, zeit
+    finally:
+        if datei is not sys.stdin.buffer:
+            datei.close()
+
+
+class RingPuffer:
+    """Hält die letzten kapazitaet Samples (Messwert, Zeit, Ankunftszeit) in festen Arrays."""
+
+    def __init__(self, kapazitaet):
+        self.kapazitaet = kapazitaet
+        self.werte = np.zeros(kapazitaet, dtype=np.int32)
+        self.zeit = np.zeros(kapazitaet, dtype=np.int64)
+        self.ankunft = np.zeros(kapazitaet)
+        # Globaler Index des nächsten Samples
+        self.anzahl = 0
+
+    def anhaengen(self, werte, zeit, ankunft):
+        """Schreibt einen Block in den Puffer; bei Überlauf bleiben nur die neuesten Samples."""
+        n = len(werte)
+        if n > self.kapazitaet:
+            werte, zeit, self.anzahl = werte[-self.kapazitaet:], zeit[-self.kapazitaet:], self.anzahl + n - self.kapazitaet
+            n = self.kapazitaet
+        idx = (self.anzahl + np.arange(n)) % self.kapazitaet
+        self.werte[idx] = werte
+        self.zeit[idx] = zeit
+        self.ankunft[idx] = ankunft
+        self.anzahl += n
+
+    def enthaelt(self, index):
+        return self.anzahl - self.kapazitaet <= index < self.anzahl
+
+    def bei(self, index):
+        """Gibt (Messwert, Zeit, Ankunftszeit) des Samples mit globalem Index zurück."""
+        i = index % self.kapazitaet
+        return int(self.werte[i]), int(self.zeit[i]), float(self.ankunft[i])
+
+    def letzte(self, anzahl):
+        """Gibt die letzten anzahl Samples in zeitlicher Reihenfolge zurück (Kopie)."""
+        anzahl = min(anzahl, self.anzahl, self.kapazitaet)
+        idx = (self.anzahl - anzahl + np.arange(anzahl)) % self.kapazitaet
+        return self.werte[idx], self.zeit[idx]
+
+
+class LiveAnalyse:
+    """Inkrementelle Auswertung eines Live-Signals: R-Peaks über den StreamingPeakDetektor,
+    gleitende HR und RMSSD über die letzten Schläge mit laufenden Summen (konstanter Aufwand pro Schlag)
+    und Alarme nach denselben altersabhängigen Grenzen wie detect_anomalies."""
+
+    def __init__(self, alter, min_hr=40, fenster_beats=30, puffer_sekunden=60,
+                 distance=200, height=340, prominence=30, max_alarme=200):
+        self.max_hr = 220 - alter
+        self.min_hr = min_hr
+        self.puffer = RingPuffer(puffer_sekunden * ABTASTRATE_HZ)
+        # Frühe Ausgabe, damit Peaks auch bei langen Distanz-Ketten (Belastung) nach ~1-2 s feststehen
+        self.detektor = StreamingPeakDetektor(distance=distance, height=height, prominence=prominence,
+                                              fruehe_ausgabe=True)
+        self._letzter_index = -1
+
+        self.fenster_beats = fenster_beats
+        self._rr = deque()
+        self._rr_summe = 0.0
+        self._quadrate = deque()
+        self._quadrat_summe = 0.0
+        self._letzter_peak = None
+        self.peaks = deque(maxlen=fenster_beats * 10)
+        self.alarme = deque(maxlen=max_alarme)
+
+    def verarbeite(self, werte, zeit, ankunft=None):
+        """Nimmt den nächsten Block entgegen und gibt die neu ausgelösten Alarme zurück.
+
+            Input:
+            werte, zeit: Arrays mit Messwerten und Zeitpunkten in ms.
+            ankunft (float, optional): Empfangszeitpunkt (time.time()) für die Latenzmessung.
+
+            Output:
+            Liste von Alarm-Dictionaries (zeit_ms, bpm, latenz_s)."""
+        ankunft = time.time() if ankunft is None else ankunft
+        self.puffer.anhaengen(werte, zeit, ankunft)
+        neue = []
+        for index in self.detektor.verarbeite(werte).tolist():
+            # Seltene nachträglich bestätigte Peaks vor dem letzten Schlag ändern die laufenden Summen nicht mehr
+            if index <= self._letzter_index or not self.puffer.enthaelt(index):
+                continue
+            self._letzter_index = index
+            wert, peak_zeit, peak_ankunft = self.puffer.bei(index)
+            self.peaks.append((peak_zeit, wert))
+            alarm = self._neuer_schlag(peak_zeit, peak_ankunft)
+            if alarm is not None:
+                neue.append(alarm)
+        self.alarme.extend(neue)
+        return neue
+
+    def _neuer_schlag(self, peak_zeit, peak_ankunft):
+        """Aktualisiert die laufenden Summen mit einem neuen RR-Intervall und prüft die Grenzen."""
+        vorher, self._letzter_peak = self._letzter_peak, peak_zeit
+        if vorher is None:
+            return None
+        rr = peak_zeit - vorher
+        if rr <= 0:
+            # Zeitsprung in der Aufnahme -> wie in RRIntervalle kein gültiges Intervall
+            return None
+
+        if self._rr:
+            quadrat = float(rr - self._rr[-1]) ** 2
+            self._quadrate.append(quadrat)
+            self._quadrat_summe += quadrat
+            if len(self._quadrate) > self.fenster_beats - 1:
+                self._quadrat_summe -= self._quadrate.popleft()
+        self._rr.append(rr)
+        self._rr_summe += rr
+        if len(self._rr) > self.fenster_beats:
+            self._rr_summe -= self._rr.popleft()
+
+        bpm = 60000 / rr
+        if self.min_hr <= bpm <= self.max_hr:
+            return None
+        return {"zeit_ms": (vorher + peak_zeit) / 2, "bpm": bpm, "latenz_s": time.time() - peak_ankunft}
+
+    @property
+    def hr(self):
+        """Mittlere Herzfrequenz über die letzten Schläge (bpm) oder None."""
+        return 60000 * len(self._rr) / self._rr_summe if self._rr else None
+
+    @property
+    def rmssd(self):
+        """RMSSD über die letzten Schläge (ms) oder None."""
+        return float(np.sqrt(max(self._quadrat_summe, 0) / len(self._quadrate))) if self._quadrate else None
+
+
+class LiveSitzung:
+    """Liest eine Quelle in einem Hintergrund-Thread und führt die LiveAnalyse nach.
+    Die Oberfläche liest nur Momentaufnahmen aus dem Ringpuffer und blockiert nie auf die Quelle."""
+
+    def __init__(self, quelle_fabrik, alter, **analyse_parameter):
+        """Input:
+            quelle_fabrik: Funktion, die mit einem threading.Event aufgerufen wird und einen Generator
+                über (messwerte, zeit_in_ms) zurückgibt, z.B. lambda stopp: wiedergabe_quelle(pfad, stopp).
+            alter: Alter der Person für die Alarmgrenzen."""
+        self.analyse = LiveAnalyse(alter, **analyse_parameter)
+        self._quelle_fabrik = quelle_fabrik
+        self._stopp = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.fehler = None
+
+    def starte(self):
+        self._thread = threading.Thread(target=self._laufen, daemon=True)
+        self._thread.start()
+        return self
+
+    def stoppe(self):
+        self._stopp.set()
+
+    @property
+    def laeuft(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _laufen(self):
+        try:
+            for werte, zeit in self._quelle_fabrik(self._stopp):
+                with self._lock:
+                    self.analyse.verarbeite(werte, zeit)
+        except Exception as fehler:
+            self.fehler = fehler
+
+    def zustand(self, sekunden=10):
+        """Momentaufnahme für die Anzeige.
+
+            Output:
+            Dictionary mit Zeit und Messwerten der letzten Sekunden, Peaks darin, HR, RMSSD und Alarmen."""
+        with self._lock:
+            werte, zeit = self.analyse.puffer.letzte(sekunden * ABTASTRATE_HZ)
+            beginn = zeit[0] if len(zeit) else 0
+            peaks = [p for p in self.analyse.peaks if p[0] >= beginn]
+            return {
+                "zeit": zeit,
+                "werte": werte,
+                "peaks": peaks,
+                "hr": self.analyse.hr,
+                "rmssd": self.analyse.rmssd,
+                "alarme": list(self.analyse.alarme)}
+
+
+if __name__ == "__main__":
+    pfad = sys.argv[1] if len(sys.argv) > 1 else "data/ekg_data/04_Belastung.txt"
+    sitzung = LiveSitzung(lambda stopp: wiedergabe_quelle(pfad, stopp), alter=30).starte()
+    try:
+        gemeldet = set()
+        while sitzung.laeuft:
+            time.sleep(1)
+            zustand = sitzung.zustand()
+            for alarm in zustand["alarme"]:
+                if alarm["zeit_ms"] not in gemeldet:
+                    gemeldet.add(alarm["zeit_ms"])
+                    print(f"Alarm bei {alarm['zeit_ms']:.0f} ms: {alarm['bpm']:.1f} bpm (Latenz {alarm['latenz_s']:.2f} s)")
+            if zustand["hr"] is not None:
+                print(f"HR {zustand['hr']:.0f} bpm, RMSSD {zustand['rmssd'] or 0:.0f} ms")
+    except KeyboardInterrupt:
+        sitzung.stoppe()
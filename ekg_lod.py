@@ -0,0 +1,132 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class MinMaxPyramide:
+    """Mehrstufige Min/Max-Zusammenfassung eines Signals für die Darstellung.
+
+    Stufe k fasst jeweils faktor**k Samples zu einem Eimer zusammen und merkt sich die Positionen
+    von Minimum und Maximum. Für einen Zeitbereich wird die gröbste Stufe gewählt, die noch etwa einen
+    Eimer pro Pixel liefert; pro Eimer werden Minimum und Maximum gezeichnet, sodass QRS-Spitzen
+    anders als bei einfachem Ausdünnen (jede n-te Zeile) sichtbar bleiben."""
+
+    def __init__(self, zeit, werte, faktor=4, min_eimer=256):
+        """Input:
+            zeit: Zeitpunkte in ms.
+            werte: Messwerte.
+            faktor (int, optional): Anzahl Eimer einer Stufe, die zu einem Eimer der nächsten zusammengefasst werden.
+            min_eimer (int, optional): Gröbste Stufe, die noch gebaut wird."""
+        self.zeit = np.asarray(zeit)
+        self.werte = np.asarray(werte)
+        self.faktor = faktor
+
+        # Monotone Abschnitte der Zeitachse (z.B. Zeitsprung in 04_Belastung), jeweils [start, ende)
+        spruenge = np.flatnonzero(np.diff(self.zeit) < 0) + 1
+        self.abschnitte = list(zip(np.concatenate(([0], spruenge)), np.concatenate((spruenge, [len(self.zeit)]))))
+
+        # Stufen als (eimer_groesse, idx_min, idx_max)
+        self.stufen = []
+        idx_min = idx_max = np.arange(len(self.werte))
+        groesse = 1
+        while len(idx_min) > min_eimer:
+            idx_min = self._verdichten(idx_min, np.argmin, np.inf)
+            idx_max = self._verdichten(idx_max, np.argmax, -np.inf)
+            groesse *= faktor
+            self.stufen.append((groesse, idx_min, idx_max))
+
+    def _verdichten(self, indizes, arg, fuellwert):
+        """Fasst je faktor Eimer zusammen und behält den Index des Extremwerts."""
+        rest = (-len(indizes)) % self.faktor
+        werte = np.concatenate((self.werte[indizes].astype(np.float64), np.full(rest, fuellwert)))
+        indizes = np.concatenate((indizes, np.full(rest, indizes[-1])))
+        gruppen = werte.reshape(-1, self.faktor)
+        auswahl = arg(gruppen, axis=1)
+        return indizes.reshape(-1, self.faktor)[np.arange(len(gruppen)), auswahl]
+
+    def _indexbereiche(self, x0, x1):
+        """Wandelt einen Zeitbereich in Indexbereiche je monotonem Abschnitt um."""
+        bereiche = []
+        for start, ende in self.abschnitte:
+            zeit = self.zeit[start:ende]
+            i0 = start + np.searchsorted(zeit, x0, side='left') if x0 is not None else start
+            i1 = start + np.searchsorted(zeit, x1, side='right') if x1 is not None else ende
+            if i1 > i0:
+                bereiche.append((int(i0), int(i1)))
+        return bereiche
+
+    def _punkte(self, i0, i1, pixel_breite):
+        """Indizes der darzustellenden Punkte für einen Indexbereich."""
+        anzahl = i1 - i0
+        if anzahl <= 2 * pixel_breite:
+            # Weit genug hineingezoomt -> Rohdaten
+            return np.arange(i0, i1)
+        groesse, idx_min, idx_max = 1, None, None
+        for stufe in self.stufen:
+            if anzahl // stufe[0] < pixel_breite:
+                break
+            groesse, idx_min, idx_max = stufe
+        if idx_min is None:
+            return np.arange(i0, i1)
+        e0, e1 = i0 // groesse, (i1 - 1) // groesse + 1
+        paare = np.stack((idx_min[e0:e1], idx_max[e0:e1]), axis=1)
+        # Minimum und Maximum eines Eimers in zeitlicher Reihenfolge
+        paare.sort(axis=1)
+        indizes = paare.ravel()
+        # Die Randeimer reichen über den Bereich hinaus (bei einem Zeitsprung bis in den anderen Abschnitt):
+        # nur Indizes im Bereich behalten und die echten Randpunkte ergänzen
+        indizes = indizes[(indizes >= i0) & (indizes < i1)]
+        return np.unique(np.concatenate(([i0], indizes, [i1 - 1])))
+
+    def ausschnitt(self, x0=None, x1=None, pixel_breite=1500):
+        """Gibt die Punkte zurück, die für den Zeitbereich [x0, x1] bei gegebener Breite nötig sind.
+
+            Input:
+            x0, x1 (optional): Zeitbereich in ms, None für Anfang bzw. Ende der Aufnahme.
+            pixel_breite (int, optional): Breite des Plots in Pixeln.
+
+            Output:
+            Tupel (zeit, werte) als Arrays; monotone Abschnitte sind durch NaN getrennt."""
+        teile_zeit, teile_werte = [], []
+        for i0, i1 in self._indexbereiche(x0, x1):
+            if teile_zeit:
+                teile_zeit.append([np.nan])
+                teile_werte.append([np.nan])
+            indizes = self._punkte(i0, i1, pixel_breite)
+            teile_zeit.append(self.zeit[indizes])
+            teile_werte.append(self.werte[indizes])
+        if not teile_zeit:
+            return np.empty(0), np.empty(0)
+        return np.concatenate(teile_zeit), np.concatenate(teile_werte)
+
+
+# Pyramiden der zuletzt angezeigten Aufnahmen, damit sie nicht bei jedem Rerun neu gebaut werden
+_PYRAMIDEN = OrderedDict()
+MAX_PYRAMIDEN = 8
+# Streamlit-Sitzungen laufen in eigenen Threads und teilen sich _PYRAMIDEN
+_pyramiden_lock = threading.Lock()
+
+
+def pyramide_fuer(schluessel, zeit, werte):
+    """Gibt die Pyramide einer Aufnahme zurück und baut sie nur, wenn sie noch nicht vorliegt.
+
+        Input:
+        schluessel: eindeutiger Schlüssel der Aufnahme (z.B. Pfad, mtime und Größe).
+        zeit, werte: Zeitpunkte und Messwerte.
+
+        Output:
+        MinMaxPyramide."""
+    with _pyramiden_lock:
+        if schluessel in _PYRAMIDEN:
+            _PYRAMIDEN.move_to_end(schluessel)
+            return _PYRAMIDEN[schluessel]
+    # Außerhalb der Sperre bauen, damit andere Sitzungen nicht warten; bauen zwei gleichzeitig,
+    # gewinnt die erste
+    pyramide = MinMaxPyramide(zeit, werte)
+    with _pyramiden_lock:
+        pyramide = _PYRAMIDEN.setdefault(schluessel, pyramide)
+        _PYRAMIDEN.move_to_end(schluessel)
+        while len(_PYRAMIDEN) > MAX_PYRAMIDEN:
+            _PYRAMIDEN.popitem(last=False)
+    return pyramide
@@ -0,0 +1,219 @@
+import hashlib
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.signal import find_peaks, peak_prominences
+
+from analyse_cache import analyse_cache
+from anomalie_episoden import als_arrays, anomalie_episoden, aus_arrays, flatline_episoden
+from detektoren import STANDARD_DETEKTOR, finde_r_zacken
+from ekg_cache import ABTASTRATE_HZ, inhalts_hash
+from hrv_fenster import FENSTER_MS, SCHRITT_MS, hrv_fenster
+from messung import messungen
+from peak_stream import waehle_nach_distanz
+from rr_intervalle import RRIntervalle
+
+# Parameter der Auswertung; alter muss für die Anomalien gesetzt werden. distance, height und prominence
+# gelten für den Detektor "schwelle", detektor_parameter (Tupel aus (Name, Wert)) für alle anderen.
+# Mit vorfilter=True laufen die Detektoren auf dem gefilterten Signal (ekg_filter), das um 0 liegt
+STANDARD_PARAMETER = {
+    "vorfilter": False,
+    "detektor": STANDARD_DETEKTOR,
+    "detektor_parameter": (),
+    "distance": 200,
+    "height": 340,
+    "prominence": 30,
+    "alter": None,
+    "min_hr": 40,
+    "fenster_ms": FENSTER_MS,
+    "schritt_ms": SCHRITT_MS}
+
+
+class Stufe:
+    """Eine Stufe der Auswertung mit ihren Eingaben (andere Stufen) und Parametern."""
+
+    def __init__(self, name, funktion, abhaengigkeiten=(), parameter=(), nach_inhalt=False, platte=None, auswahl=None):
+        """Input:
+            funktion: Wird mit (pipeline, Ergebnisse der Abhängigkeiten..., **parameter) aufgerufen.
+            abhaengigkeiten (tuple, optional): Alle Stufen, die die Stufe als Eingabe verwenden kann.
+            nach_inhalt (bool, optional): Nachfolgende Stufen hängen vom Inhalt des Ergebnisses ab statt von
+                seinen Parametern, z.B. rechnen sie nicht neu, wenn andere Parameter dieselben Peaks ergeben.
+            platte (tuple, optional): (in_arrays, aus_arrays) zum Ablegen in der Plattenebene des Analyse-Caches.
+            auswahl (optional): Gibt zu den Parametern der Pipeline die tatsächlich verwendeten Abhängigkeiten
+                zurück; nur diese werden berechnet und gehen in den Schlüssel ein."""
+        self.name = name
+        self.funktion = funktion
+        self.abhaengigkeiten = abhaengigkeiten
+        self.parameter = parameter
+        self.nach_inhalt = nach_inhalt
+        self.platte = platte
+        self.auswahl = auswahl
+
+    def eingaben(self, parameter):
+        """Gibt die Abhängigkeiten zurück, die bei diesen Parametern verwendet werden."""
+        return self.abhaengigkeiten if self.auswahl is None else self.auswahl(parameter)
+
+
+def _maxima(pipeline, vorfilter):
+    # Alle lokalen Maxima (bei Plateaus die Mitte) unabhängig von den Parametern der Auswahl
+    signal = pipeline.signal(vorfilter)
+    maxima, _ = find_peaks(signal)
+    return maxima, signal[maxima]
+
+
+def _prominenzen(pipeline, maxima, vorfilter):
+    # Die Prominenz eines Maximums hängt nur vom Signal ab, nicht davon, welche anderen Peaks ausgewählt werden
+    return peak_prominences(pipeline.signal(vorfilter), maxima[0])[0]
+
+
+def _kandidaten(pipeline, maxima, height, distance):
+    # Höhe und Distanz in derselben Reihenfolge wie peak_stream.finde_peaks; Ergebnis sind Positionen in maxima
+    positionen = np.arange(len(maxima[0]))
+    if height is not None:
+        positionen = positionen[maxima[1] >= height]
+    if distance is not None:
+        positionen = positionen[waehle_nach_distanz(maxima[0][positionen], maxima[1][positionen], distance)]
+    return positionen
+
+
+def _schwelle(pipeline, maxima, prominenzen, kandidaten, prominence):
+    if prominence is not None:
+        kandidaten = kandidaten[prominenzen[kandidaten] >= prominence]
+    return maxima[0][kandidaten]
+
+
+def _r_zacken(pipeline, vorfilter, detektor, detektor_parameter):
+    # Registrierte Detektoren ohne eigene Zwischenstufen laufen am Stück
+    return finde_r_zacken(pipeline.signal(vorfilter), detektor, ABTASTRATE_HZ, **dict(detektor_parameter))
+
+
+def _peaks(pipeline, peaks, detektor):
+    messungen.zaehle("peaks_gefunden", len(peaks))
+    return peaks
+
+
+def _heart_rate(pipeline, rr):
+    return pd.DataFrame({"Zeit in ms": rr.bpm_zeiten, "Herzfrequenz in bpm": rr.bpm})
+
+
+STUFEN = {stufe.name: stufe for stufe in [
+    Stufe("maxima", _maxima, (), ("vorfilter",)),
+    Stufe("prominenzen", _prominenzen, ("maxima",), ("vorfilter",)),
+    Stufe("kandidaten", _kandidaten, ("maxima",), ("height", "distance")),
+    Stufe("schwelle", _schwelle, ("maxima", "prominenzen", "kandidaten"), ("prominence",)),
+    Stufe("r_zacken", _r_zacken, (), ("vorfilter", "detektor", "detektor_parameter")),
+    # Der Detektor "schwelle" läuft über die Zwischenstufen oben, damit Nachjustieren nur neu auswählt
+    Stufe("peaks", _peaks, ("schwelle", "r_zacken"), ("detektor",), nach_inhalt=True,
+          platte=(lambda peaks: {"peaks": peaks}, lambda arrays: arrays["peaks"]),
+          auswahl=lambda p: ("schwelle",) if p["detektor"] == STANDARD_DETEKTOR else ("r_zacken",)),
+    Stufe("rr", lambda pipeline, peaks: RRIntervalle(peaks, pipeline.ekg.df["Zeit in ms"]), ("peaks",)),
+    Stufe("hr", _heart_rate, ("rr",)),
+    Stufe("hrv", lambda pipeline, rr: float(rr.rmssd), ("rr",)),
+    Stufe("hrv_verlauf", lambda pipeline, rr, fenster_ms, schritt_ms: hrv_fenster(rr, fenster_ms, schritt_ms),
+          ("rr",), ("fenster_ms", "schritt_ms")),
+    Stufe("flatline", lambda pipeline: flatline_episoden(pipeline.ekg.df["Messwerte in mV"], pipeline.ekg.df["Zeit in ms"])),
+    Stufe("anomalie_episoden", lambda pipeline, rr, flatline, alter, min_hr: anomalie_episoden(rr, alter, min_hr, flatline),
+          ("rr", "flatline"), ("alter", "min_hr"), platte=(als_arrays, aus_arrays)),
+]}
+
+
+def betroffene_stufen(parameter):
+    """Gibt alle Stufen zurück, die direkt oder über ihre Eingaben von den genannten Parametern abhängen."""
+    betroffen = set()
+    for stufe in STUFEN.values():
+        # STUFEN ist topologisch sortiert, Abhängigkeiten sind also schon entschieden
+        if set(stufe.parameter) & set(parameter) or set(stufe.abhaengigkeiten) & betroffen:
+            betroffen.add(stufe.name)
+    return betroffen
+
+
+class AnalysePipeline:
+    """Inkrementelle Auswertung einer Aufnahme: Maxima mit ihren Prominenzen -> Kandidaten (Höhe, Distanz)
+    -> Peaks (Prominenz; oder ein anderer Detektor aus detektoren.DETEKTOREN) -> RR-Intervalle -> Herzfrequenz, HRV, HRV-Verlauf und Anomalie-Episoden.
+
+    Jede Stufe wird im Analyse-Cache unter einem Schlüssel aus Inhalts-Hash der Aufnahme, Stufe, ihren
+    Parametern und den Schlüsseln ihrer Eingaben abgelegt. Ändert sich ein Parameter, entstehen neue
+    Schlüssel nur für die davon abhängigen Stufen; alle anderen kommen aus dem Cache. Ein anderes Alter
+    wertet also nur die Anomalien neu aus, eine andere Höhe oder Prominenz nur die Auswahl aus den
+    schon gefundenen Maxima und ihren Prominenzen."""
+
+    def __init__(self, ekg, **parameter):
+        """Input:
+            ekg (EKGdata): Aufnahme, deren DataFrame ausgewertet wird.
+            parameter: Abweichungen von STANDARD_PARAMETER, z.B. height=300 oder alter=45."""
+        self.ekg = ekg
+        self.parameter = dict(STANDARD_PARAMETER)
+        self.parameter.update(parameter)
+        # Neu berechnete Stufen als (Name, Dauer in ms), z.B. für die Anzeige in der App
+        self.berechnet = []
+        self._fingerabdruecke = {}
+        self._quelle = None
+        self._signale = {}
+
+    def setze(self, **parameter):
+        """Ändert Parameter und verwirft nur die Schlüssel der davon abhängigen Stufen."""
+        geaendert = [name for name, wert in parameter.items() if self.parameter.get(name) != wert]
+        self.parameter.update(parameter)
+        for name in betroffene_stufen(geaendert):
+            self._fingerabdruecke.pop(name, None)
+        return self
+
+    def signal(self, gefiltert=False):
+        """Messwerte oder gefiltertes Signal als float64 (wie von scipy erwartet), einmal pro Pipeline umgewandelt."""
+        if gefiltert not in self._signale:
+            quelle = self.ekg.gefiltertes_signal() if gefiltert else self.ekg.df["Messwerte in mV"]
+            self._signale[gefiltert] = np.asarray(quelle, dtype=np.float64)
+        return self._signale[gefiltert]
+
+    def _schluessel(self, name):
+        stufe = STUFEN[name]
+        if self._quelle is None:
+            self._quelle = inhalts_hash(self.ekg.data)
+        return (self._quelle, name,
+                tuple(self.parameter[p] for p in stufe.parameter),
+                tuple(self._fingerabdruck(a) for a in stufe.eingaben(self.parameter)))
+
+    def _fingerabdruck(self, name):
+        """Kurzform des Ergebnisses einer Stufe, von der die Schlüssel der Nachfolger abhängen."""
+        if name not in self._fingerabdruecke:
+            if STUFEN[name].nach_inhalt:
+                ergebnis = np.ascontiguousarray(self.ergebnis(name))
+                self._fingerabdruecke[name] = (name, hashlib.sha1(ergebnis.tobytes()).hexdigest())
+            else:
+                self._fingerabdruecke[name] = self._schluessel(name)
+        return self._fingerabdruecke[name]
+
+    def ergebnis(self, name):
+        """Gibt das Ergebnis einer Stufe zurück und berechnet dafür nur, was nicht im Cache liegt.
+
+            Input:
+            name (str): Name der Stufe (siehe STUFEN).
+
+            Output:
+            Ergebnis der Stufe (geteilt über den Analyse-Cache, nicht verändern)."""
+        stufe = STUFEN[name]
+        schluessel = self._schluessel(name)
+        wert = analyse_cache.hole(schluessel)
+        if wert is not None:
+            return wert
+
+        if stufe.platte is not None:
+            gespeichert = analyse_cache.hole_arrays(schluessel)
+            if gespeichert is not None:
+                wert = stufe.platte[1](gespeichert)
+                analyse_cache.lege_ab(schluessel, wert)
+                return wert
+
+        eingaben = [self.ergebnis(a) for a in stufe.eingaben(self.parameter)]
+        parameter = {p: self.parameter[p] for p in stufe.parameter}
+        start = time.perf_counter()
+        wert = stufe.funktion(self, *eingaben, **parameter)
+        dauer = time.perf_counter() - start
+        messungen.erfasse(f"pipeline.{name}", dauer)
+        self.berechnet.append((name, dauer * 1000))
+
+        analyse_cache.lege_ab(schluessel, wert)
+        if stufe.platte is not None:
+            analyse_cache.lege_arrays_ab(schluessel, **stufe.platte[0](wert))
+        return wert
@@ -0,0 +1,150 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from ekg_cache import CACHE_DIR, SPALTEN, lade_ekg_arrays, quell_signatur
+from messung import messungen
+
+# Obergrenze für nicht mehr benutzte Aufnahmen, die im Prozess gehalten werden (Standard 512 MB)
+MAX_BYTES = int(os.environ.get("EKG_SPEICHER_MAX_MB", 512)) * 1024 * 1024
+
+
+class _Eintrag:
+    """Eine geladene Aufnahme mit Anzahl der Nutzer."""
+
+    __slots__ = ("werte", "zeit", "df", "groesse", "referenzen")
+
+    def __init__(self, werte, zeit):
+        self.werte = werte
+        self.zeit = zeit
+        self.df = pd.DataFrame({SPALTEN[0]: werte, SPALTEN[1]: zeit}, copy=False)
+        self.groesse = werte.nbytes + zeit.nbytes
+        self.referenzen = 0
+
+
+class AufnahmeSpeicher:
+    """Prozessweiter Speicher für EKG-Aufnahmen: Jede Aufnahme wird einmal aus dem Binär-Cache
+    (ekg_cache, per mmap) geöffnet und allen Sitzungen als dieselben schreibgeschützten Arrays bzw.
+    derselbe DataFrame übergeben. Der Speicherbedarf wächst damit mit der Zahl verschiedener
+    Aufnahmen, nicht mit der Zahl der Nutzer.
+
+    Weil die Arrays auf die Cache-Dateien gemappt sind, teilen sich auch die Worker-Prozesse von
+    ekg_batch und analyse_cli die Seiten im Page-Cache des Betriebssystems: Sie bekommen nur den Pfad
+    und öffnen dieselben Dateien, statt Arrays gepickelt zu bekommen.
+
+    Jede Nutzung zählt eine Referenz hoch (oeffne/freigeben). Nicht mehr benutzte Aufnahmen bleiben
+    für den nächsten Zugriff erhalten und werden erst nach LRU verdrängt, wenn max_bytes überschritten ist;
+    benutzte Aufnahmen werden nie verdrängt."""
+
+    def __init__(self, max_bytes=MAX_BYTES, cache_dir=CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self._eintraege = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.treffer = 0
+        self.geladen = 0
+        self.verdraengt = 0
+
+    def oeffne(self, pfad):
+        """Gibt die Aufnahme zurück und zählt eine Referenz hoch.
+
+            Input:
+            pfad (str): Pfad zur EKG-Textdatei (result_link).
+
+            Output:
+            Tupel (Schlüssel für freigeben, DataFrame mit 'Messwerte in mV' und 'Zeit in ms').
+            Der DataFrame wird geteilt und darf nicht verändert werden."""
+        signatur = quell_signatur(pfad)
+        schluessel = (signatur["pfad"], signatur["mtime_ns"], signatur["groesse"])
+        with self._lock:
+            eintrag = self._eintraege.get(schluessel)
+            if eintrag is not None:
+                self._eintraege.move_to_end(schluessel)
+                eintrag.referenzen += 1
+                self.treffer += 1
+                messungen.zaehle("aufnahme_speicher.treffer")
+                return schluessel, eintrag.df
+
+        # Laden außerhalb des Locks, damit andere Aufnahmen nicht warten müssen
+        werte, zeit = lade_ekg_arrays(pfad, self.cache_dir)
+        werte, zeit = np.asarray(werte), np.asarray(zeit)
+        for array in (werte, zeit):
+            if array.flags.writeable and array.flags.owndata:
+                array.flags.writeable = False
+        neu = _Eintrag(werte, zeit)
+
+        with self._lock:
+            # Ein anderer Thread kann dieselbe Aufnahme inzwischen geladen haben
+            eintrag = self._eintraege.get(schluessel)
+            if eintrag is None:
+                eintrag = neu
+                self._entferne_alte_versionen(schluessel)
+                self._eintraege[schluessel] = eintrag
+                self._bytes += eintrag.groesse
+                self.geladen += 1
+                messungen.zaehle("aufnahme_speicher.geladen")
+            self._eintraege.move_to_end(schluessel)
+            eintrag.referenzen += 1
+            self._verdraengen()
+            return schluessel, eintrag.df
+
+    def freigeben(self, schluessel):
+        """Zählt die Referenz einer mit oeffne geholten Aufnahme herunter."""
+        with self._lock:
+            eintrag = self._eintraege.get(schluessel)
+            if eintrag is None:
+                return
+            eintrag.referenzen = max(0, eintrag.referenzen - 1)
+            self._verdraengen()
+
+    @contextmanager
+    def ausleihen(self, pfad):
+        """Hält eine Aufnahme für die Dauer eines with-Blocks und gibt (messwerte, zeit_in_ms) zurück."""
+        schluessel, df = self.oeffne(pfad)
+        try:
+            yield df[SPALTEN[0]].to_numpy(), df[SPALTEN[1]].to_numpy()
+        finally:
+            self.freigeben(schluessel)
+
+    def _entferne_alte_versionen(self, schluessel):
+        """Verwirft unbenutzte Einträge desselben Pfads mit älterer Änderungszeit oder Größe."""
+        for alt in [k for k, e in self._eintraege.items() if k[0] == schluessel[0] and e.referenzen == 0]:
+            self._bytes -= self._eintraege.pop(alt).groesse
+
+    def _verdraengen(self):
+        """Verdrängt die am längsten unbenutzten Einträge ohne Referenzen, bis max_bytes eingehalten ist."""
+        if self._bytes <= self.max_bytes:
+            return
+        for schluessel in [k for k, e in self._eintraege.items() if e.referenzen == 0]:
+            if self._bytes <= self.max_bytes:
+                break
+            self._bytes -= self._eintraege.pop(schluessel).groesse
+            self.verdraengt += 1
+
+    def leeren(self):
+        """Verwirft alle unbenutzten Aufnahmen (benutzte bleiben erhalten)."""
+        with self._lock:
+            for schluessel in [k for k, e in self._eintraege.items() if e.referenzen == 0]:
+                self._bytes -= self._eintraege.pop(schluessel).groesse
+
+    def statistik(self):
+        """Gibt Anzahl, Größe und Nutzung der gehaltenen Aufnahmen als Dictionary zurück."""
+        with self._lock:
+            return {
+                "aufnahmen": len(self._eintraege),
+                "benutzt": sum(1 for e in self._eintraege.values() if e.referenzen),
+                "referenzen": sum(e.referenzen for e in self._eintraege.values()),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "treffer": self.treffer,
+                "geladen": self.geladen,
+                "verdraengt": self.verdraengt}
+
+
+# Gemeinsame Instanz für alle Sitzungen eines Streamlit-Prozesses (bzw. eines Worker-Prozesses)
+aufnahme_speicher = AufnahmeSpeicher()
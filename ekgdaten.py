@@ -1,86 +1,234 @@
 import json
+import weakref
 import pandas as pd
 import plotly.express as px
 import numpy as np
 import plotly.graph_objects as go
-from scipy.signal import find_peaks
+from anomalie_episoden import anomalie_episoden, episoden_spuren, flatline_episoden
+from detektoren import DETEKTOREN, STANDARD_DETEKTOR, registriere
+from ekg_archiv import EKGArchiv, ist_archiv
+from ekg_cache import quell_signatur
+from ekg_filter import gefiltertes_signal
+from ekg_lod import pyramide_fuer
+from ekg_pipeline import AnalysePipeline
+from ekg_speicher import aufnahme_speicher
+from hrv_fenster import FENSTER_MS, SCHRITT_MS, hrv_fenster, plot_hrv_fenster
+from read_data import find_ekg_data_by_id
+from rr_intervalle import RRIntervalle
+from messung import gemessen
 
 class EKGdata:
 
+    # Verfügbare R-Zacken-Detektoren (Name -> Funktion); weitere mit @EKGdata.registriere_detektor("name")
+    DETEKTOREN = DETEKTOREN
+    registriere_detektor = staticmethod(registriere)
+
 ## Konstruktor der Klasse soll die EKG-Daten einlesen
 
+    @gemessen("EKGdata.laden")
     def __init__(self, ekg_dict):
         self.id = ekg_dict["id"]
         self.date = ekg_dict["date"]
         self.data = ekg_dict["result_link"]
-        self.df = pd.read_csv(
-            self.data,
-            sep='\t',
-            header=None,
-            names=['Messwerte in mV', 'Zeit in ms'])
-            #skiprows=lambda i: i % 10 != 0) # ↓ Downsampling: Nur jede 10. Zeile laden
+        # Aufnahme aus dem prozessweiten Speicher: alle Sitzungen teilen denselben (schreibgeschützten) DataFrame,
+        # die Referenz wird freigegeben, sobald dieses Objekt nicht mehr gebraucht wird
+        schluessel, self.df = aufnahme_speicher.oeffne(self.data)
+        weakref.finalize(self, aufnahme_speicher.freigeben, schluessel)
 
     @staticmethod
     def load_by_id(ekg_list, ekg_id):
         """Lädt ein EKG-Objekt aus einer Liste anhand der EKG-ID.
 
             Input:
-            ekg_list (list): Liste von EKG-Dictionaries.
+            ekg_list (list or None): Liste von EKG-Dictionaries, None für den Index über die ganze Datenbank.
             ekg_id (int or str): Gesuchte EKG-ID.
 
             Output:
             dict or None: EKG-Dictionary mit passender ID oder None, falls nicht gefunden."""
+        if ekg_list is None:
+            return find_ekg_data_by_id(ekg_id)
         for ekg in ekg_list:
             if ekg["id"] == int(ekg_id):
                 return ekg
         return None
     
-    def plot_time_series(self,peaks, anomalies=None):
-        """Zeichnet die Zeitreihe der Messwerte mit Peaks und optionalen Anomalien als farbige Bereiche.
+    @staticmethod
+    @gemessen("EKGdata.lies_zeitfenster")
+    def lies_zeitfenster(ekg_dict, start_ms, ende_ms):
+        """Liest nur die Messwerte eines Zeitfensters, ohne ein EKGdata-Objekt anzulegen.
+        Bei Archiven (ekg_archiv) werden nur die Blöcke entpackt, die das Fenster überlappen,
+        der Aufwand hängt also von der Fensterlänge ab und nicht von der Länge der Aufnahme.
+
+            Input:
+            ekg_dict (dict): EKG-Dictionary mit result_link.
+            start_ms, ende_ms: Zeitfenster in ms.
+
+            Output:
+            DataFrame mit den Spalten "Messwerte in mV" und "Zeit in ms" für das Fenster."""
+        pfad = ekg_dict["result_link"]
+        if ist_archiv(pfad):
+            werte, zeit = EKGArchiv(pfad).lies_zeitfenster(start_ms, ende_ms)
+        else:
+            # Textdateien haben keinen Index -> über die (gemappte) ganze Aufnahme
+            with aufnahme_speicher.ausleihen(pfad) as (alle_werte, alle_zeit):
+                im_fenster = (alle_zeit >= start_ms) & (alle_zeit <= ende_ms)
+                werte, zeit = alle_werte[im_fenster], alle_zeit[im_fenster]
+        return pd.DataFrame({"Messwerte in mV": werte, "Zeit in ms": zeit})
+
+    @gemessen("EKGdata.plot_time_series")
+    def plot_time_series(self,peaks, anomalies=None, x_bereich=None, pixel_breite=1500, signal="roh", fenster=None):
+        """Zeichnet die Zeitreihe der Messwerte mit Peaks und optionalen Anomalie-Episoden als farbige Bereiche.
+        Es werden nur die Punkte übertragen, die im gewählten Bereich bei der Plotbreite sichtbar sind
+        (Min/Max-Pyramide), bei starkem Zoom die Rohdaten.
 
             Input:
-            peaks und anomalien für die Dastellung
+            peaks und anomalien (Episoden aus detect_anomalies) für die Dastellung
+            x_bereich (tuple, optional): Zeitbereich (start, ende) in ms, None für die ganze Aufnahme.
+            pixel_breite (int, optional): Breite des Plots in Pixeln.
+            signal (str, optional): "roh", "gefiltert" oder "beide" (gefiltert auf zweiter y-Achse).
+            fenster (DataFrame, optional): Rohdaten des Bereichs aus lies_zeitfenster; werden statt der
+                Pyramide für die Rohdaten gezeichnet.
 
             Output:
-            Plot mit Zeitreihe, Peaks und Anomalien-Hervorhebung."""
-        peak_times = self.df.loc[peaks, "Zeit in ms"].tolist()
-        peak_values = self.df.loc[peaks, "Messwerte in mV"].tolist()
+            Plot mit Zeitreihe, Peaks und Hervorhebung der Episoden (eine Farbe pro Art)."""
+        x0, x1 = x_bereich if x_bereich is not None else (None, None)
+        gefiltert = signal == "gefiltert"
+        if fenster is not None and not gefiltert:
+            zeit = fenster["Zeit in ms"].to_numpy(dtype=np.float64)
+            werte = fenster["Messwerte in mV"].to_numpy(dtype=np.float64)
+            # Bei einem Zeitsprung die Abschnitte wie in der Pyramide durch NaN trennen
+            spruenge = np.flatnonzero(np.diff(zeit) < 0) + 1
+            zeit, werte = np.insert(zeit, spruenge, np.nan), np.insert(werte, spruenge, np.nan)
+        else:
+            zeit, werte = self.lod(gefiltert).ausschnitt(x0, x1, pixel_breite)
+
+        peak_zeiten = self.df["Zeit in ms"].to_numpy()[peaks]
+        im_bereich = np.ones(len(peak_zeiten), dtype=bool)
+        if x_bereich is not None:
+            im_bereich = (peak_zeiten >= x0) & (peak_zeiten <= x1)
+            if anomalies is not None:
+                anomalies = anomalies[(anomalies["Ende in ms"] >= x0) & (anomalies["Beginn in ms"] <= x1)]
+        peak_times = peak_zeiten[im_bereich].tolist()
+        peak_werte = self.gefiltertes_signal() if gefiltert else self.df["Messwerte in mV"].to_numpy()
+        peak_values = np.asarray(peak_werte[peaks])[im_bereich].tolist()
 
-        self.fig = px.line(self.df, x="Zeit in ms", y="Messwerte in mV")
+        y_titel = "gefiltert in mV" if gefiltert else "Messwerte in mV"
+        self.fig = px.line(x=zeit, y=werte, labels={"x": "Zeit in ms", "y": y_titel})
+        if signal == "beide":
+            # Das gefilterte Signal liegt um 0, die Rohdaten um die Grundlinie -> eigene Achse
+            zeit_gefiltert, werte_gefiltert = self.lod(True).ausschnitt(x0, x1, pixel_breite)
+            self.fig.add_trace(go.Scatter(
+                x=zeit_gefiltert, y=werte_gefiltert, mode="lines", name="gefiltert", yaxis="y2",
+                line=dict(color="green", width=1)))
+            self.fig.update_layout(yaxis2=dict(title="gefiltert in mV", overlaying="y", side="right"))
         self.fig.add_trace(go.Scatter(
             x=peak_times,
             y=peak_values,
             mode='markers',
             marker=dict(color='red', size=8),
             name='Peaks'))
-        zeit_start = self.df["Zeit in ms"][0]
-        self.fig.update_layout(xaxis=dict(range=[zeit_start, (zeit_start+30000)]))
-        if anomalies:
-            anomalies_times = [a[0] for a in anomalies]
-            for t in anomalies_times:
-                self.fig.add_vrect(
-                    x0 = t-100,
-                    x1=t +100,
-                    fillcolor="orange",
-                    opacity=0.3,
-                    layer="below",
-                    line_width=0)
+        if x_bereich is not None:
+            self.fig.update_layout(xaxis=dict(range=[x0, x1]))
+        else:
+            zeit_start = self.df["Zeit in ms"][0]
+            self.fig.update_layout(xaxis=dict(range=[zeit_start, (zeit_start+30000)]))
+        if anomalies is not None and len(anomalies) and len(werte):
+            # Eine Fläche pro Art statt einer Form pro Episode, hinter Signal und Peaks
+            spuren = episoden_spuren(anomalies, float(np.min(werte)), float(np.max(werte)))
+            self.fig.add_traces(spuren)
+            self.fig.data = self.fig.data[-len(spuren):] + self.fig.data[:-len(spuren)]
         return self.fig
     
-    def find_peaks(self, distance=200, height=340):
-        """Findet Peaks im EKG-Signal basierend auf Abstand, Höhe und Prominenz.
+    def lod(self, gefiltert=False):
+        """Gibt die Min/Max-Pyramide der Aufnahme (oder des gefilterten Signals) für die Darstellung zurück
+        (einmal pro Aufnahme gebaut)."""
+        signatur = quell_signatur(self.data)
+        schluessel = (signatur["pfad"], signatur["mtime_ns"], signatur["groesse"], gefiltert)
+        werte = self.gefiltertes_signal() if gefiltert else self.df["Messwerte in mV"].to_numpy()
+        return pyramide_fuer(schluessel, self.df["Zeit in ms"].to_numpy(), werte)
+
+    def gefiltertes_signal(self):
+        """Gibt das gefilterte Signal zurück (Bandpass gegen Grundlinienschwankung und Rauschen, Kerbfilter gegen
+        Netzbrummen, ohne Phasenverschiebung; siehe ekg_filter). Es wird einmal pro Aufnahme berechnet und
+        neben den Rohdaten im Binär-Cache abgelegt.
+
+            Output:
+            Gefiltertes Signal als float32-Array, gleich lang wie die Messwerte."""
+        if getattr(self, "_gefiltert", None) is None:
+            self._gefiltert = gefiltertes_signal(self.data)
+        return self._gefiltert
+
+    def pipeline(self, **parameter):
+        """Gibt die inkrementelle Auswertung dieser Aufnahme zurück (siehe ekg_pipeline.AnalysePipeline).
+        Geänderte Parameter verwerfen nur die davon abhängigen Stufen.
+
+            Input:
+            parameter: z.B. distance, height, prominence, alter, min_hr, fenster_ms, schritt_ms.
+
+            Output:
+            AnalysePipeline-Objekt."""
+        if getattr(self, "_pipeline", None) is None:
+            self._pipeline = AnalysePipeline(self, **parameter)
+        else:
+            self._pipeline.setze(**parameter)
+        return self._pipeline
+
+    @gemessen("EKGdata.find_peaks")
+    def find_peaks(self, distance=200, height=340, prominence=30, detektor=STANDARD_DETEKTOR, vorfilter=False,
+                   **detektor_parameter):
+        """Findet Peaks im EKG-Signal basierend auf Abstand, Höhe und Prominenz oder mit einem anderen
+        registrierten Detektor (z.B. detektor="pan_tompkins", der ohne feste Höhe auskommt).
+        Mit vorfilter=True wird im gefilterten Signal gesucht (siehe gefiltertes_signal); es liegt um 0,
+        die Höhe ist dann der Abstand zur Grundlinie (z.B. 25) und hängt nicht mehr von ihrer Lage ab.
+        Die Zwischenstufen (Maxima mit Prominenzen, Kandidaten nach Höhe und Abstand) liegen im Analyse-Cache:
+        Ändert sich nur die Prominenz, wird nur neu ausgewählt, ändert sich die Höhe, werden die schon
+        gefundenen Maxima neu gefiltert. Ergeben andere Parameter dieselben Peaks, bleiben auch
+        RR-Intervalle, HRV und Anomalien erhalten.
 
             Input:
             distance (int, optional): Minimale Distanz zwischen Peaks.
             height (int, optional): Minimale Höhe der Peaks.
+            prominence (int, optional): Minimale Prominenz der Peaks.
+            detektor (str, optional): Name des Detektors (siehe EKGdata.DETEKTOREN).
+            vorfilter (bool, optional): Im gefilterten statt im Rohsignal suchen.
+            detektor_parameter: Parameter für andere Detektoren als "schwelle".
 
             Output:gibt die Indizes der gefundenen Peaks wieder"""
-        signal = self.df['Messwerte in mV']
-        peaks, _ = find_peaks(signal, distance=distance, height=height, prominence=30)
-        self.peaks = peaks
-        return peaks
-    
-    
+        if detektor not in self.DETEKTOREN:
+            raise ValueError(f"Unbekannter Detektor: {detektor} (vorhanden: {', '.join(self.DETEKTOREN)})")
+        pipeline = self.pipeline(distance=distance, height=height, prominence=prominence, vorfilter=vorfilter,
+                                 detektor=detektor,
+                                 detektor_parameter=tuple(sorted(detektor_parameter.items())))
+        self._rr = pipeline.ergebnis("rr")
+        self._aus_pipeline = True
+        self.peaks = self._rr.peaks
+        return self.peaks
+
+    def _pipeline_fuer(self, peaks):
+        """Gibt die Pipeline zurück, wenn peaks die zuletzt mit find_peaks gefundenen sind, sonst None."""
+        self.rr_intervalle(peaks)
+        return self._pipeline if getattr(self, "_aus_pipeline", False) else None
+
+    def rr_intervalle(self, peaks):
+        """Gibt die RR-Intervalle zu den Peaks zurück. Sie werden einmal pro Peak-Menge berechnet
+        und am Objekt zwischengespeichert, sodass HR, Herzfrequenzverlauf, HRV und Anomalien sie teilen.
+
+            Input:
+            peaks: Indizes der Peaks.
+
+            Output:
+            RRIntervalle-Objekt."""
+        cached = getattr(self, "_rr", None)
+        if cached is not None and cached.peaks is peaks:
+            return cached
+        peaks = np.asarray(peaks)
+        if cached is None or not np.array_equal(cached.peaks, peaks):
+            self._rr = RRIntervalle(peaks.copy(), self.df["Zeit in ms"])
+            # Fremde Peaks -> nicht mehr über die Pipeline von find_peaks auswerten
+            self._aus_pipeline = False
+        return self._rr
+
+    @gemessen("EKGdata.estimate_hr")
     def estimate_hr(self, peaks):
         """Schätzt die durchschnittliche Herzfrequenz (BPM) aus den Peaks.
 
@@ -89,17 +237,11 @@ class EKGdata:
 
             Output:
             Durchschnittliche Herzfrequenz in bpm."""
-        heart_rates = []
-        zeit_in_ms = self.df["Zeit in ms"]
-        for i in range(len(peaks)-1):
-            interval = zeit_in_ms.iloc[peaks[i+1]]-zeit_in_ms.iloc[peaks[i]]
-            if interval > 0:
-                bpm = 60000 / interval
-                heart_rates.append(bpm)
-        avg_heart_rate = sum(heart_rates) / len(heart_rates) if heart_rates else 0
+        avg_heart_rate = self.rr_intervalle(peaks).mittlere_hr
         return avg_heart_rate
     
     #Herzrate als Plot
+    @gemessen("EKGdata.Heart_Rate")
     def Heart_Rate(self, peaks):
         """Erzeugt ein DataFrame mit Herzfrequenzwerten und zugehörigen Zeitpunkten basierend auf Peaks.
 
@@ -108,21 +250,17 @@ class EKGdata:
 
             Output:
             DataFrame mit Spalten "Zeit in ms" und "Herzfrequenz in bpm"."""
-        heart_rates = []
-        times = []
-        zeit_in_ms = self.df["Zeit in ms"]
-        for i in range(len(peaks)-1):
-            interval = zeit_in_ms.iloc[peaks[i+1]]-zeit_in_ms.iloc[peaks[i]]
-            if interval > 0:
-                bpm = 60000 / interval
-                heart_rates.append(bpm)
-                times.append(zeit_in_ms.iloc[peaks[i]])
+        pipeline = self._pipeline_fuer(peaks)
+        if pipeline is not None:
+            return pipeline.ergebnis("hr")
+        rr = self.rr_intervalle(peaks)
         hr_df = pd.DataFrame({
-        "Zeit in ms": times,
-        "Herzfrequenz in bpm": heart_rates})
+        "Zeit in ms": rr.bpm_zeiten,
+        "Herzfrequenz in bpm": rr.bpm})
         return hr_df
     
     @staticmethod
+    @gemessen("EKGdata.plot_Hear_Rate")
     def plot_Hear_Rate(hr_df):
         """Erstellt einen Linienplot der Herzfrequenz über die Zeit.
 
@@ -133,6 +271,35 @@ class EKGdata:
             Plot des Herzfrequenzverlaufs."""
         fig = px.line(hr_df, x="Zeit in ms", y="Herzfrequenz in bpm")
         return fig
+
+    @gemessen("EKGdata.hrv_verlauf")
+    def hrv_verlauf(self, peaks, fenster_ms=FENSTER_MS, schritt_ms=SCHRITT_MS):
+        """Berechnet RMSSD, SDNN, pNN50 und LF/HF in gleitenden Fenstern (siehe hrv_fenster).
+
+            Input:
+            peaks: Indizes der Peaks.
+            fenster_ms (int, optional): Fensterlänge in ms (Standard 5 min).
+            schritt_ms (int, optional): Abstand der Fensteranfänge in ms (Standard 30 s).
+
+            Output:
+            DataFrame mit einer Zeile pro Fenster (geteilt über den Analyse-Cache, nicht verändern)."""
+        pipeline = self._pipeline_fuer(peaks)
+        if pipeline is None:
+            return hrv_fenster(self.rr_intervalle(peaks), fenster_ms, schritt_ms)
+        return pipeline.setze(fenster_ms=fenster_ms, schritt_ms=schritt_ms).ergebnis("hrv_verlauf")
+
+    @staticmethod
+    @gemessen("EKGdata.plot_HRV_Verlauf")
+    def plot_HRV_Verlauf(hrv_df, kennzahlen=("RMSSD (ms)", "SDNN (ms)", "LF/HF")):
+        """Erstellt einen Plot des HRV-Verlaufs mit derselben Zeitachse wie plot_Hear_Rate.
+
+            Input:
+            hrv_df: DataFrame aus hrv_verlauf.
+            kennzahlen (tuple, optional): Darzustellende Spalten.
+
+            Output:
+            Plot des HRV-Verlaufs."""
+        return plot_hrv_fenster(hrv_df, kennzahlen)
     
     @staticmethod
     def Heartratevariation(peaks, zeit_in_ms):
@@ -144,12 +311,13 @@ class EKGdata:
 
             Output:
             RMSSD-Wert (ms) als Maß der Herzfrequenzvariabilität."""
-        rr_intervals = np.diff(zeit_in_ms.iloc[peaks])
-        rmssd = np.sqrt(np.mean(np.square(np.diff(rr_intervals))))
+        rmssd = RRIntervalle(peaks, zeit_in_ms).rmssd
         return rmssd
 
+    @gemessen("EKGdata.detect_anomalies")
     def detect_anomalies(self, peaks, alter, min_hr=40):
-        """Erkennt Anomalien basierend auf Herzfrequenzgrenzen (min/max bpm).
+        """Erkennt Anomalien als Episoden: aufeinanderfolgende auffällige Schläge werden zusammengefasst
+        (Tachykardie, Bradykardie, RR-Sprung, ausgelassener Schlag, Nulllinie; siehe anomalie_episoden).
 
             Input:
             peaks: Indizes der Peaks.
@@ -157,24 +325,17 @@ class EKGdata:
             min_hr: Minimale Herzfrequenz.
 
             Output:
-            Liste von (Zeitpunkt, bpm) für erkannte Anomalien."""
-
-        max_hr = 220 - alter
-        anomalies = []
-        zeit_in_ms = self.df["Zeit in ms"]
-
-        for i in range(len(peaks) - 1):
-            interval = zeit_in_ms.iloc[peaks[i+1]] - zeit_in_ms.iloc[peaks[i]]
-            if interval > 0:
-                bpm = 60000/interval
-                
-                if bpm < min_hr or bpm > max_hr:
-                    zeitpunkt = (zeit_in_ms.iloc[peaks[i+1]] + zeit_in_ms.iloc[peaks[i]])/2
-                    anomalies.append((zeitpunkt, bpm))
-
-        return anomalies
+            DataFrame mit einer Zeile pro Episode (Art, Beginn, Ende, Dauer, Schläge, min/max bpm),
+            geteilt über den Analyse-Cache, nicht verändern."""
+        pipeline = self._pipeline_fuer(peaks)
+        if pipeline is None:
+            flatline = flatline_episoden(self.df["Messwerte in mV"], self.df["Zeit in ms"])
+            return anomalie_episoden(self.rr_intervalle(peaks), alter, min_hr, flatline)
+        # Ein anderes Alter wertet nur diese Stufe neu aus, Peaks und RR-Intervalle bleiben
+        return pipeline.setze(alter=alter, min_hr=min_hr).ergebnis("anomalie_episoden")
     
     # Kennzahlen extrahieren
+    @gemessen("EKGdata.get_ekg_stats")
     def get_ekg_stats(ekg_obj):
         """Extrahiert Kennzahlen aus einem EKG-Objekt um sie zu vergleichen.
 
@@ -186,7 +347,7 @@ class EKGdata:
         peaks = ekg_obj.find_peaks()
         length_min = len(ekg_obj.df["Zeit in ms"]) / 60000
         avg_hr = ekg_obj.estimate_hr(peaks)
-        hrv = ekg_obj.Heartratevariation(peaks, ekg_obj.df["Zeit in ms"])
+        hrv = ekg_obj.rr_intervalle(peaks).rmssd
         return {
             "Datum": ekg_obj.date,
             "EKG-ID": ekg_obj.id,
@@ -195,6 +356,7 @@ class EKGdata:
             "HRV (ms)": int(hrv)}
     
     #Plot der durchschnittlichen Herzfrequenz mit Datum
+    @gemessen("EKGdata.plot_HFV")
     def plot_HFV(df_vergleich):
         """Erstellt einen Plot der Herzfrequenzvariabilität (HRV) über die Zeit.
 
@@ -237,10 +399,11 @@ if __name__ == "__main__":
     person_data = json.load(file)
     ekg_dict = person_data[0]["ekg_tests"][0]
     ekg = EKGdata(ekg_dict)
-    peaks = ekg.find_peaks(340, 2)
+    peaks = ekg.find_peaks(distance=200, height=340)
     avg_hr = ekg.estimate_hr(peaks)
     print(avg_hr)
-    #fig = ekg.plot_time_series()
+    #fig = ekg.plot_time_series(peaks)
     #fig.show()
-    rr_int = ekg.Heartratevariation(peaks)
+    rr_int = ekg.Heartratevariation(peaks, ekg.df["Zeit in ms"])
     print(rr_int)
+    # Auswertung aller Personen und EKGs ohne Browser: python analyse_cli.py --help
@@ -0,0 +1,73 @@
+import os
+
+import pandas as pd
+
+# Verzeichnis der Ergebnistabellen von analyse_cli, gelesen von kohorten
+ERGEBNIS_DIR = os.path.join("data", "ergebnisse")
+
+
+class ErgebnisSpeicher:
+    """Liest und schreibt die Ergebnistabellen als Parquet (falls pyarrow vorhanden) oder CSV:
+    zusammenfassung.<format> mit einer Zeile pro EKG und beats/ekg_<id>.<format> pro Aufnahme.
+    Während eines Laufs landet die Zusammenfassung jedes fertigen EKGs sofort in zeilen/ekg_<id>.<format>;
+    am Ende werden die Zeilen in die Zusammenfassung übernommen. Ein abgebrochener Lauf verliert so
+    keine fertigen Ergebnisse."""
+
+    def __init__(self, verzeichnis=ERGEBNIS_DIR, format="parquet"):
+        self.verzeichnis = verzeichnis
+        self.format = format
+        os.makedirs(os.path.join(verzeichnis, "beats"), exist_ok=True)
+        os.makedirs(os.path.join(verzeichnis, "zeilen"), exist_ok=True)
+
+    @property
+    def zusammenfassung_pfad(self):
+        return os.path.join(self.verzeichnis, f"zusammenfassung.{self.format}")
+
+    def beats_pfad(self, ekg_id):
+        return os.path.join(self.verzeichnis, "beats", f"ekg_{ekg_id}.{self.format}")
+
+    def _zeilen_pfade(self):
+        verzeichnis = os.path.join(self.verzeichnis, "zeilen")
+        return [os.path.join(verzeichnis, name) for name in sorted(os.listdir(verzeichnis))
+                if name.endswith(f".{self.format}")]
+
+    def _lesen(self, pfad):
+        return pd.read_parquet(pfad) if self.format == "parquet" else pd.read_csv(pfad)
+
+    def _schreiben(self, df, pfad):
+        tmp = f"{pfad}.tmp"
+        if self.format == "parquet":
+            df.to_parquet(tmp, index=False)
+        else:
+            df.to_csv(tmp, index=False)
+        os.replace(tmp, pfad)
+
+    def zeilen(self):
+        """Gibt die einzeln abgelegten Zeilen zurück, die noch nicht in der Zusammenfassung stehen."""
+        teile = [self._lesen(pfad) for pfad in self._zeilen_pfade()]
+        teile = [teil for teil in teile if not teil.empty]
+        return pd.concat(teile, ignore_index=True) if teile else pd.DataFrame()
+
+    def zusammenfassung(self):
+        """Gibt die bisherige Zusammenfassung zurück, samt Zeilen eines abgebrochenen Laufs (leer beim ersten Lauf)."""
+        teile = [self._lesen(self.zusammenfassung_pfad)] if os.path.exists(self.zusammenfassung_pfad) else []
+        teile = [teil for teil in teile + [self.zeilen()] if not teil.empty]
+        if not teile:
+            return pd.DataFrame()
+        # Neuere Zeilen ersetzen ältere desselben EKGs
+        return pd.concat(teile, ignore_index=True).drop_duplicates("ekg_id", keep="last").reset_index(drop=True)
+
+    def schreibe_zusammenfassung(self, df):
+        """Schreibt die Zusammenfassung und verwirft die darin übernommenen Einzelzeilen."""
+        zeilen = self._zeilen_pfade()
+        self._schreiben(df, self.zusammenfassung_pfad)
+        for pfad in zeilen:
+            os.remove(pfad)
+
+    def schreibe_zeile(self, zusammenfassung):
+        """Legt die Zusammenfassung eines fertig ausgewerteten EKGs sofort ab (nach seinen Beats)."""
+        pfad = os.path.join(self.verzeichnis, "zeilen", f"ekg_{zusammenfassung['ekg_id']}.{self.format}")
+        self._schreiben(pd.DataFrame([zusammenfassung]), pfad)
+
+    def schreibe_beats(self, ekg_id, df):
+        self._schreiben(df, self.beats_pfad(ekg_id))
@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+from scipy.signal import butter, sosfiltfilt
+
+# Standardfenster: 5 min, alle 30 s ein neues Fenster
+FENSTER_MS = 5 * 60 * 1000
+SCHRITT_MS = 30 * 1000
+
+# Gleichmäßig abgetastetes Tachogramm für die Frequenzanalyse
+TACHOGRAMM_HZ = 4
+LF_BAND = (0.04, 0.15)
+HF_BAND = (0.15, 0.4)
+
+SPALTEN = ["Zeit in ms", "Fensterbeginn in ms", "Schläge", "Ø Herzfrequenz (bpm)", "RMSSD (ms)", "SDNN (ms)",
+           "pNN50 (%)", "LF (ms²)", "HF (ms²)", "LF/HF"]
+
+
+def _fenstersumme(kumuliert, anfang, ende):
+    """Summe über [anfang, ende) für viele Fenster gleichzeitig aus einer kumulierten Summe (mit führender 0)."""
+    return kumuliert[ende] - kumuliert[anfang]
+
+
+def _kumuliert(werte):
+    return np.concatenate(([0.0], np.cumsum(werte, dtype=np.float64)))
+
+
+def _bandleistung(tachogramm, band):
+    """Filtert das Tachogramm einmal auf ein Frequenzband (vorwärts und rückwärts, ohne Phasenversatz)
+    und gibt die quadrierten Werte zurück; ihr Mittel über ein Fenster ist die Leistung im Band."""
+    sos = butter(4, band, btype="bandpass", fs=TACHOGRAMM_HZ, output="sos")
+    if len(tachogramm) <= 3 * (2 * len(sos) + 1):
+        return None
+    return np.square(sosfiltfilt(sos, tachogramm))
+
+
+def hrv_fenster(rr, fenster_ms=FENSTER_MS, schritt_ms=SCHRITT_MS, frequenzbereich=True):
+    """Berechnet HRV-Kennzahlen in gleitenden Fenstern über die RR-Intervalle einer Aufnahme.
+
+    Alle Fenster werden über kumulierte Summen ausgewertet: Die Arrays werden einmal aufsummiert,
+    jedes Fenster ist danach eine Differenz zweier Einträge. Der Aufwand wächst damit linear mit der
+    Anzahl der Schläge, unabhängig davon, wie viele Fenster es gibt. Für LF/HF wird das Tachogramm
+    einmal gleichmäßig abgetastet und in beide Bänder gefiltert, die Leistung pro Fenster ist dann
+    ebenfalls eine Fenstersumme.
+
+    Zeitsprünge in der Aufnahme (nicht positive Intervalle) werden übersprungen: Die Fenster laufen
+    über die aneinandergereihten gültigen Intervalle, Differenzen über einen Sprung hinweg zählen nicht.
+
+        Input:
+        rr (RRIntervalle): RR-Intervalle der Aufnahme.
+        fenster_ms (int, optional): Fensterlänge in ms.
+        schritt_ms (int, optional): Abstand der Fensteranfänge in ms.
+        frequenzbereich (bool, optional): False lässt LF/HF weg (Spalten bleiben leer).
+
+        Output:
+        DataFrame mit einer Zeile pro Fenster; "Zeit in ms" ist die Fenstermitte auf der Zeitachse
+        der Aufnahme, passend zu Heart_Rate."""
+    intervalle = rr.intervalle[rr.gueltig].astype(np.float64)
+    n = len(intervalle)
+    if n < 2:
+        return pd.DataFrame(columns=SPALTEN)
+
+    # Durchgehende Zeitachse: Beginn jedes Intervalls, ohne Sprünge
+    achse = rr.bpm_zeiten[0] + np.concatenate(([0.0], np.cumsum(intervalle)[:-1]))
+    dauer = achse[-1] + intervalle[-1] - achse[0]
+    anzahl = max(1, int((dauer - fenster_ms) // schritt_ms) + 1)
+    beginn = achse[0] + np.arange(anzahl) * float(schritt_ms)
+    anfang = np.searchsorted(achse, beginn, side="left")
+    ende = np.searchsorted(achse, beginn + fenster_ms, side="left")
+    schlaege = ende - anfang
+
+    # Zeitbereichskennzahlen; für die Varianz um den Gesamtmittelwert zentriert, damit nichts ausgelöscht wird
+    zentriert = intervalle - intervalle.mean()
+    summe = _fenstersumme(_kumuliert(zentriert), anfang, ende)
+    quadrate = _fenstersumme(_kumuliert(np.square(zentriert)), anfang, ende)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mittel_rr = summe / schlaege + intervalle.mean()
+        sdnn = np.sqrt(np.maximum(quadrate - np.square(summe) / schlaege, 0) / (schlaege - 1))
+
+        # Aufeinanderfolgende Differenzen nur zwischen direkt benachbarten gültigen Intervallen;
+        # Differenz i gehört zum Fenster, wenn beide Intervalle i und i+1 darin liegen
+        original = np.flatnonzero(rr.gueltig)
+        benachbart = np.diff(original) == 1
+        differenzen = np.where(benachbart, np.diff(intervalle), 0.0)
+        d_ende = np.maximum(ende - 1, anfang)
+        d_anzahl = _fenstersumme(_kumuliert(benachbart), anfang, d_ende)
+        rmssd = np.sqrt(_fenstersumme(_kumuliert(np.square(differenzen)), anfang, d_ende) / d_anzahl)
+        pnn50 = 100 * _fenstersumme(_kumuliert(benachbart & (np.abs(differenzen) > 50)), anfang, d_ende) / d_anzahl
+
+    lf = hf = np.full(anzahl, np.nan)
+    if frequenzbereich:
+        # RR-Wert jeweils am Ende seines Intervalls, linear auf TACHOGRAMM_HZ interpoliert
+        enden = achse + intervalle
+        raster = np.arange(enden[0], enden[-1], 1000 / TACHOGRAMM_HZ)
+        tachogramm = np.interp(raster, enden, intervalle)
+        tachogramm -= tachogramm.mean()
+        r_anfang = np.searchsorted(raster, beginn, side="left")
+        r_ende = np.searchsorted(raster, beginn + fenster_ms, side="left")
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for band, name in ((LF_BAND, "lf"), (HF_BAND, "hf")):
+                leistung = _bandleistung(tachogramm, band)
+                if leistung is None:
+                    continue
+                werte = _fenstersumme(_kumuliert(leistung), r_anfang, r_ende) / (r_ende - r_anfang)
+                if name == "lf":
+                    lf = werte
+                else:
+                    hf = werte
+
+    # Fenstermitte auf die Zeitachse der Aufnahme zurückführen (Beginn des nächstgelegenen Intervalls)
+    mitte = np.clip(np.searchsorted(achse, beginn + fenster_ms / 2), 0, n - 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        df = pd.DataFrame({
+            "Zeit in ms": rr.bpm_zeiten[mitte],
+            "Fensterbeginn in ms": beginn,
+            "Schläge": schlaege,
+            "Ø Herzfrequenz (bpm)": 60000 / mittel_rr,
+            "RMSSD (ms)": rmssd,
+            "SDNN (ms)": sdnn,
+            "pNN50 (%)": pnn50,
+            "LF (ms²)": lf,
+            "HF (ms²)": hf,
+            "LF/HF": lf / hf})
+    # Leere Fenster (z.B. nach einer Messpause) nicht als 0 ausgeben
+    df.loc[schlaege < 2, SPALTEN[3:]] = np.nan
+    return df
+
+
+def plot_hrv_fenster(hrv_df, kennzahlen=("RMSSD (ms)", "SDNN (ms)", "LF/HF")):
+    """Erstellt einen Plot des HRV-Verlaufs mit einer Zeile pro Kennzahl und gemeinsamer Zeitachse.
+
+        Input:
+        hrv_df: DataFrame aus hrv_fenster.
+        kennzahlen (tuple, optional): Darzustellende Spalten.
+
+        Output:
+        Plot des HRV-Verlaufs (x-Achse "Zeit in ms" wie bei plot_Hear_Rate)."""
+    fig = make_subplots(rows=len(kennzahlen), cols=1, shared_xaxes=True, vertical_spacing=0.04)
+    for zeile, kennzahl in enumerate(kennzahlen, start=1):
+        fig.add_trace(go.Scatter(x=hrv_df["Zeit in ms"], y=hrv_df[kennzahl], mode="lines", name=kennzahl),
+                      row=zeile, col=1)
+        fig.update_yaxes(title_text=kennzahl, row=zeile, col=1)
+    fig.update_xaxes(title_text="Zeit in ms", row=len(kennzahlen), col=1)
+    fig.update_layout(height=200 * len(kennzahlen) + 80, showlegend=False)
+    return fig
@@ -0,0 +1,204 @@
+import os
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from ergebnis_speicher import ERGEBNIS_DIR, ErgebnisSpeicher
+
+# Spalten der Schlag-Tabellen, die für Abfragen gelesen werden (zeit_ms und rr_ms nur bei Bedarf)
+SCHLAG_SPALTEN = ["ekg_id", "bpm", "anomalie"]
+
+
+def _datum_spalte(datum):
+    """Wandelt die Datumsspalte ("10.2.2023" oder "2023-02-10") vektorisiert in datetime64 um."""
+    datum = datum.astype(str)
+    ergebnis = pd.to_datetime(datum, format="%d.%m.%Y", errors="coerce")
+    return ergebnis.fillna(pd.to_datetime(datum, format="%Y-%m-%d", errors="coerce"))
+
+
+def _als_zeitpunkt(wert):
+    return None if wert is None else pd.Timestamp(wert)
+
+
+def altersgruppe(alter, breite=10):
+    """Ordnet Alterswerte vektorisiert Gruppen der angegebenen Breite zu (z.B. "20-29").
+
+        Input:
+        alter (Series): Alter in Jahren.
+        breite (int, optional): Breite einer Gruppe in Jahren.
+
+        Output:
+        Tupel (Untergrenze als int-Series, Beschriftung als Series)."""
+    untergrenze = (alter // breite * breite).astype(int)
+    return untergrenze, untergrenze.astype(str) + "-" + (untergrenze + breite - 1).astype(str)
+
+
+class KohortenAbfrage:
+    """Beantwortet Fragen über alle Versuchspersonen aus den Ergebnistabellen von analyse_cli
+    (zusammenfassung mit einer Zeile pro EKG, beats/ekg_<id> mit einer Zeile pro Schlag).
+    Die EKG-Textdateien werden dabei nie gelesen.
+
+    Filter laufen zuerst auf der kleinen Zusammenfassung; von den Schlag-Tabellen werden nur die
+    Dateien der verbleibenden EKGs und nur die benötigten Spalten gelesen."""
+
+    def __init__(self, verzeichnis=ERGEBNIS_DIR, format=None):
+        if format is None:
+            # Vorhandenes Format verwenden, Parquet bevorzugt
+            format = "csv" if os.path.exists(os.path.join(verzeichnis, "zusammenfassung.csv")) and not \
+                os.path.exists(os.path.join(verzeichnis, "zusammenfassung.parquet")) else "parquet"
+        self.speicher = ErgebnisSpeicher(verzeichnis, format)
+        self._lock = threading.Lock()
+        self._signatur = None
+        self._zusammenfassung = pd.DataFrame()
+
+    @property
+    def stand(self):
+        """Zeitpunkt der letzten Auswertung mit analyse_cli (datetime) oder None."""
+        try:
+            return datetime.fromtimestamp(os.path.getmtime(self.speicher.zusammenfassung_pfad))
+        except OSError:
+            return None
+
+    def zusammenfassung(self):
+        """Gibt die Zusammenfassung mit zusätzlicher Spalte "datum_dt" (datetime64) zurück.
+        Sie wird nur neu gelesen, wenn sich die Datei seit dem letzten Zugriff geändert hat."""
+        pfad = self.speicher.zusammenfassung_pfad
+        try:
+            stat = os.stat(pfad)
+            signatur = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            signatur = None
+        with self._lock:
+            if signatur != self._signatur:
+                df = self.speicher.zusammenfassung() if signatur else pd.DataFrame()
+                if not df.empty:
+                    df["datum_dt"] = _datum_spalte(df["datum"])
+                self._zusammenfassung, self._signatur = df, signatur
+            return self._zusammenfassung
+
+    def aufnahmen(self, von=None, bis=None, person_ids=None, min_alter=None, max_alter=None):
+        """Filtert die EKGs aller Personen nach Datum, Person und Alter bei der Aufnahme.
+
+            Input:
+            von, bis (date or str, optional): Datumsbereich, jeweils einschließlich.
+            person_ids (list, optional): Nur diese Personen.
+            min_alter, max_alter (int, optional): Altersbereich, jeweils einschließlich.
+
+            Output:
+            DataFrame mit einer Zeile pro EKG (Spalten der Zusammenfassung)."""
+        df = self.zusammenfassung()
+        if df.empty:
+            return df
+        maske = np.ones(len(df), dtype=bool)
+        if von is not None:
+            maske &= (df["datum_dt"] >= _als_zeitpunkt(von)).to_numpy()
+        if bis is not None:
+            maske &= (df["datum_dt"] <= _als_zeitpunkt(bis)).to_numpy()
+        if person_ids is not None:
+            maske &= df["person_id"].isin(person_ids).to_numpy()
+        if min_alter is not None:
+            maske &= (df["alter"] >= min_alter).to_numpy()
+        if max_alter is not None:
+            maske &= (df["alter"] <= max_alter).to_numpy()
+        return df[maske]
+
+    def schlaege(self, ekg_ids, spalten=SCHLAG_SPALTEN):
+        """Liest die Schlag-Tabellen der angegebenen EKGs spaltenweise in einen DataFrame.
+
+            Input:
+            ekg_ids (list): IDs der EKGs, deren Schläge gebraucht werden.
+            spalten (list, optional): Zu lesende Spalten.
+
+            Output:
+            DataFrame mit einer Zeile pro Schlag."""
+        pfade = [self.speicher.beats_pfad(ekg_id) for ekg_id in ekg_ids]
+        pfade = [pfad for pfad in pfade if os.path.exists(pfad)]
+        if not pfade:
+            return pd.DataFrame(columns=list(spalten))
+        if self.speicher.format == "parquet":
+            import pyarrow.dataset as ds
+            # Ein Dataset über genau diese Dateien, pyarrow liest sie parallel und nur die gewählten Spalten
+            return ds.dataset(pfade, format="parquet").to_table(columns=list(spalten)).to_pandas()
+        return pd.concat([pd.read_csv(pfad, usecols=list(spalten)) for pfad in pfade], ignore_index=True)
+
+    def ueber_hr_grenze(self, von=None, bis=None, tage=None):
+        """Findet alle Personen mit Schlägen über ihrer Grenze 220 - Alter (Alter am Tag der Aufnahme).
+
+            Input:
+            von, bis (date or str, optional): Datumsbereich der Aufnahmen.
+            tage (int, optional): Statt von/bis die letzten tage Tage bis heute, z.B. 30 für den letzten Monat.
+
+            Output:
+            DataFrame mit einer Zeile pro Person (person_id, Anzahl EKGs und Schläge über der Grenze,
+            höchste Herzfrequenz, Grenze, erstes und letztes betroffenes Datum), nach Schlägen absteigend sortiert."""
+        if tage is not None:
+            von, bis = date.today() - timedelta(days=tage), date.today()
+        spalten = ["person_id", "ekg_anzahl", "schlaege_ueber_grenze", "max_bpm", "grenze_bpm", "erstes_datum",
+                   "letztes_datum"]
+        aufnahmen = self.aufnahmen(von, bis)
+        if aufnahmen.empty:
+            return pd.DataFrame(columns=spalten)
+        # Nur EKGs, deren höchster Schlag über der Grenze liegt, können Treffer enthalten
+        kandidaten = aufnahmen[aufnahmen["hr_max_bpm"] > 220 - aufnahmen["alter"]]
+        if kandidaten.empty:
+            return pd.DataFrame(columns=spalten)
+
+        schlaege = self.schlaege(kandidaten["ekg_id"].tolist(), ["ekg_id", "bpm"])
+        ekg_info = kandidaten.set_index("ekg_id")
+        grenze = schlaege["ekg_id"].map(220 - ekg_info["alter"])
+        treffer = schlaege[schlaege["bpm"].to_numpy() > grenze.to_numpy()]
+        if treffer.empty:
+            return pd.DataFrame(columns=spalten)
+
+        pro_ekg = treffer.groupby("ekg_id")["bpm"].agg(["size", "max"])
+        pro_ekg = pro_ekg.join(ekg_info[["person_id", "alter", "datum_dt"]])
+        pro_ekg["grenze_bpm"] = 220 - pro_ekg["alter"]
+        ergebnis = pro_ekg.groupby("person_id").agg(
+            ekg_anzahl=("size", "count"),
+            schlaege_ueber_grenze=("size", "sum"),
+            max_bpm=("max", "max"),
+            grenze_bpm=("grenze_bpm", "min"),
+            erstes_datum=("datum_dt", "min"),
+            letztes_datum=("datum_dt", "max"))
+        return ergebnis.reset_index().sort_values("schlaege_ueber_grenze", ascending=False, ignore_index=True)
+
+    def hrv_nach_altersgruppe(self, breite=10, von=None, bis=None, min_qualitaet=None):
+        """Verteilung der HRV (RMSSD pro EKG) nach Altersgruppen.
+
+            Input:
+            breite (int, optional): Breite der Altersgruppen in Jahren.
+            von, bis (date or str, optional): Datumsbereich der Aufnahmen.
+            min_qualitaet (float, optional): Nur EKGs mit mindestens dieser Signalqualität (0-1).
+
+            Output:
+            DataFrame mit einer Zeile pro Altersgruppe (Anzahl EKGs und Personen, Mittelwert, Quantile)."""
+        df = self.aufnahmen(von, bis)
+        spalten = ["altersgruppe", "ekg_anzahl", "personen", "mittel_ms", "p10_ms", "median_ms", "p90_ms"]
+        if df.empty:
+            return pd.DataFrame(columns=spalten)
+        if min_qualitaet is not None:
+            df = df[df["signalqualitaet"] >= min_qualitaet]
+        df = df[df["rmssd_ms"].notna()]
+        untergrenze, beschriftung = altersgruppe(df["alter"], breite)
+        gruppen = df.assign(untergrenze=untergrenze.to_numpy(), altersgruppe=beschriftung.to_numpy()) \
+            .groupby(["untergrenze", "altersgruppe"])
+        ergebnis = gruppen.agg(
+            ekg_anzahl=("rmssd_ms", "size"),
+            personen=("person_id", "nunique"),
+            mittel_ms=("rmssd_ms", "mean"),
+            p10_ms=("rmssd_ms", lambda werte: werte.quantile(0.1)),
+            median_ms=("rmssd_ms", "median"),
+            p90_ms=("rmssd_ms", lambda werte: werte.quantile(0.9)))
+        return ergebnis.reset_index(level="altersgruppe").reset_index(drop=True)[spalten]
+
+
+_abfrage = None
+
+def get_kohorten():
+    """Gibt die gemeinsame Abfrage-Instanz der App zurück (beim ersten Zugriff angelegt)."""
+    global _abfrage
+    if _abfrage is None:
+        _abfrage = KohortenAbfrage()
+    return _abfrage
@@ -1,14 +1,23 @@
 import streamlit as st
-from read_data import load_person_data
 from read_data import get_person_list
 from read_data import find_person_data_by_name
-from PIL import Image #paket zum anzeigen der bilder
+from read_data import add_person, update_person
 from person import Person
 from ekgdaten import EKGdata
+from ekg_index import get_index
+from ekg_cache import ABTASTRATE_HZ, quell_signatur
+from vorschaubilder import erzeuge_vorschau, lade_vorschau
+from kohorten import get_kohorten, altersgruppe
+from ekg_live import LiveSitzung, wiedergabe_quelle, socket_quelle, pipe_quelle
+from ekg_jobs import reiche_upload_ein, ist_fertig, fortschritt, markiere_abgebrochene, FEHLER
+from ekg_speicher import aufnahme_speicher
+from messung import messungen
+from read_data import find_ekg_data_by_id, personen_namen
 import plotly.express as px
-from datetime import date,datetime
+from datetime import date,datetime,timedelta
 import os
-import json
+import time
+import numpy as np
 import pandas as pd
 
 
@@ -38,6 +47,12 @@ def login():
         else:
             st.error("Benutzername oder Passwort falsch.")
 
+# Uploads, die ein früherer Serverprozess nicht mehr fertig verarbeitet hat, gelten als fehlgeschlagen (einmal pro Prozess)
+markiere_abgebrochene()
+
+# Optionaler Tab mit Laufzeiten und Zählern der Auswertung (EKG_ADMIN_TAB=1)
+ADMIN_TAB = os.environ.get("EKG_ADMIN_TAB", "0") == "1"
+
 # Login-Abfrage
 if "logged_in" not in st.session_state:
     st.session_state["logged_in"] = False
@@ -46,8 +61,129 @@ if not st.session_state["logged_in"]:
     login()
     st.stop()  #Stoppt die Ausführung, wenn nicht eingeloggt
 
+# Jeder Rerun ist ein Lauf, dem alle Messungen bis beende_lauf am Ende der Seite zugeordnet werden
+messungen.starte_lauf()
+
+
+# Fortschritt eines hochgeladenen EKGs, das im Hintergrund verarbeitet wird; lädt die Seite neu, sobald es fertig
+# oder fehlgeschlagen ist oder länger als UPLOAD_WARTEZEIT_S läuft, damit die Abfrage nicht endlos weiterläuft
+UPLOAD_WARTEZEIT_S = 600
+
+
+def upload_wartezeit(ekg_id):
+    # Sekunden, seit diese Sitzung den Fortschritt des EKGs anzeigt
+    start = st.session_state.setdefault("upload_start", {}).setdefault(ekg_id, time.monotonic())
+    return time.monotonic() - start
+
+
+@st.fragment(run_every=2)
+def upload_fortschritt(ekg_id):
+    ekg_status = find_ekg_data_by_id(ekg_id)
+    if ekg_status is None:
+        return
+    if ist_fertig(ekg_status) or ekg_status["status"] == FEHLER or upload_wartezeit(ekg_id) > UPLOAD_WARTEZEIT_S:
+        st.rerun()
+    st.progress(fortschritt(ekg_status), text=f"EKG {ekg_id} wird verarbeitet: {ekg_status.get('status_text')}")
+
+
+# Ausgewertete Aufnahme der Sitzung: bleibt über Reruns erhalten, solange dieselbe Datei angezeigt wird,
+# samt Pipeline (Peaks, RR-Intervalle, Anomalien) und Referenz im Aufnahme-Speicher
+def sitzungs_ekg(ekg_dict):
+    signatur = quell_signatur(ekg_dict["result_link"])
+    schluessel = (ekg_dict["id"], signatur["pfad"], signatur["mtime_ns"], signatur["groesse"])
+    if st.session_state.get("ekg_schluessel") != schluessel:
+        st.session_state.ekg = EKGdata(ekg_dict)
+        st.session_state.ekg_schluessel = schluessel
+    return st.session_state.ekg
+
+
+# Vorschaubild einer Person (vorschaubilder): bleibt für alle Sitzungen im Speicher, bis sich die Bilddatei ändert
+@st.cache_data(show_spinner=False, max_entries=256)
+def vorschau(pfad, mtime_ns, groesse):
+    return lade_vorschau(pfad)
+
+
+def personen_vorschau(pfad):
+    try:
+        stat = os.stat(pfad)
+    except OSError:
+        return None
+    return vorschau(pfad, stat.st_mtime_ns, stat.st_size)
+
+
+# EKG- und Herzfrequenz-Plot im gewählten Zeitbereich: Der Slider führt nur dieses Fragment neu aus,
+# Aufnahme, Peaks, Anomalien und Herzfrequenz kommen unverändert aus dem letzten vollständigen Lauf
+PLOT_PIXEL = 1500
+
+
+@st.fragment
+def ekg_ansicht(ekg_dict, ekg, peaks, anomalies, hr_df, zeitachse):
+    with messungen.eigener_lauf("fragment:ekg_ansicht"):
+        start_ekg, ende_ekg, erster = zeitachse
+        selected_range = st.slider("Zeitbereich in ms wählen:", start_ekg, ende_ekg, (erster, min(erster + 10000, ende_ekg)))
+        slider_start_time = selected_range[0]
+        slider_end_time = selected_range[1]
+        signal = st.radio("Signal", ["roh", "gefiltert", "beide"], horizontal=True,
+                          help="gefiltert: Bandpass 0,5-40 Hz und Kerbfilter 50 Hz, einmal pro Aufnahme berechnet")
+
+        # Nur der gewählte Zeitbereich wird an den Browser übertragen. Passen die Rohdaten in die Plotbreite
+        # (höchstens zwei Messwerte pro Pixel), werden nur die Messwerte des Fensters gelesen, bei Archiven
+        # also nur die Blöcke, die es überlappen
+        fenster = None
+        if (slider_end_time - slider_start_time) * ABTASTRATE_HZ / 1000 <= 2 * PLOT_PIXEL:
+            fenster = EKGdata.lies_zeitfenster(ekg_dict, slider_start_time, slider_end_time)
+        fig = ekg.plot_time_series(peaks, anomalies, x_bereich=(slider_start_time, slider_end_time),
+                                   pixel_breite=PLOT_PIXEL, signal=signal, fenster=fenster)
+        st.plotly_chart(fig, use_container_width=True)
+
+        #Herzrate als plot
+        fig = EKGdata.plot_Hear_Rate(hr_df)
+        fig.update_layout(xaxis = dict(range=[slider_start_time, slider_end_time])) #Plot auch in der range von dem slider
+        st.plotly_chart(fig, use_container_width=True)
+
+
+# HRV-Verlauf: Fenster und Schritt ändern nur dieses Fragment, die RR-Intervalle kommen aus der Pipeline
+@st.fragment
+def hrv_ansicht(ekg, peaks):
+    with messungen.eigener_lauf("fragment:hrv_ansicht"):
+        fenster_spalte, schritt_spalte = st.columns(2)
+        fenster_min = fenster_spalte.selectbox("HRV-Fenster in min", [1, 2, 5], index=2)
+        schritt_s = schritt_spalte.selectbox("Schritt in s", [10, 30, 60], index=1)
+        hrv_df = ekg.hrv_verlauf(peaks, fenster_min * 60000, schritt_s * 1000)
+        if hrv_df["RMSSD (ms)"].notna().any():
+            fig = EKGdata.plot_HRV_Verlauf(hrv_df)
+            st.plotly_chart(fig, use_container_width=True)
+
+
+# Vergleich mehrerer EKGs aus dem Übersichtsindex, unabhängig von der angezeigten Aufnahme
+@st.fragment
+def vergleich_ansicht(ekg_tests):
+    with messungen.eigener_lauf("fragment:vergleich_ansicht"):
+        st.write("Wähle beliebig viele EKGs zum Vergleich aus:")
+
+        # Multiselect erlaubt Auswahl mehrerer IDs
+        selected_ekg_ids = st.multiselect("Wähle EKG-IDs:", [test['id'] for test in ekg_tests if ist_fertig(test)])
+
+        # Wenn mindestens eine EKG-ID ausgewählt wurde
+        if selected_ekg_ids:
+            # Kennzahlen aus dem Übersichtsindex, neue oder geänderte EKGs werden dabei nachgetragen
+            df_vergleich = get_index().vergleichstabelle([EKGdata.load_by_id(None, ekg_id) for ekg_id in selected_ekg_ids])
+
+            st.subheader("Vergleich mehrerer EKG-Tests")
+            st.dataframe(df_vergleich)
+
+            #HFV als Plot über die Zeit
+            fig = EKGdata.plot_HFV(df_vergleich)
+            st.plotly_chart(fig, use_container_width=True)
 
-tab1, tab2, tab3, tab4, tab5 = st.tabs(["Versuchsperson", "EKG-Daten","Nachrichten", "Versuchsperson anlegen", "Versuchsperson bearbeiten" ])
+        else:
+            st.info("Bitte mindestens einen EKG-Test auswählen.")
+
+
+tab_namen = ["Versuchsperson", "EKG-Daten","Nachrichten", "Versuchsperson anlegen", "Versuchsperson bearbeiten", "Live-EKG", "Kohorten" ]
+if ADMIN_TAB:
+    tab_namen.append("Leistung")
+tab1, tab2, tab3, tab4, tab5, tab6, tab7, *admin_tab = st.tabs(tab_namen)
 
 #Logout-Button
 if st.button("Logout"):
@@ -56,8 +192,7 @@ if st.button("Logout"):
 
 with tab1:
     st.write("## Versuchsperson")
-    person_data = load_person_data()
-    person_names = get_person_list(person_data)
+    person_names = get_person_list()
 
     st.write("# Versuchsperson auswählen")
 
@@ -74,9 +209,12 @@ with tab1:
 
     person = find_person_data_by_name(st.session_state.current_user)
 
-    # Anzeigen eines Bilds mit Caption
-    image = Image.open(person["picture_path"])
-    st.image(image, caption=st.session_state.current_user)
+    # Anzeigen eines Bilds mit Caption; übertragen wird nur die verkleinerte Vorschau
+    image = personen_vorschau(person["picture_path"])
+    if image is not None:
+        st.image(image, caption=st.session_state.current_user)
+    else:
+        st.caption(f"Kein Bild für {st.session_state.current_user}")
 
     #Versuchspersondaten
     my_current_person = Person(person)
@@ -97,89 +235,99 @@ with tab2:
     ekg_tests = person.get('ekg_tests', [])
     ekg_ids = [test['id'] for test in ekg_tests]
     selected_ekg_id = st.selectbox("Wähle eine EKG-Test-ID aus:", ekg_ids)
-    ekg_dict = EKGdata.load_by_id(ekg_tests, selected_ekg_id)
+    # Auswahl stammt aus den EKGs der Person -> direkt über den EKG-Index laden
+    ekg_dict = EKGdata.load_by_id(None, selected_ekg_id) if selected_ekg_id is not None else None
+
+    # Hochgeladene EKGs erst anzeigen, wenn die Hintergrundverarbeitung abgeschlossen ist
+    wird_verarbeitet = ekg_dict is not None and not ist_fertig(ekg_dict)
+    if wird_verarbeitet:
+        if ekg_dict.get("status") == FEHLER:
+            st.error(f"EKG {ekg_dict['id']} konnte nicht verarbeitet werden: {ekg_dict.get('status_text')}")
+        elif upload_wartezeit(ekg_dict["id"]) <= UPLOAD_WARTEZEIT_S:
+            upload_fortschritt(ekg_dict["id"])
+        else:
+            st.warning(f"EKG {ekg_dict['id']} wird seit über {UPLOAD_WARTEZEIT_S // 60} min verarbeitet "
+                       f"({ekg_dict.get('status_text')}); die Anzeige wird nicht mehr aktualisiert.")
+            if st.button("Status erneut prüfen"):
+                del st.session_state.upload_start[ekg_dict["id"]]
+                st.rerun()
+        ekg_dict = None
 
     if ekg_dict:
-        ekg = EKGdata(ekg_dict)
+        ekg = sitzungs_ekg(ekg_dict)
+        # Nur die in diesem Lauf neu berechneten Stufen anzeigen
+        ekg.pipeline().berechnet.clear()
 
         #EKGtest daten
         st.write("EKG-Test Datum: ", ekg.date)
         zeit_ekg = len(ekg.df["Zeit in ms"])/60000 # in min
         st.write("EKG-Test Länge in min: ", format(zeit_ekg, ".2f"))
 
+        #Parameter der Peak-Erkennung; bei Änderungen rechnen nur die davon abhängigen Stufen neu
+        with st.expander("Peak-Erkennung einstellen"):
+            detektor = st.selectbox("Detektor", list(EKGdata.DETEKTOREN),
+                                    help="pan_tompkins passt seine Schwellen an das Signal an und braucht keine feste Höhe")
+            vorfilter = st.checkbox("Im gefilterten Signal suchen",
+                                    help="Ohne Grundlinienschwankung liegt das Signal um 0, eine Höhe passt dann für alle Aufnahmen")
+            # Abstand, Höhe und Prominenz gelten nur für den Schwellen-Detektor
+            feste_schwellen = detektor != "schwelle"
+            distanz_spalte, hoehe_spalte, prominenz_spalte = st.columns(3)
+            distance = distanz_spalte.slider("Mindestabstand (Samples)", 50, 500, 200, step=10, disabled=feste_schwellen)
+            if vorfilter:
+                height = hoehe_spalte.slider("Mindesthöhe über Grundlinie (mV)", 0, 200, 25, step=5, disabled=feste_schwellen)
+                prominence = prominenz_spalte.slider("Mindestprominenz (mV)", 0, 200, 20, step=5, disabled=feste_schwellen)
+            else:
+                height = hoehe_spalte.slider("Mindesthöhe (mV)", 200, 600, 340, step=5, disabled=feste_schwellen)
+                prominence = prominenz_spalte.slider("Mindestprominenz (mV)", 0, 200, 30, step=5, disabled=feste_schwellen)
 
-        #Zeitstrahl für plot
-        start_ekg = ekg.df["Zeit in ms"][0]
-        selected_range = st.slider("Zeitbereich in ms wählen:", 0, 500000, (start_ekg,(start_ekg+10000)))
-        slider_start_time = selected_range[0]
-        slider_end_time = selected_range[1]
-
-        #plot der EKG-Daten
-        peaks = ekg.find_peaks()
+        peaks = ekg.find_peaks(distance=distance, height=height, prominence=prominence, detektor=detektor,
+                               vorfilter=vorfilter)
         anomalies = ekg.detect_anomalies(peaks, alter)
-        fig = ekg.plot_time_series(peaks, anomalies)
-        ekg.fig.update_layout(xaxis = dict(range=[slider_start_time, slider_end_time]))
-        st.plotly_chart(fig, use_container_width=True)
-
-        #Herzrate über die ges. Zeit
-        st.write("Herzfrequenz basierend auf den Peaks in bpm: ", int(ekg.estimate_hr(peaks)))
-
-        #Herzrate als plot
         hr_df = ekg.Heart_Rate(peaks)
-        fig = EKGdata.plot_Hear_Rate(hr_df)
-        fig.update_layout(xaxis = dict(range=[slider_start_time, slider_end_time])) #Plot auch in der range von dem slider
-        st.plotly_chart(fig, use_container_width=True)
-        
-        #Herzfrequenzvariablität
-        st.write("Herzfrequenzvariablität in ms: ", int(ekg.Heartratevariation(peaks, ekg.df["Zeit in ms"])))
-       
-        #Vergleich bei mehreren EGK-Daten
-        st.write("Wähle beliebig viele EKGs zum Vergleich aus:")
-
-        # Multiselect erlaubt Auswahl mehrerer IDs
-        selected_ekg_ids = st.multiselect("Wähle EKG-IDs:", ekg_ids)
 
-        # Wenn mindestens eine EKG-ID ausgewählt wurde
-        if selected_ekg_ids:
-            ekg_stat_list = []
+        #Zeitstrahl für plot: ganze Aufnahme (auch bei Zeitsprüngen), Start am ersten Messwert
+        zeit = ekg.df["Zeit in ms"].to_numpy()
+        ekg_ansicht(ekg_dict, ekg, peaks, anomalies, hr_df, (int(zeit.min()), int(zeit.max()), int(zeit[0])))
 
-            for ekg_id in selected_ekg_ids:
-                ekg_dict1 = EKGdata.load_by_id(ekg_tests, ekg_id)
-                ekg1 = EKGdata(ekg_dict1)
-                ekg_stat_list.append(EKGdata.get_ekg_stats(ekg1))
+        #Herzrate und Herzfrequenzvariablität über die ges. Zeit; mit den eingestellten Parametern können
+        #weniger als 3 Peaks gefunden werden, dann gibt es keine zwei RR-Intervalle und es wird "-" angezeigt
+        hr, hrv = (ekg.estimate_hr(peaks), ekg.rr_intervalle(peaks).rmssd) if len(peaks) >= 3 else (np.nan, np.nan)
+        st.write("Herzfrequenz basierend auf den Peaks in bpm: ", int(hr) if np.isfinite(hr) else "-")
+        st.write("Herzfrequenzvariablität in ms: ", int(hrv) if np.isfinite(hrv) else "-")
 
-            df_vergleich = pd.DataFrame(ekg_stat_list)
-
-            st.subheader("Vergleich mehrerer EKG-Tests")
-            st.dataframe(df_vergleich)
-
-            #HFV als Plot über die Zeit
-            fig = EKGdata.plot_HFV(df_vergleich)
-            st.plotly_chart(fig, use_container_width=True)
+        #HRV-Verlauf in gleitenden Fenstern (z.B. für Belastungstests)
+        hrv_ansicht(ekg, peaks)
 
+        berechnet = ekg.pipeline().berechnet
+        if berechnet:
+            st.caption("Neu berechnet: " + ", ".join(f"{stufe} ({ms:.0f} ms)" for stufe, ms in berechnet))
         else:
-            st.info("Bitte mindestens einen EKG-Test auswählen.")
-
-        
+            st.caption("Alle Auswertungsstufen aus dem Cache.")
 
+        #Vergleich bei mehreren EGK-Daten
+        vergleich_ansicht(ekg_tests)
 
-    else:
+    elif not wird_verarbeitet:
         st.write("Keine EKG-Daten vorhanden.")
 
 
 with tab3:
     if ekg_dict:
-        #Anomaliererkennung
-        anomalies = ekg.detect_anomalies(peaks, alter)
-
-        if anomalies:
-            for zeitpunkt, bpm in anomalies:
-                st.write(f"Auffälligkeit bei {zeitpunkt:.0f} ms: {bpm:.1f} BPM")
-            st.write("Anomalien werden Orange in der Grafik im Tab EKG-Daten dargestellt.")
+        #Anomaliererkennung: Ergebnis aus Tab 2 wiederverwenden
+        if len(anomalies):
+            # Eine Meldung pro Episode, nicht pro Schlag
+            for art, beginn, ende, dauer, schlaege, min_bpm, max_bpm in anomalies.itertuples(index=False):
+                meldung = f"{art} von {beginn:.0f} ms bis {ende:.0f} ms ({dauer / 1000:.1f} s"
+                if schlaege == 1:
+                    meldung += f", 1 Schlag, {min_bpm:.0f} BPM"
+                elif schlaege:
+                    meldung += f", {schlaege} Schläge, {min_bpm:.0f}-{max_bpm:.0f} BPM"
+                st.write(meldung + ")")
+            st.write("Die Episoden werden farbig nach Art in der Grafik im Tab EKG-Daten dargestellt.")
         else:
             st.write("Keine Anomalien vorhanden.")
 
-    else:
+    elif not wird_verarbeitet:
         st.write("Keine EKG-Daten vorhanden.")
 
 
@@ -196,24 +344,18 @@ with tab4:
         date_of_birth = st.date_input("Geburtsjahr", value=max_date, min_value=min_date, max_value=max_date)
         st.write("Bitte laden Sie vor dem Speichern ein Bild der Versuchsperson hoch.")
 
-        
-        data = load_person_data()
 
-        # IDs auslesen, falls "id" noch nicht existiert, auf 0 setzen
-        existing_ids = [person.get("id", 0) for person in data]
-        
-        # nächste ID bestimmen
-        next_id = max(existing_ids) + 1 if existing_ids else 1
         #Bild und EKG-Daten hochladen
         uploaded_file = st.file_uploader("Bild hochladen (nur JPG)", type=["jpg", "jpeg"])
-        ekg_txt_file = st.file_uploader("EKG-Daten optional hochladen (als .txt)", type=["txt"])
+        ekg_txt_file = st.file_uploader("EKG-Daten optional hochladen (als .txt oder .ekgz)", type=["txt", "ekgz"])
 
         #Speicherbutton
         submitted = st.form_submit_button("Speichern")
 
         if submitted:
             if firstname and lastname and date_of_birth and uploaded_file is not None:
-                
+                # Person zuerst anlegen, die ID wird vom Speicher vergeben
+                next_id = add_person(firstname, lastname, date_of_birth.strftime("%d.%m.%Y"))
 
                 img_dir = "uploaded_file"
                 os.makedirs(img_dir, exist_ok=True)
@@ -222,50 +364,14 @@ with tab4:
 
                 with open(img_path, "wb") as f:
                     f.write(uploaded_file.getbuffer())
+                # Vorschau gleich beim Hochladen anlegen, nicht erst bei der ersten Anzeige
+                erzeuge_vorschau(img_path)
+                update_person(next_id, picture_path=img_path)
 
-                #Optional: EKG-Datei speichern
-                ekg_dir = "data/ekg_data"
-                os.makedirs(ekg_dir, exist_ok=True)
-                ekg_tests = []
-
-                all_ekg_ids = []
-                for p in data:
-                    for ekg in p.get("ekg_tests", []):
-                        all_ekg_ids.append(ekg.get("id", 0))
-
-                next_ekg_id = max(all_ekg_ids) + 1 if all_ekg_ids else 1
-
+                #Optional: EKG-Datei im Hintergrund prüfen, umwandeln und auswerten
                 if ekg_txt_file is not None:
-                    ekg_file_path = os.path.join(ekg_dir, f"{next_ekg_id}.txt")
-                    with open(ekg_file_path, "wb") as f:
-                        f.write(ekg_txt_file.getbuffer())
-
-                    # Beispielhafte EKG-Metadaten (anpassbar)
-                    ekg_tests.append({
-                        "id":  next_ekg_id,
-                        "date": str(date.today()),
-                        "result_link": ekg_file_path
-                    })
-
-
-                new_person = {
-                    "id": next_id,
-                    "firstname": firstname,
-                    "lastname": lastname,
-                    "date_of_birth": date_of_birth.strftime("%d.%m.%Y"),
-                    "picture_path": img_path,
-                }
-
-                if ekg_tests:
-                    new_person["ekg_tests"] = ekg_tests
-
-                # Alte Daten laden, neue Person anhängen und speichern
-                data.append(new_person)
-
-                # JSON-Datei speichern
-
-                with open("data/person_db.json", "w") as f:
-                    json.dump(data, f, indent=4)
+                    # Eintrag anlegen, das Archiv data/ekg_data/<id>.ekgz ergibt sich aus der neuen EKG-ID
+                    reiche_upload_ein(next_id, str(date.today()), ekg_txt_file.getbuffer())
 
                 st.success(f"{firstname} {lastname} wurde erfolgreich hinzugefügt!")
 
@@ -280,7 +386,7 @@ with tab5:
 
     # Bild und EKG-Dateien optional hochladen
     uploaded_file = st.file_uploader("Neues Bild hochladen (nur JPG)", type=["jpg", "jpeg"])
-    uploaded_ekg = st.file_uploader("Neue EKG-Datei hochladen (optional, TXT)", type=["txt"])
+    uploaded_ekg = st.file_uploader("Neue EKG-Datei hochladen (optional, TXT oder EKGZ)", type=["txt", "ekgz"])
     ekg_date = date.today().strftime("%d.%m.%Y")  # aktuelles Datum
 
     with st.form("edit_form"):
@@ -291,59 +397,147 @@ with tab5:
         submitted = st.form_submit_button("Änderungen speichern")
 
         if submitted:
-            data = load_person_data()
-
-            for idx, p in enumerate(data):
-                if p["id"] == person["id"]:
-                    # Personendaten aktualisieren
-                    data[idx]["firstname"] = new_firstname
-                    data[idx]["lastname"] = new_lastname
-                    data[idx]["date_of_birth"] = new_birthday.strftime("%d.%m.%Y")
+            # Personendaten aktualisieren
+            update_person(
+                person["id"],
+                firstname=new_firstname,
+                lastname=new_lastname,
+                date_of_birth=new_birthday.strftime("%d.%m.%Y"))
+
+            # Neues Bild speichern (optional)
+            if uploaded_file is not None:
+                picture_path = person["picture_path"]
+                with open(picture_path, "wb") as f:
+                    f.write(uploaded_file.getbuffer())
+                erzeuge_vorschau(picture_path)
 
-                    # Neues Bild speichern (optional)
-                    if uploaded_file is not None:
-                        picture_path = data[idx]["picture_path"]
-                        with open(picture_path, "wb") as f:
-                            f.write(uploaded_file.getbuffer())
+            # Neues EKG im Hintergrund verarbeiten (nur wenn hochgeladen)
+            if uploaded_ekg is not None:
+                ekg_bytes = uploaded_ekg.read()
+                if ekg_bytes.strip():  # Nicht leer
+                    # Neue eindeutige EKG-ID wird vom Speicher vergeben, Fortschritt im Tab EKG-Daten
+                    reiche_upload_ein(person["id"], ekg_date, ekg_bytes)
 
-                    # Neues EKG speichern (nur wenn hochgeladen)
-                    if uploaded_ekg is not None:
-                        ekg_bytes = uploaded_ekg.read()
-                        if ekg_bytes.strip():  # Nicht leer
+            st.success("Daten wurden erfolgreich aktualisiert.")
+            st.rerun()
 
-                            # Neue eindeutige EKG-ID generieren
-                            all_ekg_ids = [
-                                ekg.get("id", 0)
-                                for person_data in data
-                                for ekg in person_data.get("ekg_tests", [])
-                            ]
-                            next_ekg_id = max(all_ekg_ids, default=0) + 1
 
+# Live-Ansicht: wird jede Sekunde aus dem Ringpuffer der laufenden Sitzung neu gezeichnet,
+# ohne dass die restliche Seite neu ausgeführt wird
+@st.fragment(run_every=1)
+def live_ansicht():
+    sitzung = st.session_state.get("live_sitzung")
+    if sitzung is None:
+        st.info("Keine Live-Sitzung gestartet.")
+        return
+    zustand = sitzung.zustand(sekunden=10)
+    if sitzung.fehler is not None:
+        st.error(f"Quelle beendet mit Fehler: {sitzung.fehler}")
+    elif not sitzung.laeuft:
+        st.write("Quelle beendet.")
+
+    spalte1, spalte2, spalte3 = st.columns(3)
+    spalte1.metric("Herzfrequenz (bpm)", f"{zustand['hr']:.0f}" if zustand["hr"] else "-")
+    spalte2.metric("RMSSD (ms)", f"{zustand['rmssd']:.0f}" if zustand["rmssd"] else "-")
+    spalte3.metric("Alarme", len(zustand["alarme"]))
+
+    if len(zustand["zeit"]):
+        fig = px.line(x=zustand["zeit"], y=zustand["werte"], labels={"x": "Zeit in ms", "y": "Messwerte in mV"})
+        if zustand["peaks"]:
+            peak_zeiten, peak_werte = zip(*zustand["peaks"])
+            fig.add_scatter(x=peak_zeiten, y=peak_werte, mode="markers", marker=dict(color="red", size=8), name="Peaks")
+        for alarm in zustand["alarme"]:
+            if alarm["zeit_ms"] >= zustand["zeit"][0]:
+                fig.add_vrect(x0=alarm["zeit_ms"] - 100, x1=alarm["zeit_ms"] + 100, fillcolor="orange",
+                              opacity=0.3, layer="below", line_width=0)
+        st.plotly_chart(fig, use_container_width=True)
 
-                            ekg_dir = "data/ekg_data"
-                            os.makedirs(ekg_dir, exist_ok=True)
-                            ekg_filename = f"{next_ekg_id}.txt"
-                            ekg_path = os.path.join(ekg_dir, ekg_filename)
-                            ekg_path_unix = ekg_path.replace("\\", "/")
+    for alarm in reversed(zustand["alarme"][-5:]):
+        st.warning(f"Auffälligkeit bei {alarm['zeit_ms']:.0f} ms: {alarm['bpm']:.1f} BPM "
+                   f"(gemeldet nach {alarm['latenz_s']:.1f} s)")
+
+
+with tab6:
+    st.write("## Live-EKG")
+    quelle = st.radio("Quelle", ["Wiedergabe einer Aufnahme", "Gerät (TCP)", "Pipe/FIFO"], horizontal=True)
+    if quelle == "Wiedergabe einer Aufnahme":
+        live_ekg_id = st.selectbox("EKG für die Wiedergabe:", ekg_ids, key="live_ekg")
+        geschwindigkeit = st.slider("Geschwindigkeit", 1.0, 10.0, 1.0)
+        live_ekg = EKGdata.load_by_id(None, live_ekg_id) if live_ekg_id is not None else None
+        fabrik = (lambda stopp: wiedergabe_quelle(live_ekg["result_link"], stopp, geschwindigkeit)) if live_ekg else None
+    elif quelle == "Gerät (TCP)":
+        host = st.text_input("Host", "127.0.0.1")
+        port = st.number_input("Port", 1, 65535, 5555)
+        fabrik = lambda stopp: socket_quelle(host, int(port), stopp)
+    else:
+        fifo_pfad = st.text_input("Pfad der Pipe", "/tmp/ekg_live")
+        fabrik = lambda stopp: pipe_quelle(fifo_pfad, stopp)
+
+    start_spalte, stopp_spalte = st.columns(2)
+    if start_spalte.button("Live starten", disabled=fabrik is None):
+        if st.session_state.get("live_sitzung") is not None:
+            st.session_state.live_sitzung.stoppe()
+        # Alarmgrenzen wie in detect_anomalies nach dem Alter der ausgewählten Person
+        st.session_state.live_sitzung = LiveSitzung(fabrik, alter).starte()
+    if stopp_spalte.button("Live stoppen") and st.session_state.get("live_sitzung") is not None:
+        st.session_state.live_sitzung.stoppe()
+
+    live_ansicht()
+
+
+with tab7:
+    st.write("## Kohorten")
+    # Abfragen über alle Personen aus den Ergebnistabellen von analyse_cli, ohne die EKG-Dateien zu lesen
+    kohorten = get_kohorten()
+    if kohorten.zusammenfassung().empty:
+        st.info("Noch keine Ergebnistabellen vorhanden. Bitte zuerst python analyse_cli.py ausführen.")
+    else:
+        st.caption(f"Stand der Auswertung: {kohorten.stand:%d.%m.%Y %H:%M} ({len(kohorten.zusammenfassung())} EKGs)")
+        namen = personen_namen()
+
+        st.subheader("Herzfrequenz über 220 - Alter")
+        zeitraum = st.date_input("Zeitraum der Aufnahmen", (date.today() - timedelta(days=30), date.today()))
+        if len(zeitraum) == 2:
+            df_grenze = kohorten.ueber_hr_grenze(*zeitraum)
+            if df_grenze.empty:
+                st.write("Keine Versuchsperson über der Grenze in diesem Zeitraum.")
+            else:
+                df_grenze.insert(1, "name", df_grenze["person_id"].map(namen))
+                st.dataframe(df_grenze)
+
+        st.subheader("HRV nach Altersgruppe")
+        breite = st.slider("Breite der Altersgruppen (Jahre)", 5, 20, 10, step=5)
+        st.dataframe(kohorten.hrv_nach_altersgruppe(breite))
+        df_hrv = kohorten.aufnahmen().dropna(subset=["rmssd_ms"])
+        untergrenze, gruppe = altersgruppe(df_hrv["alter"], breite)
+        fig = px.box(df_hrv.assign(altersgruppe=gruppe, untergrenze=untergrenze).sort_values("untergrenze"),
+                     x="altersgruppe", y="rmssd_ms", hover_data=["person_id", "ekg_id", "datum"],
+                     labels={"altersgruppe": "Altersgruppe", "rmssd_ms": "HRV (RMSSD in ms)"})
+        st.plotly_chart(fig, use_container_width=True)
 
-                            with open(ekg_path, "wb") as f:
-                                f.write(ekg_bytes)
 
-                            new_ekg_entry = {
-                                "id": next_ekg_id,
-                                "date": ekg_date,
-                                "result_link": ekg_path_unix
-                            }
+lauf = messungen.beende_lauf()
 
-                            if "ekg_tests" not in data[idx]:
-                                data[idx]["ekg_tests"] = []
+if admin_tab:
+    with admin_tab[0]:
+        st.write("## Leistung")
+        spalte1, spalte2, spalte3 = st.columns(3)
+        spalte1.metric("Dieser Rerun (ms)", f"{lauf['gesamt_ms']:.0f}" if lauf else "-")
+        speicher_stat = aufnahme_speicher.statistik()
+        spalte2.metric("Aufnahmen im Speicher", speicher_stat["aufnahmen"])
+        spalte3.metric("Speicher (MB)", f"{speicher_stat['bytes'] / 1e6:.1f}")
 
-                            data[idx]["ekg_tests"].append(new_ekg_entry)
+        st.subheader("Letzte Reruns (ms pro Messpunkt)")
+        st.dataframe(messungen.lauf_tabelle())
 
+        st.subheader("Messpunkte mit Perzentilen")
+        st.dataframe(messungen.statistik())
 
-            # Alle Änderungen speichern
-            with open("data/person_db.json", "w") as f:
-                json.dump(data, f, indent=4)
+        st.subheader("Zähler")
+        st.dataframe(pd.DataFrame(sorted(messungen.zaehler.items()), columns=["Zähler", "Wert"]))
 
-            st.success("Daten wurden erfolgreich aktualisiert.")
-            st.rerun()
+        export_spalte, leeren_spalte = st.columns(2)
+        export_spalte.download_button("Als JSON Lines exportieren", messungen.als_jsonl(),
+                                      file_name=f"messungen_{datetime.now():%Y%m%d_%H%M%S}.jsonl")
+        if leeren_spalte.button("Messungen zurücksetzen"):
+            messungen.leeren()
@@ -0,0 +1,181 @@
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Messung ist standardmäßig an; EKG_MESSUNG=0 schaltet sie ab
+AKTIV = os.environ.get("EKG_MESSUNG", "1") != "0"
+
+# Optional: jede Lauf-Zusammenfassung zusätzlich als JSON-Zeile an diese Datei anhängen
+JSONL_PFAD = os.environ.get("EKG_MESSUNG_JSONL") or None
+
+# Obergrenzen der im Prozess gehaltenen Messungen (älteste fallen heraus)
+MAX_EREIGNISSE = 50_000
+MAX_LAEUFE = 200
+
+
+class Messungen:
+    """Sammelt Laufzeiten und Zähler der wichtigsten Einstiegspunkte (Laden, Peaks, Plots, Datenbank).
+
+    Jede Messung ist ein Ereignis (Name, Dauer, Lauf); ein Lauf ist ein Streamlit-Rerun und wird pro
+    Thread über starte_lauf/beende_lauf geklammert. Zähler (z.B. geparste Zeilen, gefundene Peaks,
+    Cache-Treffer) werden gesamt und pro Lauf geführt. Alles liegt in begrenzten Ringpuffern, eine
+    Messung kostet nur zwei perf_counter-Aufrufe und ein append."""
+
+    def __init__(self, max_ereignisse=MAX_EREIGNISSE, max_laeufe=MAX_LAEUFE):
+        self.ereignisse = deque(maxlen=max_ereignisse)
+        self.laeufe = deque(maxlen=max_laeufe)
+        self.zaehler = defaultdict(int)
+        self._lokal = threading.local()
+        self._nummern = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _lauf(self):
+        return getattr(self._lokal, "lauf", None)
+
+    def starte_lauf(self, name="rerun"):
+        """Beginnt einen neuen Lauf im aktuellen Thread (ein noch offener Lauf wird abgeschlossen)."""
+        if self._lauf() is not None:
+            self.beende_lauf()
+        self._lokal.lauf = {"lauf": next(self._nummern), "name": name, "beginn": time.time(),
+                            "_start": time.perf_counter(), "zeiten": defaultdict(float), "zaehler": defaultdict(int)}
+
+    def beende_lauf(self):
+        """Schließt den Lauf des aktuellen Threads ab und gibt seine Zusammenfassung zurück."""
+        lauf = self._lauf()
+        if lauf is None:
+            return None
+        self._lokal.lauf = None
+        zusammenfassung = {
+            "lauf": lauf["lauf"],
+            "name": lauf["name"],
+            "beginn": lauf["beginn"],
+            "gesamt_ms": (time.perf_counter() - lauf["_start"]) * 1000,
+            "zeiten_ms": dict(lauf["zeiten"]),
+            "zaehler": dict(lauf["zaehler"])}
+        self.laeufe.append(zusammenfassung)
+        if JSONL_PFAD:
+            try:
+                with open(JSONL_PFAD, "a") as f:
+                    f.write(json.dumps({"typ": "lauf", **zusammenfassung}) + "\n")
+            except OSError:
+                pass
+        return zusammenfassung
+
+    @contextmanager
+    def eigener_lauf(self, name):
+        """Klammert einen Block als eigenen Lauf, falls im Thread keiner offen ist (z.B. Rerun eines
+        Streamlit-Fragments); innerhalb eines vollständigen Reruns zählt der Block zu dessen Lauf."""
+        if self._lauf() is not None:
+            yield
+            return
+        self.starte_lauf(name)
+        try:
+            yield
+        finally:
+            self.beende_lauf()
+
+    def erfasse(self, name, dauer_s):
+        """Speichert eine Laufzeit unter name."""
+        lauf = self._lauf()
+        self.ereignisse.append((time.time(), name, dauer_s * 1000, lauf["lauf"] if lauf else None))
+        if lauf is not None:
+            lauf["zeiten"][name] += dauer_s * 1000
+
+    def zaehle(self, name, anzahl=1):
+        """Erhöht einen Zähler (gesamt und im laufenden Rerun)."""
+        if not AKTIV:
+            return
+        with self._lock:
+            self.zaehler[name] += anzahl
+        lauf = self._lauf()
+        if lauf is not None:
+            lauf["zaehler"][name] += anzahl
+
+    @contextmanager
+    def messe(self, name):
+        """Misst die Laufzeit eines with-Blocks."""
+        if not AKTIV:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.erfasse(name, time.perf_counter() - start)
+
+    def statistik(self):
+        """Gibt pro Messpunkt Anzahl, Summe, Mittelwert und Perzentile (ms) zurück.
+
+            Output:
+            DataFrame mit einer Zeile pro Messpunkt, nach Gesamtzeit absteigend sortiert."""
+        spalten = ["name", "anzahl", "summe_ms", "mittel_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms"]
+        ereignisse = list(self.ereignisse)
+        if not ereignisse:
+            return pd.DataFrame(columns=spalten)
+        df = pd.DataFrame(ereignisse, columns=["zeit", "name", "dauer_ms", "lauf"])
+        gruppen = df.groupby("name")["dauer_ms"]
+        ergebnis = pd.DataFrame({
+            "anzahl": gruppen.size(),
+            "summe_ms": gruppen.sum(),
+            "mittel_ms": gruppen.mean(),
+            "p50_ms": gruppen.quantile(0.5),
+            "p90_ms": gruppen.quantile(0.9),
+            "p99_ms": gruppen.quantile(0.99),
+            "max_ms": gruppen.max()})
+        return ergebnis.reset_index().sort_values("summe_ms", ascending=False, ignore_index=True)[spalten]
+
+    def lauf_tabelle(self, anzahl=20):
+        """Gibt die letzten Läufe mit Gesamtzeit und Zeit pro Messpunkt (ms) zurück, neueste zuerst."""
+        laeufe = list(self.laeufe)[-anzahl:][::-1]
+        zeilen = [dict(lauf=eintrag["lauf"], beginn=pd.Timestamp(eintrag["beginn"], unit="s"),
+                       gesamt_ms=eintrag["gesamt_ms"], **eintrag["zeiten_ms"]) for eintrag in laeufe]
+        return pd.DataFrame(zeilen)
+
+    def als_jsonl(self):
+        """Gibt alle Ereignisse, Läufe und Zähler als JSON Lines zurück (eine Zeile pro Datensatz)."""
+        zeilen = [json.dumps({"typ": "messung", "zeit": z, "name": n, "dauer_ms": d, "lauf": l})
+                  for z, n, d, l in list(self.ereignisse)]
+        zeilen += [json.dumps({"typ": "lauf", **lauf}) for lauf in list(self.laeufe)]
+        zeilen.append(json.dumps({"typ": "zaehler", "zeit": time.time(), "werte": dict(self.zaehler)}))
+        return "\n".join(zeilen) + "\n"
+
+    def exportiere(self, pfad):
+        """Hängt alle Messungen als JSON Lines an eine Datei an."""
+        os.makedirs(os.path.dirname(pfad) or ".", exist_ok=True)
+        with open(pfad, "a") as f:
+            f.write(self.als_jsonl())
+
+    def leeren(self):
+        """Verwirft alle bisherigen Messungen, Läufe und Zähler."""
+        self.ereignisse.clear()
+        self.laeufe.clear()
+        with self._lock:
+            self.zaehler.clear()
+
+
+# Gemeinsame Instanz für den ganzen Prozess
+messungen = Messungen()
+
+
+def gemessen(name):
+    """Dekorator, der jeden Aufruf einer Funktion unter name misst, z.B. @gemessen("EKGdata.find_peaks")."""
+    def dekorator(funktion):
+        if not AKTIV:
+            return funktion
+
+        @functools.wraps(funktion)
+        def messen(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return funktion(*args, **kwargs)
+            finally:
+                messungen.erfasse(name, time.perf_counter() - start)
+        return messen
+    return dekorator
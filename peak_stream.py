@@ -0,0 +1,350 @@
+import numpy as np
+import pandas as pd
+from scipy.signal import find_peaks, peak_prominences
+
+from ekg_archiv import EKGArchiv, ist_archiv
+from ekg_cache import SPALTEN
+
+
+def lies_messwerte_chunks(pfad, chunk_groesse=65536):
+    """Liest die Messwerte einer EKG-Textdatei (oder eines Archivs) blockweise, ohne die ganze Datei in den Speicher zu laden.
+
+        Input:
+        pfad (str): Pfad zur EKG-Textdatei.
+        chunk_groesse (int, optional): Anzahl Zeilen pro Block.
+
+        Output:
+        Generator über NumPy-Arrays mit den Messwerten."""
+    if ist_archiv(pfad):
+        # Archive sind schon in Blöcke geteilt
+        for werte, _ in EKGArchiv(pfad).lies_bloecke():
+            yield werte
+        return
+    reader = pd.read_csv(pfad, sep='\t', header=None, names=SPALTEN, usecols=[0], chunksize=chunk_groesse)
+    with reader:
+        for chunk in reader:
+            yield chunk[SPALTEN[0]].to_numpy()
+
+
+def waehle_nach_distanz(peaks, prioritaet, distance):
+    """Distanz-Auswahl wie in scipy.signal.find_peaks: Peaks werden nach Höhe absteigend abgearbeitet,
+    Nachbarn näher als distance fallen weg. Bei gleicher Höhe gewinnt der frühere Peak; scipy sortiert
+    hier instabil, womit das Ergebnis bei Gleichstand vom Rechner abhängt.
+
+        Input:
+        peaks: aufsteigende Indizes der Kandidaten.
+        prioritaet: Höhe der Kandidaten.
+        distance (int): Minimale Distanz zwischen Peaks.
+
+        Output:
+        Boolesche Maske der behaltenen Kandidaten."""
+    distance = int(np.ceil(distance))
+    keep = np.ones(len(peaks), dtype=bool)
+    for j in np.argsort(-np.asarray(prioritaet, dtype=np.float64), kind='stable'):
+        if not keep[j]:
+            continue
+        k = j - 1
+        while 0 <= k and peaks[j] - peaks[k] < distance:
+            keep[k] = False
+            k -= 1
+        k = j + 1
+        while k < len(peaks) and peaks[k] - peaks[j] < distance:
+            keep[k] = False
+            k += 1
+    return keep
+
+
+def finde_peaks(signal, distance=200, height=340, prominence=30):
+    """Peak-Erkennung auf dem Gesamtsignal in der Reihenfolge von scipy.signal.find_peaks
+    (Höhe, Distanz, Prominenz), aber mit eindeutiger Distanz-Auswahl bei gleich hohen Peaks.
+
+        Input:
+        signal: Messwerte.
+        distance (int, optional): Minimale Distanz zwischen Peaks.
+        height (int, optional): Minimale Höhe der Peaks.
+        prominence (int, optional): Minimale Prominenz der Peaks.
+
+        Output:
+        Array mit den Indizes der gefundenen Peaks."""
+    x = np.asarray(signal, dtype=np.float64)
+    peaks, _ = find_peaks(x, height=height)
+    if distance is not None:
+        peaks = peaks[waehle_nach_distanz(peaks, x[peaks], distance)]
+    if prominence is not None:
+        peaks = peaks[peak_prominences(x, peaks)[0] >= prominence]
+    return peaks
+
+
+def _scan(x, start, richtung, wert, schwelle):
+    """Sucht ab x[start] in eine Richtung, ob zuerst ein Wert <= schwelle (True)
+    oder ein Wert > wert (False) auftaucht. None, wenn im Block keins von beiden vorkommt.
+    Das Suchfenster wächst geometrisch, damit die Kosten proportional zur Suchlänge bleiben."""
+    verfuegbar = start + 1 if richtung < 0 else len(x) - start
+    laenge = 64
+    while True:
+        m = min(laenge, verfuegbar)
+        stueck = x[start - m + 1:start + 1][::-1] if richtung < 0 else x[start:start + m]
+        hoeher = stueck > wert
+        tief = stueck <= schwelle
+        i_hoeher = hoeher.argmax() if hoeher.any() else m
+        i_tief = tief.argmax() if tief.any() else m
+        if i_tief < i_hoeher:
+            return True
+        if i_hoeher < m:
+            return False
+        if m == verfuegbar:
+            return None
+        laenge *= 4
+
+
+class StreamingPeakDetektor:
+    """Inkrementelle R-Peak-Erkennung mit denselben Ergebnissen wie finde_peaks auf dem Gesamtsignal.
+
+    Das Signal wird blockweise übergeben. Zwischen den Blöcken werden nur kleine Zustände gehalten:
+    die noch offene letzte Plateau-Folge, eine Zusammenfassung der Vergangenheit für die linke
+    Prominenz, offene rechte Prominenz-Prüfungen und die Kandidaten der noch offenen Distanz-Cluster.
+    Ein Peak wird ausgegeben, sobald spätere Daten seine Auswahl nicht mehr ändern können.
+
+    Bei hoher Herzfrequenz können Distanz-Cluster (Kandidaten mit Lücken < distance) sehr lang werden,
+    sodass Peaks erst nach vielen Sekunden feststehen. Mit fruehe_ausgabe=True wird die Distanz-Auswahl
+    innerhalb des Clusters schrittweise entschieden: Ein Kandidat fällt weg, sobald ein behaltener
+    höherer Nachbar feststeht, und bleibt, sobald alle höheren Nachbarn weggefallen sind. Die Menge
+    der Peaks ist dieselbe, nur kann ein Peak dann in Ausnahmefällen nach späteren Peaks ausgegeben werden."""
+
+    def __init__(self, distance=200, height=340, prominence=30, fruehe_ausgabe=False):
+        self.distance = int(np.ceil(distance)) if distance is not None else 1
+        self.height = height if height is not None else -np.inf
+        self.prominence = prominence
+        self.fruehe_ausgabe = fruehe_ausgabe
+
+        # Globaler Index des nächsten Samples
+        self.position = 0
+        # Noch offene letzte Folge gleicher Werte: (Wert davor, Wert, globaler Startindex)
+        self._lauf = None
+
+        # Vergangenheit für die linke Prominenz: Suffix-Rekorde (Werte fallend) und
+        # das Minimum aller Samples nach dem jeweiligen Rekord
+        self._rekord_werte = np.empty(0)
+        self._rekord_min_danach = np.empty(0)
+        self._historie_min = np.inf
+
+        # Offene rechte Prominenz-Prüfungen: globaler Index -> (Wert, Kandidat)
+        self._offen_rechts = {}
+        # Distanz-Cluster als Listen von Kandidaten
+        # [index, wert, prominenz_ok (True/False/None), distanz ("behalten"/"weg"/None), ausgegeben].
+        # Der letzte Cluster ist noch offen, die davor warten nur noch auf Prominenz-Prüfungen.
+        self._cluster = []
+
+        # Nur für fruehe_ausgabe: noch nicht ausgegebene Kandidaten als (cluster, position)
+        self._offen_frueh = []
+
+    def _lokale_maxima(self, x):
+        """Findet lokale Maxima (bei Plateaus die Mitte, wie in scipy) über Blockgrenzen hinweg."""
+        grenzen = np.flatnonzero(np.diff(x)) + 1
+        starts = np.concatenate(([0], grenzen)) + self.position
+        enden = np.concatenate((grenzen, [len(x)])) - 1 + self.position
+        werte = x[starts - self.position]
+
+        vorher_erster = np.nan
+        if self._lauf is not None:
+            lauf_vorher, lauf_wert, lauf_start = self._lauf
+            vorher_erster = lauf_vorher
+            if werte[0] == lauf_wert:
+                # Plateau läuft über die Blockgrenze weiter
+                starts[0] = lauf_start
+            else:
+                starts = np.concatenate(([lauf_start], starts))
+                enden = np.concatenate(([self.position - 1], enden))
+                werte = np.concatenate(([lauf_wert], werte))
+        vorher = np.concatenate(([vorher_erster], werte[:-1]))
+
+        # Die letzte Folge ist erst abgeschlossen, wenn der nächste Block einen anderen Wert liefert
+        self._lauf = (vorher[-1], werte[-1], int(starts[-1]))
+
+        ist_max = (vorher[:-1] < werte[:-1]) & (werte[1:] < werte[:-1])
+        mitten = (starts[:-1] + enden[:-1]) // 2
+        return mitten[ist_max], werte[:-1][ist_max]
+
+    def _links_ok(self, x, lokal, wert):
+        """Linke Prominenz-Bedingung: Wird links ein Wert <= wert - prominence erreicht,
+        bevor ein Wert > wert auftaucht oder das Signal beginnt?"""
+        schwelle = wert - self.prominence
+        if lokal >= 0:
+            ergebnis = _scan(x, lokal, -1, wert, schwelle)
+            if ergebnis is not None:
+                return ergebnis
+        # Im Block nicht entschieden -> Zusammenfassung der Vergangenheit befragen
+        anzahl_hoeher = np.searchsorted(-self._rekord_werte, -wert, side='left')
+        if anzahl_hoeher == 0:
+            return self._historie_min <= schwelle
+        return self._rekord_min_danach[anzahl_hoeher - 1] <= schwelle
+
+    def _historie_erweitern(self, x):
+        """Fügt den Block der Zusammenfassung der Vergangenheit hinzu (vektorisiert)."""
+        suffix_max = np.maximum.accumulate(x[::-1])[::-1]
+        rekord = np.ones(len(x), dtype=bool)
+        rekord[:-1] = x[:-1] > suffix_max[1:]
+        suffix_min = np.minimum.accumulate(x[::-1])[::-1]
+        min_danach = np.append(suffix_min[1:], np.inf)
+
+        behalten = self._rekord_werte > x.max()
+        self._rekord_werte = np.concatenate((self._rekord_werte[behalten], x[rekord]))
+        self._rekord_min_danach = np.concatenate((
+            np.minimum(self._rekord_min_danach[behalten], x.min()),
+            min_danach[rekord]))
+        self._historie_min = min(self._historie_min, x.min())
+
+    def _neuer_kandidat(self, x, index, wert):
+        """Prüft die Prominenz eines Kandidaten und ordnet ihn einem Distanz-Cluster zu."""
+        kandidat = [index, wert, True, None, False]
+        if self.prominence is not None:
+            lokal = index - self.position
+            if not self._links_ok(x, lokal, wert):
+                kandidat[2] = False
+            else:
+                kandidat[2] = _scan(x, max(lokal, 0), 1, wert, wert - self.prominence)
+                if kandidat[2] is None:
+                    self._offen_rechts[index] = (wert, kandidat)
+
+        if not self._cluster or index - self._cluster[-1][-1][0] >= self.distance:
+            self._cluster.append([])
+        self._cluster[-1].append(kandidat)
+        if self.fruehe_ausgabe:
+            self._offen_frueh.append((self._cluster[-1], len(self._cluster[-1]) - 1))
+
+    def _auswahl_nach_distanz(self, cluster):
+        """Distanz-Auswahl eines Clusters. Cluster sind durch Lücken >= distance getrennt
+        und lassen sich daher einzeln auswerten."""
+        peaks = np.array([c[0] for c in cluster], dtype=np.int64)
+        prioritaet = np.array([c[1] for c in cluster], dtype=np.float64)
+        keep = waehle_nach_distanz(peaks, prioritaet, self.distance)
+        prominenz_ok = np.array([c[2] is True and not c[4] for c in cluster], dtype=bool)
+        for c in cluster:
+            c[4] = True
+        return peaks[keep & prominenz_ok]
+
+    def _distanz_status(self, cluster, position, naechster_index):
+        """Entscheidet die Distanz-Auswahl eines Kandidaten aus seinen Nachbarn, soweit schon möglich.
+        Bei gleicher Höhe gewinnt wie in waehle_nach_distanz der frühere Kandidat."""
+        kandidat = cluster[position]
+        alle_hoeheren_weg = True
+        for richtung in (-1, 1):
+            j = position + richtung
+            while 0 <= j < len(cluster) and abs(cluster[j][0] - kandidat[0]) < self.distance:
+                nachbar = cluster[j]
+                if nachbar[1] > kandidat[1] or (nachbar[1] == kandidat[1] and nachbar[0] < kandidat[0]):
+                    if nachbar[3] == "behalten":
+                        return "weg"
+                    if nachbar[3] != "weg":
+                        alle_hoeheren_weg = False
+                j += richtung
+        # Rechts können noch Kandidaten hinzukommen, solange das Fenster nicht vollständig ist
+        if alle_hoeheren_weg and naechster_index - kandidat[0] >= self.distance:
+            return "behalten"
+        return None
+
+    def _fruehe_peaks(self, naechster_index):
+        """Gibt Kandidaten aus, deren Distanz-Auswahl und Prominenz schon feststehen (fruehe_ausgabe).
+
+            Input:
+            naechster_index: kleinster Index, an dem noch ein neuer Kandidat liegen kann."""
+        geaendert = True
+        while geaendert:
+            geaendert = False
+            for cluster, position in self._offen_frueh:
+                kandidat = cluster[position]
+                if kandidat[3] is None and not kandidat[4]:
+                    kandidat[3] = self._distanz_status(cluster, position, naechster_index)
+                    geaendert = geaendert or kandidat[3] is not None
+
+        frueh, offen = [], []
+        for cluster, position in self._offen_frueh:
+            kandidat = cluster[position]
+            if kandidat[4] or kandidat[3] == "weg" or kandidat[2] is False:
+                continue
+            if kandidat[3] == "behalten" and kandidat[2] is True:
+                kandidat[4] = True
+                frueh.append(kandidat[0])
+            else:
+                offen.append((cluster, position))
+        self._offen_frueh = offen
+        return frueh
+
+    def _fertige_cluster(self, naechster_index):
+        """Gibt die Peaks aller vorderen Cluster aus, die abgeschlossen und vollständig geprüft sind.
+
+            Input:
+            naechster_index: kleinster Index, an dem noch ein neuer Kandidat liegen kann."""
+        fertig = []
+        while self._cluster:
+            cluster = self._cluster[0]
+            offen = len(self._cluster) == 1 and naechster_index - cluster[-1][0] < self.distance
+            if offen or any(c[2] is None for c in cluster):
+                break
+            fertig.append(self._auswahl_nach_distanz(self._cluster.pop(0)))
+        if self.fruehe_ausgabe:
+            fertig.append(np.array(self._fruehe_peaks(naechster_index), dtype=np.int64))
+            fertig = [np.sort(np.concatenate(fertig))]
+        if not fertig:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(fertig)
+
+    def verarbeite(self, chunk):
+        """Verarbeitet den nächsten Block von Messwerten.
+
+            Input:
+            chunk: Array mit den nächsten Messwerten.
+
+            Output:
+            Array mit globalen Indizes der Peaks, die jetzt endgültig feststehen."""
+        x = np.asarray(chunk, dtype=np.float64)
+        if len(x) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        # Offene rechte Prüfungen mit dem neuen Block fortsetzen
+        for index, (wert, kandidat) in list(self._offen_rechts.items()):
+            ergebnis = _scan(x, 0, 1, wert, wert - self.prominence)
+            if ergebnis is not None:
+                kandidat[2] = ergebnis
+                del self._offen_rechts[index]
+
+        mitten, werte = self._lokale_maxima(x)
+        hoch_genug = werte >= self.height
+        for index, wert in zip(mitten[hoch_genug].tolist(), werte[hoch_genug].tolist()):
+            self._neuer_kandidat(x, index, wert)
+
+        self._historie_erweitern(x)
+        self.position += len(x)
+        # Ein späterer Peak kann frühestens am Anfang der noch offenen Folge liegen
+        return self._fertige_cluster(self._lauf[2])
+
+    def abschliessen(self):
+        """Beendet den Datenstrom und gibt die restlichen Peaks zurück.
+        Offene rechte Prüfungen sind am Signalende nicht erfüllt, genau wie bei scipy."""
+        for wert, kandidat in self._offen_rechts.values():
+            kandidat[2] = False
+        self._offen_rechts = {}
+        return self._fertige_cluster(np.inf)
+
+
+def finde_peaks_stream(chunks, distance=200, height=340, prominence=30):
+    """Findet R-Peaks blockweise und gibt sie schrittweise aus.
+    Das Ergebnis entspricht EKGdata.find_peaks auf dem vollständigen Signal, der Speicherbedarf
+    hängt aber nur von der Blockgröße ab und nicht von der Länge der Aufnahme.
+
+        Input:
+        chunks: Iterierbare Folge von Messwert-Arrays (z.B. lies_messwerte_chunks(pfad)).
+        distance (int, optional): Minimale Distanz zwischen Peaks.
+        height (int, optional): Minimale Höhe der Peaks.
+        prominence (int, optional): Minimale Prominenz der Peaks.
+
+        Output:
+        Generator über Arrays mit globalen Peak-Indizes (aufsteigend)."""
+    detektor = StreamingPeakDetektor(distance=distance, height=height, prominence=prominence)
+    for chunk in chunks:
+        peaks = detektor.verarbeite(chunk)
+        if len(peaks):
+            yield peaks
+    peaks = detektor.abschliessen()
+    if len(peaks):
+        yield peaks
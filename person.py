@@ -1,17 +1,19 @@
-import json
+import read_data
+from datetime import date, datetime
+from messung import gemessen
 
 class Person:
     
     @staticmethod
+    @gemessen("Person.load_person_data")
     def load_person_data():
         """Lädt die Personendaten aus der JSON-Datei 'data/person_db.json' und gibt sie als Liste von Dictionaries zurück.
         Returns:
             list: Liste von Personen-Dictionaries."""
-        file = open("data/person_db.json")
-        person_data = json.load(file)
-        return person_data
+        return read_data.load_person_data()
 
     @staticmethod
+    @gemessen("Person.get_person_list")
     def get_person_list(person_data):
         """Gibt eine Liste aller Personen-Namen in der Form "Nachname, Vorname" zurück.
         Args:
@@ -25,27 +27,12 @@ class Person:
         return list_of_names
     
     @staticmethod
+    @gemessen("Person.find_person_data_by_name")
     def find_person_data_by_name(suchstring):
         """ Eine Funktion der Nachname, Vorname als ein String übergeben wird
         und die die Person als Dictionary zurück gibt"""
 
-        person_data = Person.load_person_data()
-        #print(suchstring)
-        if suchstring == "None":
-            return {}
-
-        two_names = suchstring.split(", ")
-        vorname = two_names[1]
-        nachname = two_names[0]
-
-        for eintrag in person_data:
-            print(eintrag)
-            if (eintrag["lastname"] == nachname and eintrag["firstname"] == vorname):
-                print()
-
-                return eintrag
-        else:
-            return {}
+        return read_data.find_person_data_by_name(suchstring)
         
 
     def __init__(self, person_dict) -> None:
@@ -53,4 +40,27 @@ class Person:
         self.firstname = person_dict["firstname"]
         self.lastname = person_dict["lastname"]
         self.picture_path = person_dict["picture_path"]
-        self.id = person_dict["id"]
\ No newline at end of file
+        self.id = person_dict["id"]
+
+    @staticmethod
+    def parse_date(datum):
+        """Wandelt ein Datum aus der Datenbank ("10.2.2023" oder "2023-02-10") in ein date-Objekt um."""
+        for format in ("%d.%m.%Y", "%Y-%m-%d"):
+            try:
+                return datetime.strptime(datum, format).date()
+            except ValueError:
+                pass
+        raise ValueError(f"Unbekanntes Datumsformat: {datum}")
+
+    @gemessen("Person.calc_age")
+    def calc_age(self, stichtag=None):
+        """Berechnet das Alter der Person in Jahren.
+
+            Input:
+            stichtag (date, optional): Datum, zu dem das Alter bestimmt wird (Standard: heute).
+
+            Output:
+            Alter in ganzen Jahren."""
+        geburtstag = Person.parse_date(self.date_of_birth)
+        stichtag = stichtag or date.today()
+        return stichtag.year - geburtstag.year - ((stichtag.month, stichtag.day) < (geburtstag.month, geburtstag.day))
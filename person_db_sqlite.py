@@ -0,0 +1,214 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS persons (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    firstname TEXT NOT NULL,
+    lastname TEXT NOT NULL,
+    date_of_birth TEXT NOT NULL,
+    picture_path TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_persons_name ON persons (lastname, firstname);
+
+CREATE TABLE IF NOT EXISTS ekg_tests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    person_id INTEGER NOT NULL REFERENCES persons (id) ON DELETE CASCADE,
+    date TEXT NOT NULL,
+    result_link TEXT NOT NULL DEFAULT '',
+    status TEXT,
+    status_text TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_ekg_tests_person ON ekg_tests (person_id);
+"""
+
+PERSON_SPALTEN = ("firstname", "lastname", "date_of_birth", "picture_path")
+EKG_SPALTEN = ("date", "result_link", "status", "status_text")
+
+# Spalten, die nach dem ersten Schema hinzugekommen sind und in bestehenden Datenbanken nachgetragen werden
+NACHTRAEGLICHE_SPALTEN = {"ekg_tests": ("status TEXT", "status_text TEXT")}
+
+
+class SQLitePersonStore:
+    """Personen und EKG-Metadaten in einer SQLite-Datenbank.
+    Bietet dieselben Methoden wie PersonRepository, schreibt aber einzelne Zeilen statt der ganzen Datei,
+    vergibt IDs per AUTOINCREMENT und erlaubt dank WAL-Modus parallele Leser während eines Schreibvorgangs.
+
+    Die zurückgegebenen Dictionaries haben dasselbe Format wie die Einträge in person_db.json."""
+
+    def __init__(self, pfad="data/person_db.sqlite"):
+        self.pfad = pfad
+        # sqlite3-Verbindungen dürfen nicht zwischen Threads geteilt werden (Streamlit nutzt mehrere)
+        self._lokal = threading.local()
+        with self._verbindung() as con:
+            con.executescript(SCHEMA)
+            self._migrieren(con)
+
+    @staticmethod
+    def _migrieren(con):
+        """Ergänzt fehlende Spalten in Datenbanken, die mit einem älteren Schema angelegt wurden."""
+        for tabelle, spalten in NACHTRAEGLICHE_SPALTEN.items():
+            vorhanden = {zeile["name"] for zeile in con.execute(f"PRAGMA table_info({tabelle})")}
+            for spalte in spalten:
+                if spalte.split()[0] not in vorhanden:
+                    con.execute(f"ALTER TABLE {tabelle} ADD COLUMN {spalte}")
+
+    def _verbindung(self):
+        """Gibt die Verbindung des aktuellen Threads zurück und legt sie bei Bedarf an."""
+        con = getattr(self._lokal, "con", None)
+        if con is None:
+            os.makedirs(os.path.dirname(self.pfad) or ".", exist_ok=True)
+            con = sqlite3.connect(self.pfad, timeout=30)
+            con.row_factory = sqlite3.Row
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA foreign_keys=ON")
+            self._lokal.con = con
+        return con
+
+    @staticmethod
+    def _person_dict(zeile, ekg_zeilen):
+        """Baut aus einer Datenbankzeile ein Personen-Dictionary im JSON-Format."""
+        person = {
+            "id": zeile["id"],
+            "date_of_birth": zeile["date_of_birth"],
+            "firstname": zeile["firstname"],
+            "lastname": zeile["lastname"],
+            "picture_path": zeile["picture_path"]}
+        if ekg_zeilen:
+            person["ekg_tests"] = [SQLitePersonStore._ekg_dict(ekg) for ekg in ekg_zeilen]
+        return person
+
+    @staticmethod
+    def _ekg_dict(zeile):
+        ekg = {"id": zeile["id"], "date": zeile["date"], "result_link": zeile["result_link"]}
+        # Verarbeitungsstatus nur bei hochgeladenen EKGs, wie in person_db.json
+        if zeile["status"] is not None:
+            ekg["status"] = zeile["status"]
+            ekg["status_text"] = zeile["status_text"]
+        return ekg
+
+    def _personen_mit_ekgs(self, where="", parameter=()):
+        """Lädt Personen (gefiltert) samt ihrer EKGs mit zwei Abfragen."""
+        con = self._verbindung()
+        zeilen = con.execute(f"SELECT * FROM persons {where} ORDER BY id", parameter).fetchall()
+        if not zeilen:
+            return []
+        ids = [zeile["id"] for zeile in zeilen]
+        platzhalter = ",".join("?" * len(ids))
+        ekgs = {}
+        for ekg in con.execute(f"SELECT * FROM ekg_tests WHERE person_id IN ({platzhalter}) ORDER BY id", ids):
+            ekgs.setdefault(ekg["person_id"], []).append(ekg)
+        return [self._person_dict(zeile, ekgs.get(zeile["id"])) for zeile in zeilen]
+
+    def personen(self):
+        """Gibt die Liste aller Personen-Dictionaries zurück."""
+        return self._personen_mit_ekgs()
+
+    def namen(self):
+        """Gibt alle Namen im Format "Nachname, Vorname" zurück."""
+        zeilen = self._verbindung().execute("SELECT lastname, firstname FROM persons ORDER BY id")
+        return [zeile["lastname"] + ", " + zeile["firstname"] for zeile in zeilen]
+
+    def person_nach_id(self, person_id):
+        """Gibt die Person mit der ID zurück oder None."""
+        treffer = self._personen_mit_ekgs("WHERE id = ?", (int(person_id),))
+        return treffer[0] if treffer else None
+
+    def person_nach_name(self, name):
+        """Gibt die Person zu "Nachname, Vorname" zurück oder None."""
+        nachname, _, vorname = name.partition(", ")
+        treffer = self._personen_mit_ekgs(
+            "WHERE id = (SELECT MIN(id) FROM persons WHERE lastname = ? AND firstname = ?)", (nachname, vorname))
+        return treffer[0] if treffer else None
+
+    def ekg_nach_id(self, ekg_id):
+        """Gibt das EKG-Dictionary mit der ID zurück oder None."""
+        zeile = self._verbindung().execute("SELECT * FROM ekg_tests WHERE id = ?", (int(ekg_id),)).fetchone()
+        return self._ekg_dict(zeile) if zeile else None
+
+    def person_zu_ekg(self, ekg_id):
+        """Gibt die Person zurück, zu der das EKG gehört, oder None."""
+        treffer = self._personen_mit_ekgs(
+            "WHERE id = (SELECT person_id FROM ekg_tests WHERE id = ?)", (int(ekg_id),))
+        return treffer[0] if treffer else None
+
+    def add_person(self, firstname, lastname, date_of_birth, picture_path=""):
+        """Legt eine Person an und gibt die neue ID zurück."""
+        with self._verbindung() as con:
+            cursor = con.execute(
+                "INSERT INTO persons (firstname, lastname, date_of_birth, picture_path) VALUES (?, ?, ?, ?)",
+                (firstname, lastname, date_of_birth, picture_path))
+        return cursor.lastrowid
+
+    def update_person(self, person_id, **felder):
+        """Ändert einzelne Felder (firstname, lastname, date_of_birth, picture_path) einer Person."""
+        felder = {k: v for k, v in felder.items() if k in PERSON_SPALTEN}
+        if not felder:
+            return
+        zuweisung = ", ".join(f"{k} = ?" for k in felder)
+        with self._verbindung() as con:
+            con.execute(f"UPDATE persons SET {zuweisung} WHERE id = ?", (*felder.values(), int(person_id)))
+
+    def add_ekg_test(self, person_id, date, result_link=None, endung=".txt", **felder):
+        """Legt ein EKG für eine Person an. Ohne result_link wird data/ekg_data/<id><endung> eingetragen;
+        weitere Felder (status, status_text) werden in derselben Transaktion gesetzt.
+
+            Output:
+            EKG-Dictionary mit neuer ID."""
+        felder = {k: v for k, v in felder.items() if k in EKG_SPALTEN and k not in ("date", "result_link")}
+        spalten = ", ".join(("person_id", "date", "result_link", *felder))
+        with self._verbindung() as con:
+            cursor = con.execute(
+                f"INSERT INTO ekg_tests ({spalten}) VALUES ({', '.join('?' * (3 + len(felder)))})",
+                (int(person_id), date, result_link or "", *felder.values()))
+            ekg_id = cursor.lastrowid
+            if result_link is None:
+                result_link = f"data/ekg_data/{ekg_id}{endung}"
+                con.execute("UPDATE ekg_tests SET result_link = ? WHERE id = ?", (result_link, ekg_id))
+        return {"id": ekg_id, "date": date, "result_link": result_link, **felder}
+
+    def update_ekg_test(self, ekg_id, **felder):
+        """Ändert einzelne Felder (date, result_link, status, status_text) eines EKGs."""
+        felder = {k: v for k, v in felder.items() if k in EKG_SPALTEN}
+        if not felder:
+            return
+        zuweisung = ", ".join(f"{k} = ?" for k in felder)
+        with self._verbindung() as con:
+            con.execute(f"UPDATE ekg_tests SET {zuweisung} WHERE id = ?", (*felder.values(), int(ekg_id)))
+
+    def import_json(self, json_pfad="data/person_db.json"):
+        """Übernimmt alle Personen und EKGs aus der JSON-Datenbank mit ihren bisherigen IDs.
+        Vorhandene Zeilen werden aktualisiert statt ersetzt: Ein REPLACE würde die Person löschen und per
+        ON DELETE CASCADE auch alle EKGs, die seit dem letzten Import über SQLite hinzugekommen sind.
+
+            Output:
+            Tupel (Anzahl Personen, Anzahl EKGs)."""
+        with open(json_pfad) as f:
+            personen = json.load(f)
+        anzahl_ekgs = 0
+        with self._verbindung() as con:
+            for eintrag in personen:
+                con.execute(
+                    "INSERT INTO persons (id, firstname, lastname, date_of_birth, picture_path) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET firstname = excluded.firstname, lastname = excluded.lastname, "
+                    "date_of_birth = excluded.date_of_birth, picture_path = excluded.picture_path",
+                    (eintrag["id"], eintrag["firstname"], eintrag["lastname"], eintrag["date_of_birth"], eintrag.get("picture_path", "")))
+                for ekg in eintrag.get("ekg_tests", []):
+                    con.execute(
+                        "INSERT INTO ekg_tests (id, person_id, date, result_link, status, status_text) VALUES (?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (id) DO UPDATE SET person_id = excluded.person_id, date = excluded.date, "
+                        "result_link = excluded.result_link, status = excluded.status, status_text = excluded.status_text",
+                        (ekg["id"], eintrag["id"], ekg["date"], ekg["result_link"], ekg.get("status"), ekg.get("status_text")))
+                    anzahl_ekgs += 1
+        return len(personen), anzahl_ekgs
+
+
+if __name__ == "__main__":
+    # Einmaliger Import: python person_db_sqlite.py [json_pfad] [sqlite_pfad]
+    json_pfad = sys.argv[1] if len(sys.argv) > 1 else "data/person_db.json"
+    sqlite_pfad = sys.argv[2] if len(sys.argv) > 2 else "data/person_db.sqlite"
+    anzahl_personen, anzahl_ekgs = SQLitePersonStore(sqlite_pfad).import_json(json_pfad)
+    print(f"{anzahl_personen} Personen und {anzahl_ekgs} EKGs nach {sqlite_pfad} importiert.")
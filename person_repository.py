@@ -0,0 +1,156 @@
+import os
+import copy
+import json
+import threading
+
+from messung import messungen
+
+
+class PersonRepository:
+    """Hält die Personendatenbank im Speicher und sucht über Hash-Indizes statt über lineare Suchen.
+    Die JSON-Datei wird nur neu gelesen, wenn sich Änderungszeit oder Größe geändert haben.
+
+    Die zurückgegebenen Dictionaries werden geteilt und dürfen nicht verändert werden;
+    zum Bearbeiten liefert read_data.load_person_data eine eigene Kopie.
+    Schreibende Methoden lesen die Datei frisch ein, ändern sie und ersetzen sie atomar."""
+
+    def __init__(self, pfad="data/person_db.json"):
+        self.pfad = pfad
+        self._signatur = None
+        self._personen = []
+        self._nach_id = {}
+        self._nach_name = {}
+        self._ekg_nach_id = {}
+        self._person_zu_ekg = {}
+        self._schreib_lock = threading.Lock()
+
+    def _aktualisieren(self):
+        """Lädt die Datei neu, falls sie sich seit dem letzten Lesen geändert hat."""
+        stat = os.stat(self.pfad)
+        signatur = (stat.st_mtime_ns, stat.st_size)
+        if signatur == self._signatur:
+            return
+        with messungen.messe("PersonRepository.json_lesen"), open(self.pfad) as f:
+            personen = json.load(f)
+        messungen.zaehle("personen_db.gelesen")
+
+        nach_id, nach_name, ekg_nach_id, person_zu_ekg = {}, {}, {}, {}
+        for eintrag in personen:
+            nach_id.setdefault(eintrag.get("id"), eintrag)
+            # Bei doppelten Namen gewinnt wie bei der linearen Suche der erste Eintrag
+            nach_name.setdefault(eintrag["lastname"] + ", " + eintrag["firstname"], eintrag)
+            for ekg in eintrag.get("ekg_tests", []):
+                ekg_nach_id.setdefault(ekg.get("id"), ekg)
+                person_zu_ekg.setdefault(ekg.get("id"), eintrag)
+
+        self._personen = personen
+        self._nach_id = nach_id
+        self._nach_name = nach_name
+        self._ekg_nach_id = ekg_nach_id
+        self._person_zu_ekg = person_zu_ekg
+        self._signatur = signatur
+
+    def personen(self):
+        """Gibt die Liste aller Personen-Dictionaries zurück."""
+        self._aktualisieren()
+        return self._personen
+
+    def namen(self):
+        """Gibt alle Namen im Format "Nachname, Vorname" in der Reihenfolge der Datenbank zurück."""
+        self._aktualisieren()
+        return [eintrag["lastname"] + ", " + eintrag["firstname"] for eintrag in self._personen]
+
+    def person_nach_id(self, person_id):
+        """Gibt die Person mit der ID zurück oder None."""
+        self._aktualisieren()
+        return self._nach_id.get(int(person_id))
+
+    def person_nach_name(self, name):
+        """Gibt die Person zu "Nachname, Vorname" zurück oder None."""
+        self._aktualisieren()
+        return self._nach_name.get(name)
+
+    def ekg_nach_id(self, ekg_id):
+        """Gibt das EKG-Dictionary mit der ID zurück oder None."""
+        self._aktualisieren()
+        return self._ekg_nach_id.get(int(ekg_id))
+
+    def person_zu_ekg(self, ekg_id):
+        """Gibt die Person zurück, zu der das EKG gehört, oder None."""
+        self._aktualisieren()
+        return self._person_zu_ekg.get(int(ekg_id))
+
+    def _aendern(self, aenderung):
+        """Liest die aktuelle Datei, wendet die Änderung auf eine Kopie an und schreibt sie zurück.
+
+            Input:
+            aenderung: Funktion, die die Personenliste verändert und ein Ergebnis zurückgibt.
+
+            Output:
+            Ergebnis der Änderungsfunktion."""
+        with self._schreib_lock:
+            personen = copy.deepcopy(self.personen())
+            ergebnis = aenderung(personen)
+            tmp = f"{self.pfad}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(personen, f, indent=4)
+            os.replace(tmp, self.pfad)
+        return ergebnis
+
+    @staticmethod
+    def _finde(personen, person_id):
+        for eintrag in personen:
+            if eintrag.get("id") == int(person_id):
+                return eintrag
+        raise KeyError(f"Person mit ID {person_id} nicht gefunden")
+
+    def add_person(self, firstname, lastname, date_of_birth, picture_path=""):
+        """Legt eine Person an und gibt die neue ID zurück."""
+        def aenderung(personen):
+            neue_id = max((p.get("id", 0) for p in personen), default=0) + 1
+            personen.append({
+                "id": neue_id,
+                "firstname": firstname,
+                "lastname": lastname,
+                "date_of_birth": date_of_birth,
+                "picture_path": picture_path})
+            return neue_id
+        return self._aendern(aenderung)
+
+    def update_person(self, person_id, **felder):
+        """Ändert einzelne Felder (firstname, lastname, date_of_birth, picture_path) einer Person."""
+        def aenderung(personen):
+            self._finde(personen, person_id).update(felder)
+        self._aendern(aenderung)
+
+    def add_ekg_test(self, person_id, date, result_link=None, endung=".txt", **felder):
+        """Legt ein EKG für eine Person an. Ohne result_link wird data/ekg_data/<id><endung> eingetragen;
+        weitere Felder (z.B. status, status_text) werden im selben Schreibvorgang gesetzt.
+
+            Output:
+            EKG-Dictionary mit neuer ID."""
+        def aenderung(personen):
+            neue_id = max((e.get("id", 0) for p in personen for e in p.get("ekg_tests", [])), default=0) + 1
+            ekg = {
+                "id": neue_id,
+                "date": date,
+                "result_link": result_link or f"data/ekg_data/{neue_id}{endung}",
+                **felder}
+            self._finde(personen, person_id).setdefault("ekg_tests", []).append(ekg)
+            return dict(ekg)
+        return self._aendern(aenderung)
+
+    def update_ekg_test(self, ekg_id, **felder):
+        """Ändert einzelne Felder eines EKGs."""
+        def aenderung(personen):
+            for eintrag in personen:
+                for ekg in eintrag.get("ekg_tests", []):
+                    if ekg.get("id") == int(ekg_id):
+                        ekg.update(felder)
+                        return
+            raise KeyError(f"EKG mit ID {ekg_id} nicht gefunden")
+        self._aendern(aenderung)
+
+
+# Gemeinsame Instanz für die ganze App; bleibt über Streamlit-Reruns im Speicher
+repository = PersonRepository()
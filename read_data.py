@@ -1,37 +1,106 @@
-import json
+import copy
+import os
 
+from person_repository import repository
+from messung import gemessen
+
+# Speicher der Personendaten: "json" (data/person_db.json, Standard) oder "sqlite" (data/person_db.sqlite)
+PERSON_DB_BACKEND = os.environ.get("PERSON_DB_BACKEND", "json")
+_sqlite_store = None
+
+def get_backend():
+    """Gibt den eingestellten Speicher zurück (PersonRepository oder SQLitePersonStore).
+    Beide bieten dieselben Lese- und Schreibmethoden."""
+    global _sqlite_store
+    if PERSON_DB_BACKEND != "sqlite":
+        return repository
+    if _sqlite_store is None:
+        from person_db_sqlite import SQLitePersonStore
+        _sqlite_store = SQLitePersonStore()
+    return _sqlite_store
+
+@gemessen("read_data.load_person_data")
 def load_person_data():
     """Lädt Personendaten aus der JSON-Datei 'data/person_db.json' und gibt sie als Python-Objekt zurück.
+    Die Datei wird nur bei Änderungen neu gelesen; zurückgegeben wird eine Kopie, die verändert werden darf.
+    Mit PERSON_DB_BACKEND=sqlite kommen die Daten im selben Format aus der SQLite-Datenbank.
 
     Returns:
         dict: Die geladenen Personendaten aus der JSON-Datei."""
-    file = open("data/person_db.json")
-    person_data = json.load(file)
-    return person_data
+    return copy.deepcopy(get_backend().personen())
+
+@gemessen("read_data.personen_ansicht")
+def personen_ansicht():
+    """Gibt die Personendaten ohne Kopie zurück, für Aufrufer, die nur lesen (z.B. über alle EKGs iterieren).
+    Die Einträge werden mit dem Repository geteilt und dürfen nicht verändert werden; wer sie ändern will,
+    nimmt load_person_data."""
+    return get_backend().personen()
 
-def get_person_list(person_data):
+@gemessen("read_data.personen_namen")
+def personen_namen():
+    """Gibt ein Dictionary ID -> "Nachname, Vorname" aller Personen zurück."""
+    return {eintrag["id"]: eintrag["lastname"] + ", " + eintrag["firstname"] for eintrag in get_backend().personen()}
+
+@gemessen("read_data.get_person_list")
+def get_person_list(person_data=None):
+
+    """Eine Funktion die das dict mit den geladenen Personendaten nimmt und es als Namensliste wiedergibt.
+    Ohne Argument wird die Namensliste direkt aus dem Repository genommen."""
+    if person_data is None:
+        return get_backend().namen()
 
-    """Eine Funktion die das dict mit den geladenen Personendaten nimmt und es als Namensliste wiedergibt"""
     list_of_names = []
 
     for eintrag in person_data:
         list_of_names.append(eintrag["lastname"] + ", " +  eintrag["firstname"])
     return list_of_names
 
+@gemessen("read_data.find_person_data_by_name")
 def find_person_data_by_name(suchstring):
     """ Eine Funktion der Nachname, Vorname als ein String übergeben wird
     und die die Person als Dictionary zurück gibt"""
 
-    person_data = load_person_data()
     if suchstring == "None":
         return {}
 
-    two_names = suchstring.split(", ")
-    vorname = two_names[1]
-    nachname = two_names[0]
+    eintrag = get_backend().person_nach_name(suchstring)
+    return eintrag if eintrag is not None else {}
 
-    for eintrag in person_data:
-        if (eintrag["lastname"] == nachname and eintrag["firstname"] == vorname):
-            return eintrag
-    else:
-        return {}
\ No newline at end of file
+@gemessen("read_data.find_person_data_by_id")
+def find_person_data_by_id(person_id):
+    """Gibt die Person mit der übergebenen ID als Dictionary zurück (leer, falls nicht vorhanden)."""
+    eintrag = get_backend().person_nach_id(person_id)
+    return eintrag if eintrag is not None else {}
+
+@gemessen("read_data.find_person_data_by_ekg_id")
+def find_person_data_by_ekg_id(ekg_id):
+    """Gibt die Person zurück, zu der das EKG gehört (leer, falls nicht vorhanden)."""
+    eintrag = get_backend().person_zu_ekg(ekg_id)
+    return eintrag if eintrag is not None else {}
+
+@gemessen("read_data.find_ekg_data_by_id")
+def find_ekg_data_by_id(ekg_id):
+    """Gibt das EKG-Dictionary mit der übergebenen ID zurück oder None."""
+    return get_backend().ekg_nach_id(ekg_id)
+
+@gemessen("read_data.add_person")
+def add_person(firstname, lastname, date_of_birth, picture_path=""):
+    """Legt eine neue Versuchsperson an und gibt ihre ID zurück."""
+    return get_backend().add_person(firstname, lastname, date_of_birth, picture_path)
+
+@gemessen("read_data.update_person")
+def update_person(person_id, **felder):
+    """Ändert einzelne Felder einer Versuchsperson, z.B. update_person(1, firstname="Anna")."""
+    get_backend().update_person(person_id, **felder)
+
+@gemessen("read_data.add_ekg_test")
+def add_ekg_test(person_id, date, result_link=None, endung=".txt", **felder):
+    """Legt ein EKG für eine Versuchsperson an und gibt den neuen Eintrag zurück.
+    Ohne result_link wird der Pfad data/ekg_data/<id><endung> eingetragen; weitere Felder
+    (z.B. status="wartend") werden gleich mitgeschrieben."""
+    return get_backend().add_ekg_test(person_id, date, result_link, endung, **felder)
+
+@gemessen("read_data.update_ekg_test")
+def update_ekg_test(ekg_id, **felder):
+    """Ändert einzelne Felder eines EKG-Eintrags."""
+    get_backend().update_ekg_test(ekg_id, **felder)
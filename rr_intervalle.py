@@ -0,0 +1,63 @@
+import numpy as np
+
+
+class RRIntervalle:
+    """RR-Intervalle einer Peak-Menge als NumPy-Arrays.
+    Alle Kennzahlen (BPM, mittlere HR, RMSSD, Anomalien) werden einmal vektorisiert berechnet,
+    statt pro Schlag über .iloc auf die Zeitspalte zuzugreifen."""
+
+    def __init__(self, peaks, zeit_in_ms):
+        """Input:
+            peaks: Indizes der Peaks.
+            zeit_in_ms: Zeitpunkte der Messungen (Series oder Array)."""
+        self.peaks = np.asarray(peaks)
+        zeit = np.asarray(zeit_in_ms)
+        # int64, damit Differenzen und Summen bei kompakt gespeicherter Zeitspalte nicht überlaufen
+        self.peak_zeiten = zeit[self.peaks].astype(np.int64)
+        self.intervalle = np.diff(self.peak_zeiten)
+
+        # Nur positive Intervalle ergeben eine Herzfrequenz (Zeitsprünge werden übersprungen)
+        self.gueltig = self.intervalle > 0
+        self.bpm = 60000 / self.intervalle[self.gueltig]
+        self.bpm_zeiten = self.peak_zeiten[:-1][self.gueltig]
+
+    @property
+    def mittlere_hr(self):
+        """Durchschnittliche Herzfrequenz in bpm (0, falls keine gültigen Intervalle)."""
+        return float(self.bpm.mean()) if len(self.bpm) else 0
+
+    @property
+    def rmssd(self):
+        """RMSSD in ms über alle aufeinanderfolgenden RR-Intervalle."""
+        return np.sqrt(np.mean(np.square(np.diff(self.intervalle))))
+
+    @property
+    def qualitaet(self):
+        """Signalqualität als Anteil plausibler RR-Intervalle (300-2000 ms und höchstens 30 % Änderung
+        zum vorherigen Intervall). Fehlende oder doppelt erkannte Schläge senken den Wert."""
+        if len(self.intervalle) < 2:
+            return 0.0
+        rr = self.intervalle
+        plausibel = (rr >= 300) & (rr <= 2000)
+        stetig = np.ones(len(rr), dtype=bool)
+        stetig[1:] = np.abs(np.diff(rr)) <= 0.3 * np.abs(rr[:-1])
+        return float(np.mean(plausibel & stetig))
+
+    def anomalie_maske(self, alter, min_hr=40):
+        """Boolesche Maske über self.bpm für Herzfrequenzen außerhalb von [min_hr, 220 - alter].
+
+            Input:
+            alter: Alter der Person für max Herzfrequenzberechnung.
+            min_hr: Minimale Herzfrequenz.
+
+            Output:
+            Boolesches Array mit derselben Länge wie self.bpm."""
+        max_hr = 220 - alter
+        return (self.bpm < min_hr) | (self.bpm > max_hr)
+
+    def anomalien(self, alter, min_hr=40):
+        """Gibt die Anomalien als Liste von (Zeitpunkt, bpm) zurück.
+        Der Zeitpunkt ist die Mitte zwischen den beiden Peaks des auffälligen Intervalls."""
+        maske = self.anomalie_maske(alter, min_hr)
+        mitte = (self.peak_zeiten[:-1] + self.peak_zeiten[1:])[self.gueltig] / 2
+        return list(zip(mitte[maske].tolist(), self.bpm[maske].tolist()))
@@ -0,0 +1,88 @@
+import os
+
+from PIL import Image, ImageOps
+
+from ekg_cache import datei_hash
+from messung import gemessen, messungen
+
+# Verzeichnis der Vorschaubilder; der Dateiname ist der Hash des Originals, gleiche Bilder teilen sich eine Vorschau
+VORSCHAU_DIR = os.path.join("data", "cache", "bilder")
+
+# Längste Kante der Vorschau in Pixeln und JPEG-Qualität
+MAX_KANTE = 400
+JPEG_QUALITAET = 85
+
+# Größte Pixelzahl eines Originals (50 MP, genug für Kamerafotos). Größere Bilder bekommen keine Vorschau,
+# statt beim Dekodieren den Speicher zu füllen; PIL bricht selbst ab dem Doppelten mit DecompressionBombError ab
+MAX_PIXEL = 50_000_000
+Image.MAX_IMAGE_PIXELS = MAX_PIXEL
+
+# (Pfad, mtime, Größe, Kante) -> Vorschaudatei, damit das Original nicht bei jedem Aufruf gehasht wird
+_bekannt = {}
+
+
+def _vorschau_datei(inhalts_hash, max_kante, cache_dir):
+    # Unterverzeichnis nach den ersten zwei Zeichen, damit kein Verzeichnis zu groß wird
+    return os.path.join(cache_dir, inhalts_hash[:2], f"{inhalts_hash}_{max_kante}.jpg")
+
+
+@gemessen("vorschaubilder.erzeuge_vorschau")
+def erzeuge_vorschau(pfad, max_kante=MAX_KANTE, cache_dir=VORSCHAU_DIR):
+    """Legt die Vorschau eines Bildes im Cache ab (falls noch nicht vorhanden) und gibt ihren Pfad zurück.
+    Das Bild wird gedreht wie in den EXIF-Daten angegeben und so verkleinert, dass die längste Kante
+    höchstens max_kante Pixel hat; JPEGs werden dafür schon verkleinert dekodiert.
+
+        Input:
+        pfad (str): Pfad zum Originalbild.
+        max_kante (int, optional): Längste Kante der Vorschau in Pixeln.
+        cache_dir (str, optional): Verzeichnis der Vorschaubilder.
+
+        Output:
+        Pfad der Vorschau oder None, wenn das Bild nicht gelesen werden kann oder mehr als MAX_PIXEL Pixel hat."""
+    try:
+        stat = os.stat(pfad)
+    except OSError:
+        return None
+    schluessel = (os.path.abspath(pfad), stat.st_mtime_ns, stat.st_size, max_kante, cache_dir)
+    ziel = _bekannt.get(schluessel)
+    if ziel is not None and os.path.exists(ziel):
+        return ziel
+
+    ziel = _vorschau_datei(datei_hash(pfad), max_kante, cache_dir)
+    if os.path.exists(ziel):
+        messungen.zaehle("vorschau_cache_treffer")
+    else:
+        try:
+            with Image.open(pfad) as bild:
+                if bild.width * bild.height > MAX_PIXEL:
+                    return None
+                bild.draft("RGB", (max_kante, max_kante))
+                vorschau = ImageOps.exif_transpose(bild).convert("RGB")
+            vorschau.thumbnail((max_kante, max_kante), Image.LANCZOS)
+            os.makedirs(os.path.dirname(ziel), exist_ok=True)
+            tmp = f"{ziel}.{os.getpid()}.tmp"
+            vorschau.save(tmp, format="JPEG", quality=JPEG_QUALITAET, optimize=True)
+            os.replace(tmp, ziel)
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+            # Kein lesbares Bild (PIL meldet das je nach Format als OSError, SyntaxError oder ValueError),
+            # zu großes Bild oder Cache nicht beschreibbar
+            return None
+        messungen.zaehle("vorschau_erzeugt")
+    _bekannt[schluessel] = ziel
+    return ziel
+
+
+def lade_vorschau(pfad, max_kante=MAX_KANTE, cache_dir=VORSCHAU_DIR):
+    """Gibt die Vorschau eines Bildes als JPEG-Bytes zurück, zum Anzeigen mit st.image.
+
+        Input:
+        pfad (str): Pfad zum Originalbild.
+        max_kante (int, optional): Längste Kante der Vorschau in Pixeln.
+
+        Output:
+        JPEG-Bytes oder None, wenn das Bild nicht gelesen werden kann."""
+    ziel = erzeuge_vorschau(pfad, max_kante, cache_dir)
+    if ziel is None:
+        return None
+    with open(ziel, "rb") as f:
+        return f.read()